@@ -0,0 +1,184 @@
+"""cache.py
+    * プロセス内で共有するキャッシュ
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """LRUCache
+        * 上限件数を超えると、最も長く参照されていない要素から削除するキャッシュ
+        * 複数スレッドから参照できるようにロックで保護する
+
+    Attributes:
+        max_size(int): 保持する最大件数
+        hits(int): キャッシュヒット数
+        misses(int): キャッシュミス数
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """get
+            * キーに対応する値を返す
+
+        Args:
+            key(obj): キー
+            default(obj): キーが存在しない場合の値
+
+        Returns:
+            obj: キャッシュされた値
+        """
+        with self.__lock:
+            if key not in self.__items:
+                self.misses += 1
+                return default
+
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return self.__items[key]
+
+    def put(self, key, value):
+        """put
+            * 値をキャッシュする
+
+        Args:
+            key(obj): キー
+            value(obj): 値
+        """
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """pop
+            * キーに対応する値をキャッシュから削除する
+
+        Args:
+            key(obj): キー
+            default(obj): キーが存在しない場合の値
+
+        Returns:
+            obj: 削除された値
+        """
+        with self.__lock:
+            return self.__items.pop(key, default)
+
+    def clear(self):
+        """clear
+            * キャッシュを全て削除する
+        """
+        with self.__lock:
+            self.__items.clear()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        return key in self.__items
+
+
+class TTLCache:
+    """TTLCache
+        * 登録から ttl 秒経過した要素を削除するキャッシュ
+        * 上限件数を超えた場合は、最も古く登録された要素から削除する
+
+    Attributes:
+        max_size(int): 保持する最大件数
+        ttl(float): 保持する秒数
+        hits(int): 登録済みのキーを参照した回数
+        misses(int): 未登録 (期限切れを含む) のキーを参照した回数
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def add(self, key, value=True):
+        """add
+            * キーが未登録の場合のみ値を登録する (確認と登録を1度に行う)
+
+        Args:
+            key(obj): キー
+            value(obj): 値
+
+        Returns:
+            bool: 登録した場合は True (登録済みの場合は False)
+        """
+        with self.__lock:
+            self.expire(time.monotonic())
+            if key in self.__items:
+                self.hits += 1
+                return False
+
+            self.misses += 1
+            self.__items[key] = (time.monotonic() + self.ttl, value)
+            while len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
+            return True
+
+    def get(self, key, default=None):
+        """get
+            * キーに対応する値を返す
+
+        Args:
+            key(obj): キー
+            default(obj): キーが存在しない場合の値
+
+        Returns:
+            obj: キャッシュされた値
+        """
+        with self.__lock:
+            self.expire(time.monotonic())
+            if key not in self.__items:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return self.__items[key][1]
+
+    def pop(self, key, default=None):
+        """pop
+            * キーに対応する値をキャッシュから削除する
+
+        Args:
+            key(obj): キー
+            default(obj): キーが存在しない場合の値
+
+        Returns:
+            obj: 削除された値
+        """
+        with self.__lock:
+            item = self.__items.pop(key, None)
+            return default if item is None else item[1]
+
+    def expire(self, now):
+        # 登録順 = 期限順のため、先頭から期限切れの要素を削除する
+        while len(self.__items) != 0:
+            key, (expires, value) = next(iter(self.__items.items()))
+            if expires > now:
+                break
+            del self.__items[key]
+
+    def clear(self):
+        """clear
+            * キャッシュを全て削除する
+        """
+        with self.__lock:
+            self.__items.clear()
+
+    def __len__(self):
+        return len(self.__items)
@@ -1,9 +1,9 @@
 """callback.py
     * LINEからのwebhookを処理する
 """
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot import (
-    LineBotApi, WebhookHandler
+    WebhookHandler
 )
 from linebot.exceptions import (
     InvalidSignatureError
@@ -17,11 +17,18 @@ from handler import (
 from observer import (
     UserObserver, StatusObserver, ProductObserver, MessageObserver
 )
+from search import search_engine
+from ranking import recipe_ranker
+from snapshot import RecipeSnapshot
+from worker import EventWorkerPool
+from line_client import line_bot_api
+from status_cache import status_cache
+from dedup import webhook_dedup, annotate
+from instrument import sql_instrument
 from setting import *
 import os
 
 app = Flask(__name__)
-line_bot_api = LineBotApi(BOT.YOUR_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(BOT.YOUR_CHANNEL_SECRET)
 
 
@@ -39,13 +46,64 @@ def callback():
 
     # handle webhook body
     try:
-        handler.handle(body, signature)
+        events = handler.parser.parse(body, signature)
     except InvalidSignatureError:
         abort(400)
 
+    # 再送の判定に使う webhookEventId を設定する
+    annotate(events, body)
+
+    # ユーザごとのレーンに登録 (同じユーザのイベントは受信順に、異なるユーザは並行に処理する)
+    batch = event_pool.submit_all(events)
+
+    # 同期モード : 全てのイベントを処理してから応答する
+    # 非同期モード : 登録後すぐに応答する
+    if Webhook.MODE != 'async':
+        batch.wait()
+
     return 'OK'
 
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """metrics
+        * イベント処理の状態を返す
+    """
+    return jsonify({
+        'webhook': event_pool.stats(),
+        'line_api': line_bot_api.http_client.stats.snapshot(),
+        'status_cache': status_cache.stats(),
+        'dedup': webhook_dedup.stats(),
+        'sql': sql_instrument.stats(),
+    })
+
+
+def dispatch(event):
+    """dispatch
+        * イベントの種類に対応する処理を呼び出す (ワーカースレッドから呼び出される)
+
+    Args:
+        event(obj): webhookのイベント
+    """
+    event_handler = EVENT_HANDLERS.get(type(event))
+    if event_handler is None:
+        return
+
+    # イベント1件の SQL 数を計測する (SQL_INSTRUMENT=on の場合)
+    with sql_instrument.event_scope(type(event).__name__):
+        # 処理済みのイベント (LINE からの再送) は処理しない
+        key = webhook_dedup.claim(event)
+        if key is None:
+            return
+
+        try:
+            event_handler(event)
+        except Exception:
+            # 処理に失敗したイベントは、再送時に処理し直す
+            webhook_dedup.release(key)
+            raise
+
+
 @handler.add(MessageEvent)
 def handle_message(event):
     """handle_message
@@ -101,7 +159,39 @@ def follow(event):
     event_handler.execute()
 
 
+# イベントの種類と処理の対応
+EVENT_HANDLERS = {
+    MessageEvent: handle_message,
+    PostbackEvent: handle_postback,
+    FollowEvent: follow,
+    UnfollowEvent: follow,
+}
+
+event_pool = EventWorkerPool(dispatch, Webhook.WORKERS, Webhook.QUEUE_SIZE, Webhook.ENQUEUE_TIMEOUT)
+
+
+def prepare():
+    """prepare
+        * 転置インデックスとレシピの人気度を事前に読み込む (起動時に1度だけ呼び出す)
+    """
+    if Snapshot.PATH:
+        try:
+            snapshot = RecipeSnapshot(Snapshot.PATH)
+        except ValueError as e:
+            # 形式の古いスナップショットは使わず、DB から読み込む (snapshot.py export で作り直す)
+            print(e.args)
+        else:
+            search_engine.load_snapshot(snapshot)
+            recipe_ranker.load_snapshot(snapshot)
+            return
+
+    search_engine.load()
+    recipe_ranker.load()
+
+
 if __name__ == "__main__":
     #    app.run()
+    # 転置インデックスの事前読み込み
+    prepare()
     port = int(os.getenv("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
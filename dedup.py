@@ -0,0 +1,195 @@
+"""dedup.py
+    * 処理済みの webhook イベントを記録し、LINE から再送されたイベントを処理しない
+    * イベントは webhookEventId (無い場合は replyToken / 種類・ユーザ・時刻) で識別する
+    * memory : プロセス内の TTLCache で判定する
+    * table : TTLCache に加えて webhook_eventテーブルに登録し、複数のプロセス / サーバで判定を共有する
+"""
+
+from setting import *
+from cache import TTLCache
+from sqlalchemy.exc import IntegrityError
+import json
+import threading
+import time
+
+# INSERT INTO webhook_event (event_key, received_at) VALUES (?, ?) ;
+INSERT_EVENT = WebhookEvent.__table__.insert()
+
+
+def annotate(events, body):
+    """annotate
+        * 解析済みのイベントに webhookEventId と再送フラグを設定する
+        * line-bot-sdk のモデルはこれらの項目を保持しないため、リクエストの body から取り出す
+
+    Args:
+        events(list): handler.parser.parse() で解析したイベント
+        body(str): webhook のリクエスト body
+    """
+    # parse() は未対応の種類のイベント (unsend / videoPlayComplete など) を読み飛ばすため、
+    # 順番に並べるだけでは対応がずれる。種類と時刻が一致する body のイベントを先頭から探して対応付ける
+    events_json = iter(json.loads(body).get('events', []))
+    for event in events:
+        event.webhook_event_id = None
+        event.is_redelivery = False
+
+        for event_json in events_json:
+            if event_json.get('type') == event.type and event_json.get('timestamp') == event.timestamp:
+                event.webhook_event_id = event_json.get('webhookEventId')
+                event.is_redelivery = (event_json.get('deliveryContext') or {}).get('isRedelivery', False)
+                break
+
+
+def event_key(event):
+    """event_key
+        * イベントを識別するキーを返す
+
+    Args:
+        event(obj): webhookのイベント
+
+    Returns:
+        str: webhookEventId / replyToken / 種類:ユーザID:時刻
+    """
+    webhook_event_id = getattr(event, 'webhook_event_id', None)
+    if webhook_event_id:
+        return webhook_event_id
+
+    reply_token = getattr(event, 'reply_token', None)
+    if reply_token:
+        return 'reply:' + reply_token
+
+    return '%s:%s:%s' % (event.type, getattr(event.source, 'user_id', ''), event.timestamp)
+
+
+class WebhookDedup:
+    """WebhookDedup
+        * 処理済みの webhook イベントの記録
+
+    Attributes:
+        mode(str): 'off' / 'memory' / 'table'
+        ttl(float): 処理済みのイベントを保持する秒数
+    """
+
+    def __init__(self, mode, size, ttl):
+        self.mode = mode
+        self.ttl = ttl
+        self.__events = TTLCache(size, ttl)
+        self.__lock = threading.Lock()
+        self.__purged = time.monotonic()
+        self.__counts = {'checked': 0, 'duplicates': 0, 'redeliveries': 0, 'released': 0, 'table_duplicates': 0}
+
+    def claim(self, event):
+        """claim
+            * 未処理のイベントを処理済みとして記録する
+
+        Args:
+            event(obj): webhookのイベント
+
+        Returns:
+            str: 記録したキー (処理済みのイベントの場合は None)
+        """
+        if self.mode == 'off':
+            return ''
+
+        key = event_key(event)
+        self.count('checked')
+        if getattr(event, 'is_redelivery', False):
+            self.count('redeliveries')
+
+        if not self.__events.add(key):
+            self.count('duplicates')
+            return None
+
+        if self.mode == 'table' and not self.insert(key):
+            self.count('duplicates')
+            self.count('table_duplicates')
+            return None
+
+        return key
+
+    def release(self, key):
+        """release
+            * 処理に失敗したイベントの記録を削除する (再送時に処理し直す)
+
+        Args:
+            key(str): claim() で記録したキー
+        """
+        if self.mode == 'off':
+            return
+
+        self.__events.pop(key)
+        self.count('released')
+
+        if self.mode == 'table':
+            try:
+                # DELETE FROM webhook_event WHERE event_key = ? ;
+                session.query(WebhookEvent). \
+                    filter(WebhookEvent.event_key == key). \
+                    delete(synchronize_session=False)
+                session.commit()
+            except Exception as e:
+                print(e.args)
+                session.rollback()
+
+    def insert(self, key):
+        """insert
+            * webhook_eventテーブルにキーを登録する (イベントの処理とは別のトランザクションで確定する)
+            * 一定間隔で期限切れのキーを削除する
+
+        Args:
+            key(str): イベントのキー
+
+        Returns:
+            bool: 登録した場合は True (他のプロセスで登録済みの場合は False)
+        """
+        now = int(time.time())
+        with self.__lock:
+            purge = time.monotonic() - self.__purged > Dedup.PURGE_INTERVAL
+            if purge:
+                self.__purged = time.monotonic()
+
+        try:
+            session.execute(INSERT_EVENT, {'event_key': key, 'received_at': now})
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return False
+        except Exception as e:
+            # テーブルに登録できない場合は、プロセス内の判定のみで処理を続ける
+            print(e.args)
+            session.rollback()
+            return True
+
+        if purge:
+            try:
+                # DELETE FROM webhook_event WHERE received_at < ? ;
+                session.query(WebhookEvent). \
+                    filter(WebhookEvent.received_at < now - self.ttl). \
+                    delete(synchronize_session=False)
+                session.commit()
+            except Exception as e:
+                print(e.args)
+                session.rollback()
+
+        return True
+
+    def count(self, name):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    def stats(self):
+        """stats
+            * 判定件数と再送の割合を返す
+
+        Returns:
+            dict: 件数
+        """
+        with self.__lock:
+            stats = dict(self.__counts)
+
+        stats['mode'] = self.mode
+        stats['entries'] = len(self.__events)
+        stats['hit_rate'] = round(stats['duplicates'] / stats['checked'], 4) if stats['checked'] != 0 else 0.0
+        return stats
+
+
+webhook_dedup = WebhookDedup(Dedup.MODE, CacheSize.WEBHOOK_EVENT, Dedup.TTL)
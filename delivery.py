@@ -0,0 +1,245 @@
+"""delivery.py
+    * 賞味期限通知 (push.py) を並行に送信する
+    * 送信スレッド数を制限し、LINE の秒間リクエスト数の上限をトークンバケットで守る
+    * 同じ内容の通知は multicast で最大500人ずつまとめて送信する
+    * 429 / 5xx は X-Line-Retry-Key を付けてバックオフしながら再試行する (line_client.py)
+"""
+
+from setting import *
+from line_client import PooledHttpClient
+from linebot import (
+    LineBotApi
+)
+from linebot.exceptions import (
+    LineBotApiError
+)
+from linebot.models import (
+    TextSendMessage
+)
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import functools
+import threading
+import time
+
+# 送信結果の件数
+REPORT_COUNTS = ('delivered', 'failed', 'push', 'multicast', 'multicast_recipients', 'already_accepted',
+                 'retries', 'throttled_ms')
+
+
+class TokenBucket:
+    """TokenBucket
+        * 秒間 rate 回までに送信を制限する
+
+    Attributes:
+        rate(float): 1秒あたりに補充するトークン数
+        capacity(float): 保持できるトークン数 (連続して送信できる回数)
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """acquire
+            * トークンを1つ取得する (無い場合は補充されるまで待つ)
+
+        Returns:
+            float: 待機した秒数
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return waited
+
+                wait = (1 - self.__tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class DeliveryReport:
+    """DeliveryReport
+        * 1回の送信の結果
+
+    Attributes:
+        counts(dict): 送信件数
+        failed_users(list): 送信に失敗したユーザID (FAILED_SAMPLES 件まで)
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.failed_users = []
+        self.errors = collections.Counter()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.__lock = threading.Lock()
+
+    def delivered(self, kind, user_ids, waited, accepted=False):
+        with self.__lock:
+            self.counts[kind] += 1
+            self.counts['delivered'] += len(user_ids)
+            self.counts['throttled_ms'] += int(waited * 1000)
+            if kind == 'multicast':
+                self.counts['multicast_recipients'] += len(user_ids)
+            if accepted:
+                self.counts['already_accepted'] += 1
+
+    def failed(self, kind, user_ids, error):
+        with self.__lock:
+            self.counts[kind] += 1
+            self.counts['failed'] += len(user_ids)
+            self.errors[error] += 1
+            self.failed_users.extend(user_ids[:Delivery.FAILED_SAMPLES - len(self.failed_users)])
+
+    def record_error(self, error):
+        with self.__lock:
+            self.errors[error] += 1
+
+    def finish(self, retries):
+        with self.__lock:
+            self.elapsed = time.perf_counter() - self.started
+            self.counts['retries'] += retries
+
+    def as_dict(self):
+        """as_dict
+            * 結果を dict で返す
+
+        Returns:
+            dict: 送信件数・失敗したユーザ・処理時間
+        """
+        counts = {name: self.counts[name] for name in REPORT_COUNTS}
+        users = counts['delivered'] + counts['failed']
+        return dict(counts, users=users, errors=dict(self.errors), failed_users=list(self.failed_users),
+                    elapsed_sec=round(self.elapsed, 2),
+                    users_per_sec=round(users / self.elapsed, 1) if self.elapsed > 0 else 0.0)
+
+
+class DeliveryEngine:
+    """DeliveryEngine
+        * 通知を並行に送信する
+
+    Attributes:
+        api(:obj:LineBotApi): 送信に使用するクライアント
+        senders(int): 同時に送信するスレッド数
+        multicast_size(int): multicast 1回の送信先の上限
+        group_window(int): 同じ内容の通知をまとめるために保持するユーザ数
+    """
+
+    def __init__(self, api, senders, push_rate, multicast_rate, multicast_size, group_window):
+        self.api = api
+        self.senders = senders
+        self.multicast_size = multicast_size
+        self.group_window = group_window
+        self.__buckets = {'push': TokenBucket(push_rate), 'multicast': TokenBucket(multicast_rate)}
+
+    def deliver(self, notices, report=None, on_delivered=None):
+        """deliver
+            * 通知を送信し、全ての送信が終わるまで待つ
+            * 同じ内容の通知は group_window 人分まで保持し、multicast でまとめて送信する
+
+        Args:
+            notices(iterator): (user_id, 通知メッセージ) ※ 1ユーザ1件
+            report(:obj:DeliveryReport): 結果を追加する送信結果 (None の場合は新しく作成する)
+            on_delivered(function): 送信できたユーザIDのリストを受け取る関数 (送信スレッドから呼び出す)
+
+        Returns:
+            report(:obj:DeliveryReport): 送信結果
+        """
+        report = report or DeliveryReport()
+        retries = self.retries()
+
+        # 送信待ちを送信スレッド数の2倍までに制限する (通知の取得が送信より速い場合にメモリを使い続けないため)
+        slots = threading.BoundedSemaphore(self.senders * 2)
+
+        with ThreadPoolExecutor(self.senders, thread_name_prefix='push-sender') as executor:
+            def submit(user_ids, text):
+                slots.acquire()
+                future = executor.submit(self.send, user_ids, text, report, on_delivered)
+                future.add_done_callback(lambda future: slots.release())
+
+            groups = collections.OrderedDict()
+            buffered = 0
+            for user_id, text in notices:
+                recipients = groups.setdefault(text, [])
+                recipients.append(user_id)
+                buffered += 1
+
+                if len(recipients) == self.multicast_size:
+                    submit(groups.pop(text), text)
+                    buffered -= self.multicast_size
+
+                if buffered >= self.group_window:
+                    for text, recipients in groups.items():
+                        submit(recipients, text)
+                    groups.clear()
+                    buffered = 0
+
+            for text, recipients in groups.items():
+                submit(recipients, text)
+
+        report.finish(self.retries() - retries)
+        return report
+
+    def send(self, user_ids, text, report, on_delivered=None):
+        """send
+            * 1人の場合は push、複数人の場合は multicast で送信する (送信スレッドで実行)
+
+        Args:
+            user_ids(list): 送信先のユーザID
+            text(str): 通知メッセージ
+            report(:obj:DeliveryReport): 結果を記録する
+            on_delivered(function): 送信できたユーザIDのリストを受け取る関数
+        """
+        kind = 'push' if len(user_ids) == 1 else 'multicast'
+        messages = TextSendMessage(text=text)
+
+        try:
+            waited = self.__buckets[kind].acquire()
+            if kind == 'push':
+                self.api.push_message(user_ids[0], messages)
+            else:
+                self.api.multicast(user_ids, messages)
+            report.delivered(kind, user_ids, waited)
+        except LineBotApiError as e:
+            # 409 : 再試行前の送信が受け付け済み (X-Line-Retry-Key が重複)
+            if e.status_code != 409:
+                report.failed(kind, user_ids, str(e.status_code))
+                return
+            report.delivered(kind, user_ids, 0.0, accepted=True)
+        except Exception as e:
+            print(e.args)
+            report.failed(kind, user_ids, type(e).__name__)
+            return
+
+        if on_delivered is not None:
+            try:
+                on_delivered(user_ids)
+            except Exception as e:
+                print(e.args)
+                report.record_error('on_delivered')
+
+    def retries(self):
+        # push / multicast の再試行回数の合計
+        snapshot = self.api.http_client.stats.snapshot()
+        return sum(snapshot.get(endpoint, {}).get('retries', 0)
+                   for endpoint in ('POST /v2/bot/message/push', 'POST /v2/bot/message/multicast'))
+
+
+# 通知用のクライアント (送信スレッド数分のコネクションを保持し、再試行回数を増やす)
+push_api = LineBotApi(BOT.YOUR_CHANNEL_ACCESS_TOKEN, endpoint=LineApi.ENDPOINT,
+                      timeout=(LineApi.CONNECT_TIMEOUT, LineApi.READ_TIMEOUT),
+                      http_client=functools.partial(PooledHttpClient, pool_size=Delivery.SENDERS,
+                                                    max_retries=Delivery.MAX_RETRIES))
+
+delivery_engine = DeliveryEngine(push_api, Delivery.SENDERS, Delivery.PUSH_RATE, Delivery.MULTICAST_RATE,
+                                 Delivery.MULTICAST_SIZE, Delivery.GROUP_WINDOW)
@@ -0,0 +1,47 @@
+"""gunicorn.conf.py
+    * gunicorn の設定 (値は setting.py の Server)
+    * ワーカーは fork 後に DB のコネクションプールを作り直す
+    * 終了時 (SIGTERM / max_requests による再起動) は、処理中のリクエストとキューのイベントを処理してから終了する
+"""
+
+from setting import Server
+
+bind = Server.BIND
+workers = Server.WORKERS
+worker_class = 'gthread'
+threads = Server.THREADS
+preload_app = True
+
+# 一定数のリクエストを処理したワーカーを再起動する (メモリの断片化対策)
+max_requests = Server.MAX_REQUESTS
+max_requests_jitter = Server.MAX_REQUESTS_JITTER
+
+timeout = Server.TIMEOUT
+graceful_timeout = Server.GRACEFUL_TIMEOUT
+keepalive = Server.KEEPALIVE
+
+
+def post_fork(server, worker):
+    """post_fork
+        * マスタープロセスから引き継いだコネクションプールを破棄し、ワーカーで新しく接続する
+    """
+    from setting import ENGINE
+
+    ENGINE.dispose()
+
+
+def worker_exit(server, worker):
+    """worker_exit
+        * キューに残ったイベントを処理し、書き込み待ちの status を書き込んでから終了する
+    """
+    from setting import session
+    from callback import event_pool
+    from status_cache import status_cache
+
+    if event_pool.drain(Server.DRAIN_TIMEOUT):
+        event_pool.shutdown(0)
+    else:
+        server.log.warning('worker %s exited with %d pending events', worker.pid, event_pool.stats()['pending'])
+
+    status_cache.flush()
+    session.remove()
@@ -6,12 +6,11 @@
 from abc import ABCMeta, abstractmethod
 from setting import *
 import datetime
-import json
-from linebot import (
-    LineBotApi
-)
-
-line_bot_api = LineBotApi(BOT.YOUR_CHANNEL_ACCESS_TOKEN)
+from line_client import line_bot_api
+from unit_of_work import UnitOfWork
+from status_cache import status_cache
+from postback import decode_postback
+from instrument import sql_instrument
 
 
 class AbstractHandler(metaclass=ABCMeta):
@@ -24,6 +23,7 @@ class AbstractHandler(metaclass=ABCMeta):
 
     def __init__(self):
         self.__observers = []
+        self.unit_of_work = None
 
     def add_observer(self, observer):
         """add_observer
@@ -37,13 +37,25 @@ class AbstractHandler(metaclass=ABCMeta):
     def notify_observer(self):
         """notify_observer
             * observerにデータを通知する
+            * 全てのobserverの更新を1トランザクションで確定し、確定後にメッセージを返信する
         """
-        for obs in self.__observers:
-            try:
-                obs.update(self)
-            except Exception as e:
-                print(e.args)
-                self.error_setter()
+        with UnitOfWork(getattr(self.event, 'reply_token', None)) as unit_of_work:
+            self.unit_of_work = unit_of_work
+
+            for obs in self.__observers:
+                try:
+                    # 発行した SQL の呼び出し元として記録する
+                    with sql_instrument.origin(type(self).__name__ + '.' + type(obs).__name__):
+                        obs.update(self)
+                except Exception as e:
+                    print(e.args)
+                    self.error_setter()
+
+            with sql_instrument.origin(type(self).__name__ + '.UnitOfWork'):
+                if not unit_of_work.complete(self.error):
+                    self.error_setter()
+
+        unit_of_work.send_replies()
 
     @abstractmethod
     def execute(self) -> None:
@@ -84,11 +96,8 @@ class MessageHandler(AbstractHandler):
             self.message = self.event.message.text
             self.reset_status_col = self.check_push_menu(self.message)
 
-        # SELECT * FROM status WHERE user_id = ? ;
-        status = session.query(Status). \
-            filter(Status.user_id == self.user_id). \
-            first()
-        self.status = status
+        # SELECT * FROM status WHERE user_id = ? ; (キャッシュ有効時はキャッシュから取得)
+        self.status = status_cache.load(self.user_id)
 
         self.notify_observer()
 
@@ -135,17 +144,14 @@ class PostbackHandler(AbstractHandler):
 
     def execute(self):
         postback_data_str = self.event.postback.data
-        postback_data_json = json.loads(postback_data_str)
+        postback_data_json = decode_postback(postback_data_str)
 
         self.sequence = postback_data_json['sequence']
         self.command = postback_data_json['command']
         self.data_json = postback_data_json
 
-        # SELECT * FROM status WHERE user_id = ? ;
-        status = session.query(Status). \
-            filter(Status.user_id == self.user_id). \
-            first()
-        self.status = status
+        # SELECT * FROM status WHERE user_id = ? ; (キャッシュ有効時はキャッシュから取得)
+        self.status = status_cache.load(self.user_id)
 
         self.notify_observer()
 
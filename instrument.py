@@ -0,0 +1,193 @@
+"""instrument.py
+    * SQLAlchemy のイベントフックで、発行した SQL の処理時間・件数・呼び出し元 (handler / observer) を記録する
+    * webhook イベントごとに SQL 数を集計し、一部のイベント (SAMPLE_RATE) と遅い SQL (SLOW_MS) を JSON でログに出力する
+    * 環境変数 SQL_INSTRUMENT=on の場合のみ有効 (off の場合はイベントフックを登録しない)
+"""
+
+from setting import *
+from sqlalchemy import event
+import contextlib
+import json
+import random
+import threading
+import time
+
+# 無効時に返すコンテキスト (何もしない)
+NULL_SCOPE = contextlib.nullcontext()
+
+
+class SqlInstrument:
+    """SqlInstrument
+        * SQL の計測
+
+    Attributes:
+        enabled(bool): 計測する場合は True
+        sample_rate(float): SQL をログに出力するイベントの割合
+        slow_ms(float): 必ずログに出力する SQL の処理時間(ms)
+    """
+
+    def __init__(self, enabled, sample_rate, slow_ms):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__origins = {}
+        self.__counts = {'statements': 0, 'errors': 0, 'logged': 0, 'slow': 0,
+                         'events': 0, 'event_statements': 0, 'max_event_statements': 0}
+
+    def install(self, engine):
+        """install
+            * エンジンにイベントフックを登録する (無効の場合は登録しない)
+
+        Args:
+            engine(:obj:Engine): SQLAlchemy のエンジン
+        """
+        if not self.enabled:
+            return
+
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def event_scope(self, name):
+        """event_scope
+            * webhook イベント1件の処理を計測する範囲
+
+        Args:
+            name(str): イベント名 (呼び出し元が未設定の SQL の呼び出し元になる)
+
+        Returns:
+            contextmanager: with で使用する
+        """
+        if not self.enabled:
+            return NULL_SCOPE
+
+        return self.__event_scope(name)
+
+    def origin(self, name):
+        """origin
+            * 範囲内で発行した SQL の呼び出し元を設定する
+
+        Args:
+            name(str): 呼び出し元 (handler / observer のクラス名)
+
+        Returns:
+            contextmanager: with で使用する
+        """
+        if not self.enabled:
+            return NULL_SCOPE
+
+        return self.__origin(name)
+
+    @contextlib.contextmanager
+    def __event_scope(self, name):
+        local = self.__local
+        local.event = {'event': name, 'statements': 0, 'elapsed_ms': 0.0, 'rows': 0,
+                       'sampled': random.random() < self.sample_rate}
+        local.origin = name
+        try:
+            yield
+        finally:
+            summary = local.event
+            local.event = None
+            local.origin = None
+
+            with self.__lock:
+                self.__counts['events'] += 1
+                self.__counts['event_statements'] += summary['statements']
+                self.__counts['max_event_statements'] = max(self.__counts['max_event_statements'], summary['statements'])
+
+            if summary['sampled']:
+                self.log(dict(summary, type='event', elapsed_ms=round(summary['elapsed_ms'], 3)))
+
+    @contextlib.contextmanager
+    def __origin(self, name):
+        local = self.__local
+        previous = getattr(local, 'origin', None)
+        local.origin = name
+        try:
+            yield
+        finally:
+            local.origin = previous
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # 1つの接続で同時に実行する SQL は1つのため、開始時刻は上書きで保持する
+        conn.info['instrument_started'] = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('instrument_started', None)
+        if started is None:
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        local = self.__local
+        origin = getattr(local, 'origin', None) or threading.current_thread().name
+        summary = getattr(local, 'event', None)
+        rows = cursor.rowcount
+
+        if summary is not None:
+            summary['statements'] += 1
+            summary['elapsed_ms'] += elapsed_ms
+            summary['rows'] += max(rows, 0)
+
+        slow = elapsed_ms >= self.slow_ms
+        with self.__lock:
+            self.__counts['statements'] += 1
+            if slow:
+                self.__counts['slow'] += 1
+
+            # 呼び出し元ごとの件数 / 合計時間 / 最大時間
+            totals = self.__origins.setdefault(origin, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed_ms
+            totals[2] = max(totals[2], elapsed_ms)
+
+        if slow or (summary['sampled'] if summary is not None else random.random() < self.sample_rate):
+            self.log({
+                'type': 'slow' if slow else 'statement',
+                'origin': origin,
+                'event': summary['event'] if summary is not None else None,
+                'elapsed_ms': round(elapsed_ms, 3),
+                'rows': rows,
+                'executemany': executemany,
+                'statement': ' '.join(statement.split())[:Instrument.STATEMENT_LENGTH],
+            })
+
+    def handle_error(self, exception_context):
+        # SQL が例外になった場合は after_cursor_execute が呼ばれないため、ここで開始時刻を破棄する
+        # (重複した webhook イベントの IntegrityError など)
+        if exception_context.connection is not None:
+            exception_context.connection.info.pop('instrument_started', None)
+
+        with self.__lock:
+            self.__counts['errors'] += 1
+
+    def log(self, record):
+        with self.__lock:
+            self.__counts['logged'] += 1
+        print('sql ' + json.dumps(record, ensure_ascii=False))
+
+    def stats(self):
+        """stats
+            * 集計結果を返す
+
+        Returns:
+            dict: SQL 数・イベントあたりの SQL 数・呼び出し元ごとの処理時間
+        """
+        if not self.enabled:
+            return {'enabled': False}
+
+        with self.__lock:
+            stats = dict(self.__counts)
+            origins = {origin: {'statements': count, 'total_ms': round(total, 3), 'max_ms': round(maximum, 3)}
+                       for origin, (count, total, maximum) in self.__origins.items()}
+
+        stats['enabled'] = True
+        stats['statements_per_event'] = round(stats['event_statements'] / stats['events'], 2) if stats['events'] else 0.0
+        stats['origins'] = origins
+        return stats
+
+
+sql_instrument = SqlInstrument(Instrument.ENABLED, Instrument.SAMPLE_RATE, Instrument.SLOW_MS)
+sql_instrument.install(ENGINE)
@@ -0,0 +1,113 @@
+"""kana.py
+    * 商品名を読み仮名(カタカナ)に変換する
+    * 変換器はプロセス内で1度だけ作成し、変換結果はキャッシュする
+"""
+
+from setting import *
+from cache import LRUCache
+import pykakasi
+import threading
+import unicodedata
+
+
+def normalize_kana(text):
+    """normalize_kana
+        * 文字幅・互換文字を NFKC で正規化する (半角カナ → 全角カナ, 全角英数 → 半角英数)
+
+    Args:
+        text(str): 正規化する文字列
+
+    Returns:
+        str: 正規化した文字列
+    """
+    if text is None:
+        return ''
+
+    return unicodedata.normalize('NFKC', text).strip()
+
+
+class KanaConverter:
+    """KanaConverter
+        * 商品名をカタカナに変換するクラス
+
+    Attributes:
+        cache(:obj:LRUCache): 商品名をキーとした読み仮名のキャッシュ
+    """
+
+    def __init__(self, cache_size):
+        self.cache = LRUCache(cache_size)
+        self.__converter = None
+        self.__lock = threading.Lock()
+
+    def get_converter(self):
+        """get_converter
+            * pykakasi の変換器を返す (初回のみ辞書を読み込む)
+
+        Returns:
+            obj: pykakasi の変換器
+        """
+        if self.__converter is None:
+            kakasi = pykakasi.kakasi()
+            kakasi.setMode('J', 'K') # H(Kanji) to K(Katakana)
+            kakasi.setMode('K', 'K') # K(Katakana) to K(Katakana)
+            kakasi.setMode('H', 'K') # J(Hiragana) to aK(Katakana)
+            self.__converter = kakasi.getConverter()
+
+        return self.__converter
+
+    def to_kana(self, product_name):
+        """to_kana
+            * 商品名をカタカナに変換する
+
+        Args:
+            product_name(str): 商品名
+
+        Returns:
+            str: 読み仮名 (product_kana)
+        """
+        return self.to_kana_batch([product_name])[0]
+
+    def to_kana_batch(self, product_names, use_cache=True):
+        """to_kana_batch
+            * 複数の商品名をまとめてカタカナに変換する
+
+        Args:
+            product_names(list): 商品名のリスト
+            use_cache(bool): False の場合はキャッシュを使わない (レシピの材料など1度しか変換しない文字列)
+
+        Returns:
+            list: 商品名と同じ順序の読み仮名のリスト
+        """
+        names = [normalize_kana(product_name) for product_name in product_names]
+
+        if not use_cache:
+            with self.__lock:
+                conv = self.get_converter()
+                return [normalize_kana(conv.do(name)) for name in names]
+
+        results = {}
+        missing = []
+        for name in names:
+            if name in results:
+                continue
+
+            kana = self.cache.get(name)
+            if kana is None:
+                missing.append(name)
+                results[name] = None
+            else:
+                results[name] = kana
+
+        if len(missing) != 0:
+            # 変換器はスレッドセーフではないため、まとめて1度だけロックする
+            with self.__lock:
+                conv = self.get_converter()
+                for name in missing:
+                    kana = normalize_kana(conv.do(name))
+                    self.cache.put(name, kana)
+                    results[name] = kana
+
+        return [results[name] for name in names]
+
+
+kana_converter = KanaConverter(CacheSize.PRODUCT_KANA)
@@ -0,0 +1,210 @@
+"""line_client.py
+    * 全モジュールで共有する LINE Messaging API のクライアント
+    * requests.Session のコネクションプールを使い、keep-alive で接続を再利用する
+    * 429 / 5xx は待機時間にジッタを入れて再試行し、エンドポイントごとの処理時間を記録する
+"""
+
+from setting import *
+from linebot import (
+    LineBotApi
+)
+from linebot.http_client import (
+    RequestsHttpClient, RequestsHttpResponse
+)
+from requests.adapters import HTTPAdapter
+import collections
+import random
+import re
+import requests
+import threading
+import time
+import urllib.parse
+import uuid
+
+# 再試行するステータスコード
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# X-Line-Retry-Key を付けて再試行するエンドポイント (重複送信は LINE 側で除外される)
+RETRY_KEY_PATHS = ('/v2/bot/message/push', '/v2/bot/message/multicast')
+
+# URL に含まれるユーザID / グループID / トークルームID
+ID_PATTERN = re.compile(r'/[UCR][0-9a-f]{32}')
+
+
+def endpoint_name(method, url):
+    """endpoint_name
+        * 処理時間を集計するエンドポイント名を返す (URL のIDは {id} に置き換える)
+
+    Args:
+        method(str): HTTPメソッド
+        url(str): リクエストURL
+
+    Returns:
+        str: 'POST /v2/bot/message/reply' などのエンドポイント名
+    """
+    return method + ' ' + ID_PATTERN.sub('/{id}', urllib.parse.urlsplit(url).path)
+
+
+def percentile(values, rate):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(rate * (len(ordered) - 1))))]
+
+
+class LatencyStats:
+    """LatencyStats
+        * エンドポイントごとの呼び出し回数・エラー数・再試行数・処理時間を記録するクラス
+
+    Attributes:
+        samples(int): エンドポイントごとに保持する処理時間の件数
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.__endpoints = {}
+        self.__lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status=None, retried=False):
+        """record
+            * 1回の呼び出し結果を記録する
+
+        Args:
+            endpoint(str): エンドポイント名
+            seconds(float): 処理時間(秒)
+            status(int): ステータスコード (通信エラーの場合は None)
+            retried(bool): 再試行する場合は True
+        """
+        with self.__lock:
+            entry = self.__endpoints.get(endpoint)
+            if entry is None:
+                entry = {'count': 0, 'errors': 0, 'retries': 0, 'latency': collections.deque(maxlen=self.samples)}
+                self.__endpoints[endpoint] = entry
+
+            entry['count'] += 1
+            entry['latency'].append(seconds * 1000)
+            if status is None or status >= 400:
+                entry['errors'] += 1
+            if retried:
+                entry['retries'] += 1
+
+    def snapshot(self):
+        """snapshot
+            * 記録した内容を集計して返す
+
+        Returns:
+            dict: エンドポイント名をキーとした集計結果
+        """
+        with self.__lock:
+            endpoints = {endpoint: dict(entry, latency=list(entry['latency']))
+                         for endpoint, entry in self.__endpoints.items()}
+
+        stats = {}
+        for endpoint, entry in endpoints.items():
+            latency = entry['latency']
+            stats[endpoint] = {
+                'count': entry['count'],
+                'errors': entry['errors'],
+                'retries': entry['retries'],
+                'p50_ms': round(percentile(latency, 0.50), 1),
+                'p95_ms': round(percentile(latency, 0.95), 1),
+                'p99_ms': round(percentile(latency, 0.99), 1),
+                'max_ms': round(max(latency), 1),
+            }
+
+        return stats
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """PooledHttpClient
+        * コネクションプールと再試行を備えた line-bot-sdk の HttpClient
+
+    Attributes:
+        timeout(tuple): (接続, 応答) のタイムアウト秒数
+        max_retries(int): 再試行回数
+        stats(:obj:LatencyStats): エンドポイントごとの処理時間
+    """
+
+    def __init__(self, timeout=(LineApi.CONNECT_TIMEOUT, LineApi.READ_TIMEOUT), pool_size=LineApi.POOL_SIZE,
+                 max_retries=LineApi.MAX_RETRIES, stats=None):
+        super(PooledHttpClient, self).__init__(timeout)
+        self.max_retries = max_retries
+        self.stats = stats or LatencyStats(LineApi.LATENCY_SAMPLES)
+
+        # 再試行は request() で行うため、urllib3 の再試行は無効にする
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self.request('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self.request('POST', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self.request('DELETE', url, timeout, headers=headers, data=data)
+
+    def request(self, method, url, timeout, headers=None, **kwargs):
+        """request
+            * リクエストを送信する
+            * 429 は常に、5xx / 通信エラーは重複送信にならないリクエストのみ再試行する
+              (GET と X-Line-Retry-Key を付けた push / multicast。reply は replyToken が1回限りのため再試行しない)
+
+        Args:
+            method(str): HTTPメソッド
+            url(str): リクエストURL
+            timeout(float or tuple): タイムアウト秒数 (None の場合は self.timeout)
+            headers(dict): リクエストヘッダ
+
+        Returns:
+            RequestsHttpResponse: レスポンス
+        """
+        endpoint = endpoint_name(method, url)
+        headers = dict(headers or {})
+        if method == 'POST' and urllib.parse.urlsplit(url).path in RETRY_KEY_PATHS:
+            headers.setdefault('X-Line-Retry-Key', str(uuid.uuid4()))
+        idempotent = method == 'GET' or 'X-Line-Retry-Key' in headers
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers,
+                                                timeout=timeout or self.timeout, **kwargs)
+            except requests.RequestException as e:
+                # 接続できなかった場合は送信されていないため、常に再試行できる
+                retry = attempt < self.max_retries and (idempotent or isinstance(e, requests.ConnectTimeout))
+                self.stats.record(endpoint, time.perf_counter() - started, None, retry)
+                if not retry:
+                    raise
+                self.wait(attempt)
+                attempt += 1
+                continue
+
+            status = response.status_code
+            retry = attempt < self.max_retries and status in RETRY_STATUS and (status == 429 or idempotent)
+            self.stats.record(endpoint, time.perf_counter() - started, status, retry)
+            if not retry:
+                return RequestsHttpResponse(response)
+
+            self.wait(attempt, response.headers.get('Retry-After'))
+            attempt += 1
+
+    @staticmethod
+    def wait(attempt, retry_after=None):
+        """wait
+            * 再試行まで待機する (指数バックオフ + フルジッタ, Retry-After があればそれ以上待つ)
+
+        Args:
+            attempt(int): 何回目の再試行か (0 始まり)
+            retry_after(str): Retry-After ヘッダの値
+        """
+        delay = random.uniform(0, min(LineApi.BACKOFF_MAX, LineApi.BACKOFF_BASE * (2 ** attempt)))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(LineApi.BACKOFF_MAX, float(retry_after)))
+
+        time.sleep(delay)
+
+
+line_bot_api = LineBotApi(BOT.YOUR_CHANNEL_ACCESS_TOKEN, endpoint=LineApi.ENDPOINT,
+                          timeout=(LineApi.CONNECT_TIMEOUT, LineApi.READ_TIMEOUT), http_client=PooledHttpClient)
@@ -5,19 +5,26 @@
 
 from abc import ABCMeta, abstractmethod
 from setting import *
+from search import search_engine
+from ranking import recipe_ranker
+from cache import LRUCache
+from kana import kana_converter
+from search_session import search_session_store
+from status_cache import status_cache
+from template import Template, FlexDictMessage
+from postback import encode_postback, encode_selection, decode_selection, selected_products
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, FlexSendMessage, FollowEvent, UnfollowEvent, PostbackEvent
 )
-
-from linebot import (
-    LineBotApi
-)
-import pykakasi
+from line_client import line_bot_api
+import collections
 import datetime
-import copy
-import json
 
-line_bot_api = LineBotApi(BOT.YOUR_CHANNEL_ACCESS_TOKEN)
+# スナップショットから取り出したレシピ情報
+RecipeCard = collections.namedtuple('RecipeCard', ['recipe_number', 'recipe_name', 'recipe_photo', 'recipe_url'])
+
+# 作成済みのレシピ bubble (recipe_number → dict)
+recipe_bubble_cache = LRUCache(CacheSize.RECIPE_BUBBLE)
 
 
 class AbstractObserver(metaclass=ABCMeta):
@@ -117,19 +124,27 @@ class AbstractObserver(metaclass=ABCMeta):
         """
         date = datetime.datetime.now()
         return str(date.year * 10000 + date.month * 100 + date.day)
+
+    def get_date(self):
+        """get_date
+            * 現在日付をdate型で返す (productテーブルの日付)
+
+        Returns:
+           date: 現在日付
+        """
+        return datetime.date.today()
     
     def convert_date(self, date):
-        """get_datetime
-            * yyyy-mm-dd の日付を yyyymmdd のint型で返す
+        """convert_date
+            * Datepicker の yyyy-mm-dd の日付をdate型で返す
 
         Args:
             date(str): yyyy-mm-dd の 日付データ
 
         Returns:
-           int: yyyymdd の日付
+           date: 日付
         """
-        split_date = date.split("-")
-        return int(split_date[0]) * 10000 + int(split_date[1]) * 100 + int(split_date[2])
+        return datetime.date.fromisoformat(date)
 
 
 class UserObserver(AbstractObserver):
@@ -155,21 +170,21 @@ class UserObserver(AbstractObserver):
 
             # INSERT INTO user... ;
             session.add(user)
-            session.commit()
+            session.flush()
             return
         
         # followイベント
         if handler.type == 'follow':
             # UPDATE user SET status = '1' ;
             handler.user.status = '1'
-            session.commit()
+            session.flush()
 
         # unfollowイベント
         if handler.type == 'unfollow':
             # UPDATE user SET status = '0' ;
             handler.user.delete_date = super().get_datetime()
             handler.user.status = '0'
-            session.commit()
+            session.flush()
 
 
 class StatusObserver(AbstractObserver):
@@ -186,20 +201,26 @@ class StatusObserver(AbstractObserver):
 
         # Followイベント
         if handler.type == 'follow':
+            # キャッシュと書き込み待ちの更新を破棄する
+            status_cache.invalidate(handler.user_id)
+
             # INSERT INTO status ... ;
             status = Status()
             status.user_id = handler.user_id
             session.add(status)
-            session.commit()
+            session.flush()
             return
 
         # Unfollowイベント
         if handler.type == 'unfollow':
+            # キャッシュと書き込み待ちの更新を破棄する
+            status_cache.invalidate(handler.user_id)
+
             # DELETE FROM status
             session.query(Status). \
                 filter(Status.user_id == handler.user_id). \
                 delete()
-            session.commit()
+            session.flush()
             return
 
         # Messageイベント
@@ -208,21 +229,19 @@ class StatusObserver(AbstractObserver):
             if super().check_invalid_request(handler):
                 return
             
-            # SELECT * FROM status where user_id = ? ;
-            status = session.query(Status). \
-                filter(Status.user_id == handler.user_id). \
-                first()
+            # handlerで読み込み済みのstatusを更新する
+            status = handler.status
             
             # メニューボタン選択時
             if handler.reset_status_col != 0:
                 status = self.reset_status(status, handler.reset_status_col)
-                session.commit()
+                status_cache.save(handler.unit_of_work, status)
                 return
 
             # 登録処理 - 商品名入力時
             if status.register_status == RegisterStatus.WAIT_PRODUCT:
                 status.register_status = RegisterStatus.WAIT_DATE
-                session.commit()
+                status_cache.save(handler.unit_of_work, status)
                 return
         
         # Postbackイベント
@@ -231,22 +250,20 @@ class StatusObserver(AbstractObserver):
             if super().check_invalid_postback(handler):
                 return
 
-            # SELECT * FROM status where user_id = ? ;
-            status = session.query(Status). \
-                filter(Status.user_id == handler.user_id). \
-                first()
+            # handlerで読み込み済みのstatusを更新する
+            status = handler.status
 
             # 登録処理 - Datepicker入力時 (WAIT_DATE → INIT)
             if handler.sequence == PostbackSEQ.REGISTER_EXPIRE:
                 status.register_status = RegisterStatus.INIT
-                session.commit()
+                status_cache.save(handler.unit_of_work, status)
                 return
 
             # 一覧処理 - 商品選択時 (WAIT_PRODUCT → WAIT_SELECT)
             if status.list_status == ListStatus.WAIT_PRODUCT:
                 if handler.command == Command.SELECT_PRODUCT:
                     status.list_status = ListStatus.WAIT_SELECT
-                    session.commit()
+                    status_cache.save(handler.unit_of_work, status)
                     return
             
             # 一覧処理 - アクション選択時
@@ -254,19 +271,19 @@ class StatusObserver(AbstractObserver):
                 # 日付変更選択時 (WAIT_SELECT → WAIT_DATE)
                 if handler.command == Command.CHANGE_DATE:
                     status.list_status = ListStatus.WAIT_DATE
-                    session.commit()
+                    status_cache.save(handler.unit_of_work, status)
                     return
                 
                 # 商品削除選択時 (WAIT_SELECT → INIT)
                 if handler.command == Command.DELETE:
                     status.list_status = ListStatus.INIT
-                    session.commit()
+                    status_cache.save(handler.unit_of_work, status)
                     return
             
             # 一覧処理 - Datepicker入力時 (WAIT_DATE → INIT)
             if status.list_status == ListStatus.WAIT_DATE:
                 status.list_status = ListStatus.INIT
-                session.commit()
+                status_cache.save(handler.unit_of_work, status)
                 return
             
             # レシピ処理 - 検索時 
@@ -274,7 +291,7 @@ class StatusObserver(AbstractObserver):
                 # 検索選択時 (WAIT_PRODUCT → INIT)
                 if handler.command == Command.SEARCH:
                     status.recipe_status = RecipeStatus.INIT
-                    session.commit()
+                    status_cache.save(handler.unit_of_work, status)
                     return
 
             
@@ -295,6 +312,9 @@ class StatusObserver(AbstractObserver):
         if reset_status_col == 0:
             return status
         
+        # レシピ検索状態の破棄
+        search_session_store.evict(status.user_id)
+
         # ステータス初期化
         status.register_status = RegisterStatus.INIT
         status.list_status = ListStatus.INIT
@@ -335,23 +355,17 @@ class ProductObserver(AbstractObserver):
             if self.check_action(handler) == 'INSERT':
                 product_name = handler.data_json['product_name']
 
-                # 形態素解析
-                kakasi = pykakasi.kakasi()
-                kakasi.setMode('J', 'K') # H(Kanji) to K(Katakana)
-                kakasi.setMode('K', 'K') # K(Katakana) to K(Katakana)
-                kakasi.setMode('H', 'K') # J(Hiragana) to aK(Katakana)
-
-                conv = kakasi.getConverter()
-                product_kana = conv.do(product_name)
+                # 読み仮名変換
+                product_kana = kana_converter.to_kana(product_name)
 
                 product = Product()
                 product.product_name = product_name
                 product.product_kana = product_kana
                 product.user_id = handler.user_id
-                product.register_date = super().get_datetime()
+                product.register_date = super().get_date()
                 product.expire_date = super().convert_date(handler.event.postback.params['date'])
                 session.add(product)
-                session.commit()
+                session.flush()
                 return
             
             # UPDATE (一覧処理 - Datepicker入力時)
@@ -362,7 +376,7 @@ class ProductObserver(AbstractObserver):
                     first()
 
                 product.expire_date = super().convert_date(handler.event.postback.params['date'])
-                session.commit()
+                session.flush()
                 return
             
             # DELETE (一覧処理 - 商品削除入力時)
@@ -370,7 +384,7 @@ class ProductObserver(AbstractObserver):
                 product = session.query(Product). \
                     filter(Product.product_id == handler.data_json['product_id']). \
                     delete()
-                session.commit()
+                session.flush()
                 return
 
 
@@ -521,6 +535,12 @@ class MessageObserver(AbstractObserver):
                 # レシピ検索選択時
                 if handler.command == Command.SEARCH:
                     reply_message = self.return_recipe_list(handler)
+
+                    # レシピが0件の場合
+                    if len(reply_message['contents']) == 0:
+                        self.reply_text_message(handler, Message.NO_RECIPE)
+                        return
+
                     self.reply_flex_message(handler, reply_message)
                     return
 
@@ -548,41 +568,20 @@ class MessageObserver(AbstractObserver):
             product_id = handler.data_json['product_id']
             product_name = handler.data_json['product_name']
 
-        # FlexMessage - header
-        datepicker_flame = copy.deepcopy(Message.BUBBLE_FLAME)
-        list_header = copy.deepcopy(Message.HEADER_FLAME)
-        list_header['contents'][0]['text'] = product_name
-        list_header['contents'][1]['text'] = "賞味期限を登録してね。"
-        datepicker_flame['header'] = list_header
-
-        # data JSONの作成 (datepicker)
-        pick_data_flame = copy.deepcopy(Message.DATA_FORMAT)
-        pick_data_flame['sequence'] = sequence
-        pick_data_flame['command'] = Command.DATEPICKER
-        pick_data_flame['product_id'] = product_id
-        pick_data_flame['product_name'] = product_name
-        pick_data_str = json.dumps(pick_data_flame)
-
-        # data JSONの作成 (Cancel)
-        cancel_data_flame = copy.deepcopy(pick_data_flame)
-        cancel_data_flame['command'] = Command.CANCEL
-        cancel_data_str = json.dumps(cancel_data_flame)
+        # dataの作成 (datepicker)
+        pick_data_str = encode_postback(sequence, Command.DATEPICKER, product_id=product_id, product_name=product_name)
+
+        # dataの作成 (Cancel)
+        cancel_data_str = encode_postback(sequence, Command.CANCEL, product_id=product_id, product_name=product_name)
 
         # FlexMessage - body
-        date = datetime.datetime.now()
-        month = "0" + str(date.month)
-        day = "0" + str(date.day)
-        today_date = str(date.year) + "-" + month[-2:] + "-" + day[-2:]
-    
-        list_body = copy.deepcopy(Message.CALENDER_BODY)
-        list_body['contents'][0]['action']['data'] = pick_data_str
-        list_body['contents'][0]['action']['min'] = today_date
-        list_body['contents'][1]['action']['data'] = cancel_data_str
-        datepicker_flame['body'] = list_body
+        today_date = datetime.date.today().isoformat()
 
-        # FlexMessage - style
-        list_styles = copy.deepcopy(Message.COMMON_STYLES)
-        datepicker_flame['styles'] = list_styles
+        # FlexMessage - header / body / style
+        datepicker_flame = Template.BUBBLE(
+            header=Template.HEADER(title=product_name, text="賞味期限を登録してね。"),
+            body=Template.CALENDER_BODY(pick_data=pick_data_str, min_date=today_date, cancel_data=cancel_data_str),
+            styles=Message.COMMON_STYLES)
 
         return datepicker_flame
 
@@ -626,13 +625,14 @@ class MessageObserver(AbstractObserver):
         end_amount = 5
         display_position = 0
         marker_array = []
-        recipe_list = {}
+        hit_count = 0
 
-        # SELECT product_id, product_name, expire_date FROM product where user_id = ? ; 
+        # SELECT product_id, product_name, expire_date FROM product where user_id = ? ORDER BY expire_date, product_id ; 
         product_list = session.query(Product.product_id, Product.product_name, Product.expire_date). \
             filter(Product.user_id == handler.user_id). \
-            order_by(Product.expire_date).\
+            order_by(Product.expire_date, Product.product_id).\
             all()
+        product_ids = [str(product.product_id) for product in product_list]
         
         # 0件の登録時
         if len(product_list) == 0:
@@ -656,7 +656,7 @@ class MessageObserver(AbstractObserver):
         if handler.type == 'postback':
             sequence = handler.sequence
             display_position = int(handler.data_json['display_position'])
-            marker_array = handler.data_json['marker_array']
+            marker_array = decode_selection(handler.data_json, product_ids)
 
             # 共通 - Back選択時
             if handler.command == Command.BACK:
@@ -702,48 +702,28 @@ class MessageObserver(AbstractObserver):
                 if start_length == len(marker_array):
                     marker_array.append(product_id)
 
-            # レシピ件数取得処理
-            count = 0
-            for marker in marker_array:
-                # SELECT product_kana FROM product WHERE product_id = ? ;
-                product = session.query(Product.product_kana). \
-                    filter(Product.product_id == marker). \
-                    first()
-
-                # SELECT index FROM inverted_index WHERE index_kana = ? ;
-                inverted_index = session.query(InvertedIndex.index). \
-                    filter(InvertedIndex.index_kana == product.product_kana). \
-                    first()
-
-                # 転置インデックス配列を作成
-                if inverted_index is None:
-                    index_array = []
-                else:
-                    index_array = inverted_index.index.split(',')
-
-                if count == 0:
-                    recipe_list = set(index_array)
-                else:
-                    # 既に取得している転置インデックスとの積集合を取得
-                    recipe_list = recipe_list.intersection(set(index_array))
-                
-                count += 1
+            # レシピ件数取得処理 (レシピ処理のみ)
+            if sequence == PostbackSEQ.RECIPE_PRODUCT:
+                hit_count = search_session_store.sync(handler.user_id, marker_array).hit_count()
         
         # *** FlexMessage作成処理 *** 
         # FlexMessage - header
-        list_flame = copy.deepcopy(Message.BUBBLE_FLAME)
-        list_flame['header'] = copy.deepcopy(Message.HEADER_FLAME)
+        header_title = ''
+        header_text = ''
 
         # 一覧処理
         if sequence == PostbackSEQ.LIST_PRODUCT:
-            list_flame['header']['contents'][0]['text'] = '【登録商品一覧】'
-            list_flame['header']['contents'][1]['text'] = '賞味期限変更 / 商品削除ができます。'
+            header_title = '【登録商品一覧】'
+            header_text = '賞味期限変更 / 商品削除ができます。'
 
         # レシピ処理
         elif sequence == PostbackSEQ.RECIPE_PRODUCT:
-            list_flame['header']['contents'][0]['text'] = '【レシピ検索】'
-            list_flame['header']['contents'][1]['text'] = '検索ヒット数 : ' + str(len(recipe_list)) + '  (10件まで表示可能)'
+            header_title = '【レシピ検索】'
+            header_text = '検索ヒット数 : ' + str(hit_count) + '  (10件まで表示可能)'
         
+        # 選択中の商品 (全ボタン共通)
+        selection = encode_selection(product_ids, marker_array)
+
         # 表示範囲から検索した商品のbodyを作成
         contents_array = []
         show_count = 0
@@ -752,34 +732,28 @@ class MessageObserver(AbstractObserver):
 
         for product in product_list:
             if start_amount <= execution_count <= end_amount:
-                # data JSONの作成 (商品ボタン)
-                body_data_flame = copy.deepcopy(Message.DATA_FORMAT)
-                body_data_flame['sequence'] = sequence
-                body_data_flame['command'] = Command.SELECT_PRODUCT
-                body_data_flame['product_id'] = str(product.product_id)
-                body_data_flame['product_name'] = product.product_name
-                body_data_flame['expire_date'] = str(product.expire_date)
-                body_data_flame['display_position'] = str(display_position)
-                body_data_flame['marker_array'] = marker_array
-                body_data_str = json.dumps(body_data_flame)
+                # dataの作成 (商品ボタン)
+                body_data_str = encode_postback(
+                    sequence, Command.SELECT_PRODUCT, product_id=product.product_id, display_position=display_position,
+                    expire_date=product.expire_date.strftime('%Y%m%d'), selection=selection,
+                    product_name=product.product_name)
                 
                 # FlexMessage - body
-                list_contents = copy.deepcopy(Message.LIST_CONTENTS)
+                color = '#ff8c00'
                 # 一覧処理
                 if sequence == PostbackSEQ.LIST_PRODUCT:
-                    list_contents['contents'][0]['color'] = color_type[show_count]
+                    color = color_type[show_count]
                 
                 # レシピ処理
                 elif sequence == PostbackSEQ.RECIPE_PRODUCT:
                     # 商品選択時
                     if str(product.product_id) in marker_array:
-                        list_contents['contents'][0]['color'] = '#ff7f24'
+                        color = '#ff7f24'
                     # 商品選択解除時
                     else:
-                        list_contents['contents'][0]['color'] = '#ffc966'
+                        color = '#ffc966'
                     
-                list_contents['contents'][0]['action']['label'] = product.product_name
-                list_contents['contents'][0]['action']['data'] = body_data_str
+                list_contents = Template.LIST_CONTENTS(color=color, label=product.product_name, data=body_data_str)
                 contents_array.append(list_contents)
                 show_count += 1
                 
@@ -791,48 +765,34 @@ class MessageObserver(AbstractObserver):
 
         # レシピ処理
         if sequence == PostbackSEQ.RECIPE_PRODUCT:
-            # data JSON (検索ボタン)
-            button_data_flame = copy.deepcopy(Message.DATA_FORMAT)
-            button_data_flame['sequence'] = sequence
-            button_data_flame['command'] = Command.SEARCH
-            button_data_flame['marker_array'] = marker_array
-            button_data_str = json.dumps(button_data_flame)
+            # data (検索ボタン)
+            button_data_str = encode_postback(sequence, Command.SEARCH, selection=selection)
 
             # 検索ボタンの追加
-            recipe_button = copy.deepcopy(Message.RECIPE_BUTTON)
-            recipe_button['contents'][0]['action']['label'] = 'レシピを検索'
-            recipe_button['contents'][0]['action']['data'] = button_data_str
+            recipe_button = Template.RECIPE_BUTTON(label='レシピを検索', data=button_data_str)
             contents_array.append(recipe_button)
-        
-        # 商品登録件数が0件の場合は、bodyを作成しない
-        if len(contents_array) != 0:
-            list_body_flame = copy.deepcopy(Message.BODY_FLAME)
-            list_body_flame['contents'] = contents_array
-            list_flame['body'] = list_body_flame
-            
+
         # FlexMessage - footer
-        back_data_flame = copy.deepcopy(Message.DATA_FORMAT)
         # BACK ボタン
-        back_data_flame['sequence'] = sequence
-        back_data_flame['command'] = Command.BACK
-        back_data_flame['display_position'] = str(display_position)
-        back_data_flame['marker_array'] = marker_array
-        back_data_str = json.dumps(back_data_flame)
+        back_data_str = encode_postback(sequence, Command.BACK, display_position=display_position, selection=selection)
 
         # NEXT ボタン
-        next_data_flame = copy.deepcopy(back_data_flame)
-        next_data_flame['command'] = Command.NEXT
-        next_data_flame['marker_array'] = marker_array
-        next_data_str = json.dumps(next_data_flame)
+        next_data_str = encode_postback(sequence, Command.NEXT, display_position=display_position, selection=selection)
         
         # 件数表示
-        list_footer = copy.deepcopy(Message.LIST_FOOTER)
-        list_footer['contents'][0]['action']['data'] = back_data_str
-        list_footer['contents'][1]['text'] = str(start_amount) + '-' + str(end_amount) + ' / ' + str(len(product_list))
-        list_footer['contents'][2]['action']['data'] = next_data_str
-    
-        list_flame['footer'] = list_footer
-        list_flame['styles'] = Message.COMMON_STYLES
+        list_footer = Template.LIST_FOOTER(
+            back_data=back_data_str,
+            page=str(start_amount) + '-' + str(end_amount) + ' / ' + str(len(product_list)),
+            next_data=next_data_str)
+
+        list_flame = Template.LIST_BUBBLE(
+            header=Template.HEADER(title=header_title, text=header_text),
+            footer=list_footer,
+            styles=Message.COMMON_STYLES)
+
+        # 商品登録件数が0件の場合は、bodyを作成しない
+        if len(contents_array) != 0:
+            list_flame['body'] = Template.BODY(contents=contents_array)
 
         return list_flame
 
@@ -857,35 +817,19 @@ class MessageObserver(AbstractObserver):
         product_name = handler.data_json['product_name']
         product_id = handler.data_json['product_id']
 
-        # data JSON (datepicker)
-        menu_data_flame = copy.deepcopy(Message.DATA_FORMAT)
-        menu_data_flame['sequence'] = PostbackSEQ.LIST_SELECT
-        menu_data_flame['command'] = 'MENU'
-        menu_data_flame['product_id'] = product_id
-        menu_data_flame['product_name'] = product_name
+        # data (datepicker)
+        date_data_str = encode_postback(PostbackSEQ.LIST_SELECT, Command.CHANGE_DATE,
+                                        product_id=product_id, product_name=product_name)
 
-        date_data_flame = copy.deepcopy(menu_data_flame)
-        date_data_flame['command'] = Command.CHANGE_DATE
-        date_data_str = json.dumps(date_data_flame)
+        # data (delete)
+        delete_data_str = encode_postback(PostbackSEQ.LIST_SELECT, Command.DELETE,
+                                          product_id=product_id, product_name=product_name)
 
-        # data JSON (delete)
-        delete_data_flame = copy.deepcopy(menu_data_flame)
-        delete_data_flame['command'] = Command.DELETE
-        delete_data_str = json.dumps(delete_data_flame)
-
-        # FlexMessage - header
-        select_flame = copy.deepcopy(Message.BUBBLE_FLAME)
-        select_header = copy.deepcopy(Message.HEADER_FLAME)
-        select_header['contents'][0]['text'] = product_name
-        select_header['contents'][1]['text'] = expire_date + ' に賞味期限が切れます'
-        select_flame['header'] = select_header
-
-        # FlexMessage - body
-        select_body = copy.deepcopy(Message.SELECT_BODY)
-        select_body['contents'][0]['contents'][0]['action']['data'] = date_data_str
-        select_body['contents'][1]['contents'][0]['action']['data'] = delete_data_str
-        select_flame['body'] = select_body
-        select_flame['styles'] = copy.deepcopy(Message.COMMON_STYLES)
+        # FlexMessage - header / body / style
+        select_flame = Template.BUBBLE(
+            header=Template.HEADER(title=product_name, text=expire_date + ' に賞味期限が切れます'),
+            body=Template.SELECT_BODY(change_data=date_data_str, delete_data=delete_data_str),
+            styles=Message.COMMON_STYLES)
 
         return select_flame
 
@@ -901,62 +845,79 @@ class MessageObserver(AbstractObserver):
            recipe_flame(dict): messageのフォーマットを定義したJSON
         """
         
-        # レシピ候補の作成
-        marker_array = marker_array = handler.data_json['marker_array']
-        count = 0
-        for marker in marker_array:
-            # SELECT product_kana FROM product WHERE product_id = ? ;
-            product = session.query(Product.product_kana). \
-                filter(Product.product_id == marker). \
-                first()
-
-            # SELECT index FROM inverted_index WHERE index_kana = ? ;
-            inverted_index = session.query(InvertedIndex.index). \
-                filter(InvertedIndex.index_kana == product.product_kana). \
-                first()
-
-            # 転置インデックス配列を作成
-            if inverted_index is None:
-                index_array = []
-            else:
-                index_array = inverted_index.index.split(',')
-
-            if count == 0:
-                recipe_list = set(index_array)
-            else:
-                # 既に取得している転置インデックスとの積集合を取得
-                recipe_list = recipe_list.intersection(set(index_array))
-            
-            count += 1
+        # レシピ候補の作成 (スコア上位10件)
+        marker_array = selected_products(handler.user_id, handler.data_json)
+        kana_list = search_session_store.sync(handler.user_id, marker_array).kana_list()
+        recipe_list = recipe_ranker.top_k(kana_list, Ranking.LIMIT)
 
         # レシピ作成
-        count = 0
-        body_contents = []
-        for recipe_num in recipe_list:
-            # SELECT * FROM recipe WHERE recipe_number = ? ;
-            recipe = session.query(Recipe). \
-                filter(Recipe.recipe_number == recipe_num). \
-                first()
-            
-            # FlexMessage - body
-            recipe_body = copy.deepcopy(Message.RECIPE_BODY)
-            recipe_body['header']['contents'][0]['text'] = recipe.recipe_name
-            recipe_body['hero']['url'] = recipe.recipe_photo
-            recipe_body['footer']['contents'][0]['action']['uri'] = recipe.recipe_url
-            recipe_body['styles'] = copy.deepcopy(Message.COMMON_STYLES)
-            body_contents.append(recipe_body)
-
-            count += 1
-
-            # 10件までの表示チェック
-            if count >= 10:
-                break
-
-        recipe_flame = copy.deepcopy(Message.CAROUSEL_FLAME)
-        recipe_flame['contents'] = body_contents
-        
+        body_contents = MessageObserver.get_recipe_bubbles(recipe_list)
+
+        recipe_flame = Template.CAROUSEL(contents=body_contents)
+
         return recipe_flame
 
+    @staticmethod
+    def get_recipe_bubbles(recipe_list):
+        """get_recipe_bubbles
+            * レシピ番号に対応するレシピの bubble を返す
+            * 作成済みの bubble はキャッシュから取得し、未作成のレシピのみ一括で取得する
+
+        Args:
+            recipe_list(list): 表示順のレシピ番号
+
+        Returns:
+           body_contents(list): レシピの bubble のリスト
+        """
+        bubbles = {}
+        missing = []
+        for recipe_num in recipe_list:
+            recipe_body = recipe_bubble_cache.get(recipe_num)
+            if recipe_body is not None:
+                bubbles[recipe_num] = recipe_body
+                continue
+
+            # スナップショットのレシピ情報
+            recipe = search_engine.find_recipe(recipe_num)
+            if recipe is None:
+                missing.append(recipe_num)
+                continue
+
+            recipe_body = MessageObserver.build_recipe_bubble(RecipeCard(*recipe))
+            recipe_bubble_cache.put(recipe_num, recipe_body)
+            bubbles[recipe_num] = recipe_body
+
+        if len(missing) != 0:
+            # SELECT recipe_number, recipe_name, recipe_photo, recipe_url FROM recipe WHERE recipe_number IN (...) ;
+            recipes = session.query(Recipe.recipe_number, Recipe.recipe_name, Recipe.recipe_photo, Recipe.recipe_url). \
+                filter(Recipe.recipe_number.in_(missing)). \
+                all()
+
+            for recipe in recipes:
+                recipe_body = MessageObserver.build_recipe_bubble(recipe)
+                recipe_bubble_cache.put(recipe.recipe_number, recipe_body)
+                bubbles[recipe.recipe_number] = recipe_body
+
+        # 削除済みのレシピは表示しない
+        return [bubbles[recipe_num] for recipe_num in recipe_list if recipe_num in bubbles]
+
+    @staticmethod
+    def build_recipe_bubble(recipe):
+        """build_recipe_bubble
+            * レシピの bubble を作成する
+            * 作成した bubble はキャッシュで共有するため、作成後は変更しないこと
+
+        Args:
+            recipe(obj): recipe_number, recipe_name, recipe_photo, recipe_url を持つレコード
+
+        Returns:
+           recipe_body(dict): レシピの bubble
+        """
+        recipe_body = Template.RECIPE_BODY(
+            title=recipe.recipe_name, photo=recipe.recipe_photo, url=recipe.recipe_url, styles=Message.COMMON_STYLES)
+
+        return recipe_body
+
     @staticmethod
     def reply_text_message(handler, message):
         """reply_text_message
@@ -966,9 +927,7 @@ class MessageObserver(AbstractObserver):
             handler(obj): handlerのインスタンス
             message(str): 送信するメッセージ
         """
-        token = handler.event.reply_token
-        line_bot_api.reply_message(
-            token, TextSendMessage(text=message))
+        MessageObserver.reply(handler, TextSendMessage(text=message))
 
     @staticmethod
     def reply_flex_message(handler, message):
@@ -979,6 +938,21 @@ class MessageObserver(AbstractObserver):
             handler(obj): handlerのインスタンス
             message(dict): 送信するメッセージ
         """
-        token = handler.event.reply_token
-        line_bot_api.reply_message(
-            token, FlexSendMessage(alt_text="flexMessage", contents=message))
\ No newline at end of file
+        MessageObserver.reply(handler, FlexDictMessage(alt_text="flexMessage", contents=message))
+
+    @staticmethod
+    def reply(handler, send_message):
+        """reply
+            * メッセージを返信する
+            * イベントのトランザクション中は、確定後に送信するよう登録する
+
+        Args:
+            handler(obj): handlerのインスタンス
+            send_message(obj): TextSendMessage / FlexDictMessage
+        """
+        unit_of_work = getattr(handler, 'unit_of_work', None)
+        if unit_of_work is not None:
+            unit_of_work.reply(send_message)
+            return
+
+        line_bot_api.reply_message(handler.event.reply_token, send_message)
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""postback.py
+    * Postback の data を短い区切り文字形式で作成 / 解析する
+    * 選択中の商品は product_id の配列ではなく、商品一覧 (賞味期限, product_id 順) に対するビットマスクで持つ
+    * data の長さは選択数によらず、商品の登録件数で上限が決まる (LINE の postback data は300文字まで)
+    * 以前の形式 (JSON) の data も解析できる (送信済みのメッセージのボタン)
+
+    R<sequence>|<command>|<product_id>|<display_position>|<expire_date>|<selection>|<product_name>
+"""
+
+from setting import *
+import json
+import zlib
+
+# data の先頭文字 (以前の形式は '{' で始まる)
+PREFIX = 'R'
+SEPARATOR = '|'
+
+# 区切り文字形式の項目 (product_name は区切り文字を含む可能性があるため末尾に置く)
+FIELDS = ('sequence', 'command', 'product_id', 'display_position', 'expire_date', 'selection', 'product_name')
+
+# Command の1文字の略称
+COMMAND_CODES = {
+    Command.DATEPICKER: 'd',
+    Command.CANCEL: 'c',
+    Command.CHANGE_DATE: 'h',
+    Command.DELETE: 'x',
+    Command.SEARCH: 's',
+    Command.SELECT_PRODUCT: 'p',
+    Command.BACK: 'b',
+    Command.NEXT: 'n',
+}
+COMMANDS = {code: command for command, code in COMMAND_CODES.items()}
+
+
+def encode_postback(sequence, command, product_id='', display_position='', expire_date='', selection='',
+                    product_name=''):
+    """encode_postback
+        * Postback の data を作成する
+
+    Args:
+        sequence(str): PostbackSEQ
+        command(str): Command
+        product_id(str): 商品ID
+        display_position(int): 商品一覧の表示ページ
+        expire_date(str): 賞味期限 (YYYYMMDD)
+        selection(str): encode_selection() で作成した選択中の商品
+        product_name(str): 商品名
+
+    Returns:
+        str: Postback の data
+    """
+    return PREFIX + SEPARATOR.join((sequence, COMMAND_CODES[command], str(product_id), str(display_position),
+                                    str(expire_date), selection, product_name))
+
+
+def decode_postback(data):
+    """decode_postback
+        * Postback の data を項目名をキーとした dict にする
+
+    Args:
+        data(str): Postback の data
+
+    Returns:
+        dict: FIELDS をキーとした値 (以前の形式の場合は DATA_FORMAT の JSON)
+
+    Raises:
+        ValueError: 解析できない data の場合
+    """
+    # 以前の形式 (JSON)
+    if data.startswith('{'):
+        return json.loads(data)
+
+    values = data[len(PREFIX):].split(SEPARATOR, len(FIELDS) - 1)
+    if not data.startswith(PREFIX) or len(values) != len(FIELDS) or values[1] not in COMMANDS:
+        raise ValueError('invalid postback data: ' + data[:40])
+
+    data_json = dict(zip(FIELDS, values))
+    data_json['command'] = COMMANDS[data_json['command']]
+    return data_json
+
+
+def fingerprint(product_ids):
+    """fingerprint
+        * 商品一覧の並びを識別する値 (登録 / 削除 / 賞味期限の変更で変わる)
+
+    Args:
+        product_ids(list): 商品一覧の product_id (str)
+
+    Returns:
+        str: 16進4桁
+    """
+    return '%04x' % (zlib.crc32(','.join(product_ids).encode('utf-8')) & 0xffff)
+
+
+def encode_selection(product_ids, marker_array):
+    """encode_selection
+        * 選択中の商品を、商品一覧の位置のビットマスクにする
+
+    Args:
+        product_ids(list): 商品一覧の product_id (str, 賞味期限, product_id 順)
+        marker_array(list): 選択中の product_id (str)
+
+    Returns:
+        str: <fingerprint>.<ビットマスク(16進)> (未選択の場合は空文字)
+    """
+    markers = set(marker_array)
+    mask = 0
+    for position, product_id in enumerate(product_ids):
+        if product_id in markers:
+            mask |= 1 << position
+
+    if mask == 0:
+        return ''
+
+    return fingerprint(product_ids) + '.' + format(mask, 'x')
+
+
+def decode_selection(data_json, product_ids):
+    """decode_selection
+        * Postback の data から選択中の product_id を取り出す
+        * 作成後に商品一覧が変わった場合は、選択を解除する
+
+    Args:
+        data_json(dict): decode_postback() の結果
+        product_ids(list): 商品一覧の product_id (str, 賞味期限, product_id 順)
+
+    Returns:
+        list: 選択中の product_id (str)
+    """
+    # 以前の形式 (JSON)
+    if 'marker_array' in data_json:
+        return [str(marker) for marker in data_json['marker_array']]
+
+    selection = data_json.get('selection', '')
+    if selection == '':
+        return []
+
+    selection_fingerprint, _, mask = selection.partition('.')
+    if selection_fingerprint != fingerprint(product_ids):
+        return []
+
+    mask = int(mask, 16)
+    return [product_id for position, product_id in enumerate(product_ids) if mask >> position & 1]
+
+
+def selected_products(user_id, data_json):
+    """selected_products
+        * Postback の data から選択中の product_id を取り出す (商品一覧を取得していない場合)
+
+    Args:
+        user_id(str): ユーザID
+        data_json(dict): decode_postback() の結果
+
+    Returns:
+        list: 選択中の product_id (str)
+    """
+    if 'marker_array' in data_json or data_json.get('selection', '') == '':
+        return decode_selection(data_json, [])
+
+    # SELECT product_id FROM product WHERE user_id = ? ORDER BY expire_date, product_id ;
+    product_list = session.query(Product.product_id). \
+        filter(Product.user_id == user_id). \
+        order_by(Product.expire_date, Product.product_id). \
+        all()
+
+    return decode_selection(data_json, [str(product.product_id) for product in product_list])
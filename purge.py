@@ -0,0 +1,170 @@
+"""purge.py
+    * 賞味期限切れの商品を product_archiveテーブルに移動するJobモジュール
+    * BATCH_SIZE 件ずつ、1つの SQL (DELETE ... RETURNING → INSERT ... SELECT) で移動し、バッチごとにコミットする
+    * 他のトランザクションがロックしている商品は読み飛ばす (FOR UPDATE SKIP LOCKED、次のバッチ / 次回に移動する)
+    * このJobで移動する商品には、1行ずつアーカイブするトリガ (backup_recode) の処理を行わない (recipebot.skip_backup)
+
+    python purge.py [--continuous]
+"""
+
+from setting import *
+import argparse
+import datetime
+import json
+import signal
+import time
+
+# 1バッチ分の商品を移動する (PostgreSQL)
+# SET LOCAL により、このトランザクションの DELETE ではトリガがアーカイブしない
+SKIP_BACKUP = text("SET LOCAL recipebot.skip_backup = 'on'")
+MOVE_EXPIRED = text("""
+    WITH expired AS (
+        SELECT product_id FROM product
+        WHERE expire_date < :today_date AND product_id > :after_product_id
+        ORDER BY product_id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM product
+        WHERE product_id IN (SELECT product_id FROM expired)
+        RETURNING *
+    ), archived AS (
+        INSERT INTO product_archive
+        SELECT * FROM moved
+        ON CONFLICT (product_id) DO NOTHING
+        RETURNING product_id
+    )
+    SELECT (SELECT count(*) FROM moved) AS deleted, (SELECT count(*) FROM archived) AS archived,
+           (SELECT max(product_id) FROM moved) AS last_product_id
+""")
+
+
+def today():
+    return datetime.date.today()
+
+
+def purge_batch(connection, today_date, batch_size, after_product_id=0):
+    """purge_batch
+        * 賞味期限切れの商品を batch_size 件まで product_archive に移動する (呼び出し元のトランザクション内で実行)
+        * 前のバッチの続き (after_product_id より後) から探すため、残っている商品を毎回読み直さない
+
+    Args:
+        connection(:obj:Connection): トランザクションを開始した接続
+        today_date(date): 今日日付
+        batch_size(int): 移動する商品数の上限
+        after_product_id(int): 前のバッチで移動した最後の商品ID
+
+    Returns:
+        tuple: (削除した商品数, アーカイブした商品数, 移動した最後の商品ID)
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(SKIP_BACKUP)
+        row = connection.execute(MOVE_EXPIRED, today_date=today_date, batch_size=batch_size,
+                                 after_product_id=after_product_id).first()
+        return row.deleted, row.archived, row.last_product_id or after_product_id
+
+    # PostgreSQL 以外 (開発用の SQLite など) : 同じ処理を3つの SQL で行う (トリガは無い前提)
+    product = Product.__table__
+    archive = ProductArchive.__table__
+
+    # SELECT product_id FROM product WHERE expire_date < ? AND product_id > ? ORDER BY product_id LIMIT ? ;
+    product_ids = [row.product_id for row in connection.execute(
+        select([product.c.product_id]).
+        where(product.c.expire_date < today_date).
+        where(product.c.product_id > after_product_id).
+        order_by(product.c.product_id).
+        limit(batch_size))]
+    if len(product_ids) == 0:
+        return 0, 0, after_product_id
+
+    # 取得した範囲の賞味期限切れの商品を移動する
+    last_product_id = product_ids[-1]
+    expired = and_(product.c.expire_date < today_date,
+                   product.c.product_id > after_product_id, product.c.product_id <= last_product_id)
+
+    # INSERT INTO product_archive SELECT * FROM product
+    # WHERE expire_date < ? AND product_id > ? AND product_id <= ?
+    # AND NOT EXISTS (SELECT product_id FROM product_archive WHERE product_archive.product_id = product.product_id) ;
+    archived = connection.execute(archive.insert().from_select(
+        product.columns.keys(),
+        select([product]).
+        where(expired).
+        where(~exists().where(archive.c.product_id == product.c.product_id)))).rowcount
+
+    # DELETE FROM product WHERE expire_date < ? AND product_id > ? AND product_id <= ? ;
+    deleted = connection.execute(product.delete().
+                                 where(expired)).rowcount
+    return deleted, archived, last_product_id
+
+
+def purge(today_date, batch_size=Purge.BATCH_SIZE, pause=Purge.PAUSE, running=lambda: True):
+    """purge
+        * 賞味期限切れの商品が無くなるまで、バッチごとにコミットしながら移動する
+
+    Args:
+        today_date(date): 今日日付
+        batch_size(int): 1トランザクションで移動する商品数
+        pause(float): バッチ間の待ち時間(秒)
+        running(function): False を返した場合は次のバッチを実行しない (停止要求)
+
+    Returns:
+        dict: 削除 / アーカイブした商品数・バッチ数・処理時間
+    """
+    report = {'deleted': 0, 'archived': 0, 'batches': 0, 'max_batch_ms': 0.0}
+    started = time.perf_counter()
+    last_product_id = 0
+
+    while running():
+        batch_started = time.perf_counter()
+        with ENGINE.begin() as connection:
+            deleted, archived, last_product_id = purge_batch(connection, today_date, batch_size, last_product_id)
+
+        report['batches'] += 1
+        report['deleted'] += deleted
+        report['archived'] += archived
+        report['max_batch_ms'] = max(report['max_batch_ms'], (time.perf_counter() - batch_started) * 1000)
+
+        # 上限より少ない場合は残りが無い (ロック中で読み飛ばした商品は次回に移動する)
+        if deleted < batch_size:
+            break
+        time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+    report['max_batch_ms'] = round(report['max_batch_ms'], 1)
+    report['elapsed_sec'] = round(elapsed, 2)
+    report['rows_per_sec'] = round(report['deleted'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='賞味期限切れ商品のアーカイブ')
+    parser.add_argument('--continuous', action='store_true', help='停止するまで --interval 秒ごとに実行する')
+    parser.add_argument('--interval', type=int, default=Purge.INTERVAL, help='常駐する場合の実行間隔(秒)')
+    parser.add_argument('--batch-size', type=int, default=Purge.BATCH_SIZE, help='1トランザクションで移動する商品数')
+    parser.add_argument('--pause', type=float, default=Purge.PAUSE, help='バッチ間の待ち時間(秒)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # SIGTERM (dyno の再起動) を受けた場合は、実行中のバッチをコミットしてから終了する
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    while True:
+        report = purge(today(), args.batch_size, args.pause, lambda: not stopping)
+        print('purge: ' + json.dumps(report))
+
+        if not args.continuous:
+            break
+
+        deadline = time.monotonic() + args.interval
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(1)
+        if stopping:
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,315 @@
 """push.py
     * 日次(AM8:30)のJobプログラム
-    * 賞味期限切れ商品の削除
+    * 賞味期限切れ商品のアーカイブ (purge.py、バッチごとにコミット)
     * 賞味期限間近の商品の通知
-"""
-from linebot import (
-    LineBotApi
-)
+    * 通知対象の商品は1つのクエリ (サーバサイドカーソル) で取得し、ユーザごとにまとめながら送信する
+    * 送信は delivery.py で並行に行う (同じ内容の通知は multicast)
+    * ユーザを user_id のハッシュで分割し、複数のプロセスで並行に実行できる (--shards / --shard)
+      PostgreSQL ではシャードの条件を SQL で絞り込み、各プロセスは担当するユーザの行のみを取得する
+    * 通知したユーザ (push_log) と進捗 (push_checkpoint) を記録し、再実行時は未通知のユーザのみに送信する (--resume)
 
+    python push.py --shards 4 --shard 0 [--resume]
+"""
 from linebot.models import (
     TextSendMessage, FlexSendMessage
 )
 
 from sqlalchemy.sql.functions import *
+from sqlalchemy.dialects.postgresql import BIT
 from setting import *
+from delivery import delivery_engine, DeliveryReport
+from purge import purge
+import argparse
 import datetime
-import os
+import hashlib
+import itertools
+import json
+import operator
+import time
 
-# LineApi
-YOUR_CHANNEL_ACCESS_TOKEN = os.environ["YOUR_CHANNEL_ACCESS_TOKEN"]
-line_bot_api = LineBotApi(YOUR_CHANNEL_ACCESS_TOKEN)
+# push_checkpoint.status
+RUNNING = '0'
+DONE = '1'
 
-def main():
-    # 今日日付
-    date = datetime.datetime.now()
-    today_date = str(date.year * 10000 + date.month * 100 + date.day)
+# シャードの条件を SQL で絞り込めるか (SQLite には md5 が無いため、取得後に読み飛ばす)
+SHARD_IN_SQL = ENGINE.dialect.name == 'postgresql'
 
-    # 1週間後
-    date += datetime.timedelta(days=7)
-    limit_date = str(date.year * 10000 + date.month * 100 + date.day)
-    
-    # DELETE FROM product WHERE expire_date < ? ;
-    product = session.query(Product). \
-        filter(Product.expire_date < today_date). \
-        delete()
-    session.commit()
+# シャードの計算に使う md5 の桁数 (16進7桁 = 28bit、PostgreSQL の int に収まる正の値)
+SHARD_HASH_DIGITS = 7
 
-    # SELECT user_id FROM user WHERE status = '1'
-    users = session.query(User.user_id). \
+
+def due_products(today_date, limit_date, after_user_id=None, shards=1, shard=0):
+    """due_products
+        * 有効なユーザの、賞味期限が today_date 以降 limit_date より前の商品を取得する
+        * 賞味期限切れの商品は含めない (アーカイブはシャード0のみが行い、ロック中の商品は読み飛ばすため)
+        * サーバサイドカーソルで FETCH_SIZE 行ずつ取得するため、全件をメモリに保持しない
+        * PostgreSQL の場合は担当するシャードのユーザのみを取得する (SQLite の場合は digests で読み飛ばす)
+
+    Args:
+        today_date(date): 今日日付 (通知する賞味期限の下限)
+        limit_date(date): 通知する賞味期限の上限
+        after_user_id(str): 再開する場合は、処理済みの最後のユーザID (このユーザより後から取得する)
+        shards(int): シャード数
+        shard(int): 担当するシャード
+
+    Returns:
+        iterator: (user_id, product_name, expire_date) の行 (user_id, expire_date 順)
+    """
+    # SELECT product.user_id, product.product_name, product.expire_date
+    # FROM product JOIN "user" ON "user".user_id = product.user_id
+    # WHERE "user".status = '1' AND product.expire_date >= ? AND product.expire_date < ? [AND product.user_id > ?]
+    # [AND CAST(CAST('x' || substr(md5(product.user_id), 1, 7) AS BIT(28)) AS INTEGER) % ? = ?]
+    # ORDER BY product.user_id, product.expire_date ;
+    query = session.query(Product.user_id, Product.product_name, Product.expire_date). \
+        join(User, User.user_id == Product.user_id). \
         filter(User.status == '1'). \
-        all()
-
-    for user in users:
-        # SELECT product_name, expire_date FROM product 
-        # WHERE user_id = ? AND expire_date < ? ORDER BY expire_date;
-        products = session.query(Product.product_name, Product.expire_date). \
-            filter(Product.user_id == user). \
-            filter(Product.expire_date < limit_date). \
-            order_by(Product.expire_date).\
-            all()
-
-        if len(products) != 0:
-            expire_date = 0
-            message = Message.PUSH_HEADER
-            for product in products:
-                if product.expire_date != expire_date:
-                    expire_date = product.expire_date
-                    month = str(expire_date)[4:6]
-                    day = str(expire_date)[6:8]
-                    message += "\n***** " + month + "月" + day + "日 *****\n"
-                
-                message += "■ " + product.product_name + "\n"
-  
-            message += Message.PUSH_FOOTER
-
-            messages = TextSendMessage(text=message)
-            line_bot_api.push_message(user.user_id, messages)
+        filter(Product.expire_date >= today_date). \
+        filter(Product.expire_date < limit_date)
 
+    if after_user_id is not None:
+        query = query.filter(Product.user_id > after_user_id)
 
-if __name__ == "__main__":
-    main()
+    if shards > 1 and SHARD_IN_SQL:
+        query = query.filter(shard_expression(Product.user_id, shards) == shard)
+
+    return query. \
+        order_by(Product.user_id, Product.expire_date). \
+        yield_per(Push.FETCH_SIZE)
+
+
+def shard_of(user_id, shards):
+    """shard_of
+        * ユーザの担当シャードを返す (user_id の md5 の先頭7桁、shard_expression と同じ値)
+
+    Args:
+        user_id(str): ユーザID
+        shards(int): シャード数
+
+    Returns:
+        int: 0 〜 shards - 1
+    """
+    return int(hashlib.md5(user_id.encode('utf-8')).hexdigest()[:SHARD_HASH_DIGITS], 16) % shards
+
+
+def shard_expression(column, shards):
+    """shard_expression
+        * shard_of と同じ値を PostgreSQL で計算する式を返す
+
+    Args:
+        column(:obj:Column): ユーザIDの列
+        shards(int): シャード数
+
+    Returns:
+        obj: CAST(CAST('x' || substr(md5(user_id), 1, 7) AS BIT(28)) AS INTEGER) % shards
+    """
+    digits = literal('x') + func.substr(func.md5(column), 1, SHARD_HASH_DIGITS)
+    return cast(cast(digits, BIT(SHARD_HASH_DIGITS * 4)), Integer) % shards
+
+
+def digests(rows, shards=1, shard=0):
+    """digests
+        * user_id 順の行をユーザごとにまとめる (保持するのは処理中のユーザの行のみ)
+
+    Args:
+        rows(iterator): due_products() の行
+        shards(int): シャード数 (SQL でシャードを絞り込んだ場合は 1)
+        shard(int): 担当するシャード (他のシャードのユーザは読み飛ばす)
+
+    Returns:
+        iterator: (user_id, 商品の行のリスト)
+    """
+    for user_id, products in itertools.groupby(rows, key=operator.attrgetter('user_id')):
+        if shards == 1 or shard_of(user_id, shards) == shard:
+            yield user_id, list(products)
+
+
+def build_message(products):
+    """build_message
+        * 賞味期限ごとに商品名を並べた通知メッセージを作成する
+
+    Args:
+        products(list): 1ユーザ分の商品の行 (expire_date 順)
+
+    Returns:
+        str: 通知メッセージ
+    """
+    expire_date = None
+    message = Message.PUSH_HEADER
+    for product in products:
+        if product.expire_date != expire_date:
+            expire_date = product.expire_date
+            message += "\n***** " + expire_date.strftime('%m月%d日') + " *****\n"
+
+        message += "■ " + product.product_name + "\n"
+
+    message += Message.PUSH_FOOTER
+    return message
+
+
+def load_checkpoint(notice_date, shards, shard):
+    """load_checkpoint
+        * シャードの進捗を取得する
+
+    Returns:
+        checkpoint(row): push_checkpoint の行 (未実行の場合は None)
+    """
+    table = PushCheckpoint.__table__
+
+    # SELECT * FROM push_checkpoint WHERE notice_date = ? AND shard = ? AND shards = ? ;
+    with ENGINE.connect() as connection:
+        return connection.execute(table.select().
+                                  where(table.c.notice_date == notice_date).
+                                  where(table.c.shard == shard).
+                                  where(table.c.shards == shards)).first()
+
+
+def save_checkpoint(notice_date, shards, shard, last_user_id, users, status):
+    """save_checkpoint
+        * シャードの進捗を記録する
+        * 通知対象の取得中のトランザクション (サーバサイドカーソル) とは別の接続で確定する
 
+    Args:
+        notice_date(int): 通知日 (YYYYMMDD)
+        shards(int): シャード数
+        shard(int): シャード
+        last_user_id(str): 処理済みの最後のユーザID
+        users(int): 処理済みのユーザ数
+        status(str): RUNNING / DONE
+    """
+    table = PushCheckpoint.__table__
+    values = {'last_user_id': last_user_id, 'users': users, 'status': status, 'updated_at': int(time.time())}
 
+    with ENGINE.begin() as connection:
+        # UPDATE push_checkpoint SET ... WHERE notice_date = ? AND shard = ? AND shards = ? ;
+        result = connection.execute(table.update().
+                                    where(table.c.notice_date == notice_date).
+                                    where(table.c.shard == shard).
+                                    where(table.c.shards == shards).
+                                    values(values))
 
+        # INSERT INTO push_checkpoint VALUES (...) ; (初回のみ)
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(notice_date=notice_date, shard=shard, shards=shards, **values))
+
+
+def notified_users(notice_date, user_ids):
+    """notified_users
+        * 通知日に通知済みのユーザを返す
+
+    Args:
+        notice_date(int): 通知日 (YYYYMMDD)
+        user_ids(list): 確認するユーザID
+
+    Returns:
+        set: 通知済みのユーザID
+    """
+    table = PushLog.__table__
+
+    # SELECT user_id FROM push_log WHERE notice_date = ? AND user_id IN (...) ;
+    with ENGINE.connect() as connection:
+        rows = connection.execute(select([table.c.user_id]).
+                                  where(table.c.notice_date == notice_date).
+                                  where(table.c.user_id.in_(user_ids)))
+        return {row.user_id for row in rows}
+
+
+def mark_notified(notice_date, shard, user_ids):
+    """mark_notified
+        * 通知できたユーザを記録する (送信スレッドから、送信の成功ごとに呼び出す)
+
+    Args:
+        notice_date(int): 通知日 (YYYYMMDD)
+        shard(int): シャード
+        user_ids(list): 通知できたユーザID
+    """
+    now = int(time.time())
+
+    # INSERT INTO push_log (user_id, notice_date, shard, notified_at) VALUES (?, ?, ?, ?) ; (executemany)
+    with ENGINE.begin() as connection:
+        connection.execute(PushLog.__table__.insert(), [
+            {'user_id': user_id, 'notice_date': notice_date, 'shard': shard, 'notified_at': now}
+            for user_id in user_ids])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='賞味期限切れ商品の削除と賞味期限通知')
+    parser.add_argument('--shards', type=int, default=1, help='ユーザを分割する数')
+    parser.add_argument('--shard', type=int, default=0, help='このプロセスが担当するシャード (0 〜 shards - 1)')
+    parser.add_argument('--resume', action='store_true', help='前回の進捗 (push_checkpoint) の続きから実行する')
+    args = parser.parse_args(argv)
+
+    if not 0 <= args.shard < args.shards:
+        parser.error('--shard must be between 0 and --shards - 1')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+
+    # 今日日付 (push_log / push_checkpoint は yyyymmdd で記録する)
+    today_date = datetime.date.today()
+    notice_date = int(today_date.strftime('%Y%m%d'))
+
+    # 1週間後
+    limit_date = today_date + datetime.timedelta(days=Push.NOTICE_DAYS)
+
+    # 再開 : 完了済みのシャードは何もしない / 途中の場合は処理済みの最後のユーザより後から実行する
+    checkpoint = load_checkpoint(notice_date, args.shards, args.shard) if args.resume else None
+    if checkpoint is not None and checkpoint.status == DONE:
+        print('push: shard %d/%d already done for %d (%d users)' % (
+            args.shard, args.shards, notice_date, checkpoint.users))
+        return
+
+    after_user_id = checkpoint.last_user_id if checkpoint is not None else None
+    processed = checkpoint.users if checkpoint is not None else 0
+
+    # 賞味期限切れ商品のアーカイブは、シャード0の初回のみ行う (バッチごとにコミットする)
+    if args.shard == 0 and after_user_id is None:
+        print('push: purge ' + json.dumps(purge(today_date)))
+
+    save_checkpoint(notice_date, args.shards, args.shard, after_user_id, processed, RUNNING)
+
+    # 通知対象の商品を取得しながら、CHECKPOINT_USERS 人ずつ送信して進捗を記録する
+    query_started = time.perf_counter()
+    counts = {'rows': 0, 'users': 0, 'skipped': 0}
+    report = DeliveryReport()
+
+    # PostgreSQL はシャードの条件を SQL で絞り込むため、取得後には読み飛ばさない
+    rows = due_products(today_date, limit_date, after_user_id, args.shards, args.shard)
+    shards, shard = (1, 0) if SHARD_IN_SQL else (args.shards, args.shard)
+
+    def notices():
+        for user_id, products in digests(rows, shards, shard):
+            counts['rows'] += len(products)
+            counts['users'] += 1
+            yield user_id, build_message(products)
+
+    notices = notices()
+    while True:
+        chunk = list(itertools.islice(notices, Push.CHECKPOINT_USERS))
+        if len(chunk) == 0:
+            break
+
+        # 通知済みのユーザ (中断前の実行 / --resume なしの再実行) には送信しない
+        notified = notified_users(notice_date, [user_id for user_id, message in chunk])
+        counts['skipped'] += len(notified)
+
+        delivery_engine.deliver([notice for notice in chunk if notice[0] not in notified], report,
+                                lambda user_ids: mark_notified(notice_date, args.shard, user_ids))
+
+        processed += len(chunk)
+        save_checkpoint(notice_date, args.shards, args.shard, chunk[-1][0], processed, RUNNING)
+
+    session.commit()
+    save_checkpoint(notice_date, args.shards, args.shard, None, processed, DONE)
+
+    elapsed = time.perf_counter() - query_started
+    print('push: shard %d/%d, %d users (%d already notified) / %d products, %.0f rows/sec, job %.1f sec' % (
+        args.shard, args.shards, counts['users'], counts['skipped'], counts['rows'],
+        counts['rows'] / elapsed if elapsed > 0 else 0, time.perf_counter() - started))
+    print('push: delivery ' + json.dumps(report.as_dict()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""ranking.py
+    * レシピ検索結果の順位付け
+    * BM25(IDF) / 食材の網羅率 / レシピの人気度 からスコアを計算する
+    * 人気度は楽天レシピのカテゴリ別ランキングの順位 (recipe.recipe_rank) の逆数
+    * 上位件数のみをヒープで保持し、候補全体のソートは行わない
+"""
+
+from setting import *
+from search import search_engine, iter_intersection, iter_threshold
+from sqlalchemy.exc import OperationalError, ProgrammingError
+import heapq
+import math
+
+
+def rank_popularity(ranks):
+    """rank_popularity
+        * ランキング順位を人気度 (順位の逆数) に変換する
+
+    Args:
+        ranks(iterable): (recipe_number, recipe_rank)
+
+    Returns:
+        dict: レシピ番号をキーとした人気度 (1位 = 1.0)
+    """
+    return {recipe_number: 1.0 / rank for recipe_number, rank in ranks if rank and rank > 0}
+
+
+class RecipeRanker:
+    """RecipeRanker
+        * 転置インデックスの検索結果に順位を付けるクラス
+
+    Attributes:
+        engine(:obj:SearchEngine): 検索エンジン
+        popularity(dict): レシピ番号をキーとした人気度 (0.0 ~ 1.0)
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.popularity = {}
+
+    def set_popularity(self, popularity):
+        """set_popularity
+            * レシピの人気度を設定する
+            * 最大値が 1.0 になるように正規化する
+
+        Args:
+            popularity(dict): レシピ番号をキーとした人気度 (閲覧数・ランキング順位の逆数など)
+        """
+        highest = max(popularity.values(), default=0)
+        if highest <= 0:
+            self.popularity = {}
+            return
+
+        self.popularity = {recipe_number: value / highest for recipe_number, value in popularity.items()}
+
+    def load(self):
+        """load
+            * recipeテーブルのランキング順位から人気度を読み込む
+            * recipe_rank 列が無い (004_recipe_rank.sql が未適用) 場合は、人気度を使わずに順位付けする
+        """
+        try:
+            # SELECT recipe_number, recipe_rank FROM recipe WHERE recipe_rank IS NOT NULL ;
+            ranks = session.query(Recipe.recipe_number, Recipe.recipe_rank). \
+                filter(Recipe.recipe_rank.isnot(None)). \
+                all()
+        except (OperationalError, ProgrammingError) as e:
+            print(e.args)
+            session.rollback()
+            ranks = []
+
+        self.set_popularity(rank_popularity(ranks))
+
+    def load_snapshot(self, snapshot):
+        """load_snapshot
+            * スナップショットのランキング順位から人気度を読み込む (DB は参照しない)
+
+        Args:
+            snapshot(:obj:RecipeSnapshot): mmap で開いたスナップショット
+        """
+        self.set_popularity(rank_popularity(snapshot.recipe_ranks()))
+
+    def idf(self, posting):
+        """idf
+            * BM25 の IDF を返す
+
+        Args:
+            posting(array): 索引語のレシピ番号配列
+
+        Returns:
+            float: IDF
+        """
+        total = self.engine.document_count()
+        frequency = len(posting)
+        return math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+    def score(self, recipe_number, weights, matched_count, total_count):
+        """score
+            * レシピのスコアを計算する
+
+        Args:
+            recipe_number(int): レシピ番号
+            weights(list): 一致した索引語の IDF のリスト
+            matched_count(int): 一致した食材の数
+            total_count(int): 選択された食材の数
+
+        Returns:
+            float: スコア
+        """
+        # BM25 (索引語はレシピ内に1回のみ出現するものとして tf = 1)
+        doc_length = self.engine.doc_lengths.get(recipe_number, self.engine.avg_doc_length)
+        avg_doc_length = self.engine.avg_doc_length or 1.0
+        norm = Ranking.BM25_K1 * (1 - Ranking.BM25_B + Ranking.BM25_B * doc_length / avg_doc_length)
+        bm25 = sum(weights) * (Ranking.BM25_K1 + 1) / (1 + norm)
+
+        coverage = matched_count / total_count
+        prior = self.popularity.get(recipe_number, 0.0)
+
+        return bm25 + Ranking.COVERAGE_WEIGHT * coverage + Ranking.POPULARITY_WEIGHT * prior
+
+    def top_k(self, kana_list, limit=Ranking.LIMIT):
+        """top_k
+            * スコア上位のレシピ番号を返す
+            * 全食材を含むレシピが無い場合は、n 個中 k 個 (k = n-1, ..., 1) を含むレシピから探す
+
+        Args:
+            kana_list(list): 商品の読み仮名のリスト
+            limit(int): 返す件数
+
+        Returns:
+            list: スコアの高い順のレシピ番号
+        """
+        # 同じ読みの商品は1つの食材として扱う
+        kana_list = list(dict.fromkeys(kana_list))
+        if len(kana_list) == 0:
+            return []
+
+        postings = [self.engine.get_posting(kana) for kana in kana_list]
+        weights = [self.idf(posting) for posting in postings]
+        total_count = len(postings)
+
+        # 全食材を含むレシピ
+        heap = []
+        for recipe_number in iter_intersection(postings):
+            score = self.score(recipe_number, weights, total_count, total_count)
+            self.push(heap, score, recipe_number, limit)
+
+        # n 個中 k 個の食材を含むレシピ
+        minimum = total_count - 1
+        while len(heap) == 0 and minimum >= 1:
+            for recipe_number, matched in iter_threshold(postings, minimum):
+                matched_weights = [weights[i] for i in matched]
+                score = self.score(recipe_number, matched_weights, len(matched), total_count)
+                self.push(heap, score, recipe_number, limit)
+            minimum -= 1
+
+        # スコアの降順 (同点はレシピ番号の昇順)
+        return [recipe_number for score, sort_key, recipe_number in sorted(heap, reverse=True)]
+
+    @staticmethod
+    def push(heap, score, recipe_number, limit):
+        """push
+            * 上位 limit 件のみを保持するようにヒープへ追加する
+
+        Args:
+            heap(list): (スコア, 並び順, レシピ番号) の最小ヒープ
+            score(float): スコア
+            recipe_number(int): レシピ番号
+            limit(int): 保持する件数
+        """
+        item = (score, -recipe_number, recipe_number)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+
+recipe_ranker = RecipeRanker(search_engine)
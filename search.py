@@ -0,0 +1,677 @@
+"""search.py
+    * レシピ検索エンジン
+    * inverted_indexテーブルを1度だけ読み込み、index_kana をキーとしたソート済み整数配列で保持する
+    * 複数食材の積集合はギャロッピング探索で求める
+    * 読み込み後に追加されたレシピは差分の転置インデックスで検索し、バックグラウンドで統合する
+"""
+
+from setting import *
+from kana import normalize_kana, kana_converter
+from vocabulary import KanaVocabulary
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+import heapq
+import threading
+import time
+
+# 転置インデックス配列の型 (unsigned int)
+POSTING_TYPE = 'I'
+
+
+def parse_posting(index_str):
+    """parse_posting
+        * カンマ区切りの転置インデックス文字列をソート済み整数配列に変換する
+
+    Args:
+        index_str(str): inverted_index.index の値
+
+    Returns:
+        array: 重複を除いた昇順のレシピ番号配列
+    """
+    if not index_str:
+        return array(POSTING_TYPE)
+
+    numbers = {int(number) for number in index_str.split(',') if number.strip()}
+    return array(POSTING_TYPE, sorted(numbers))
+
+
+def merge_posting(left, right):
+    """merge_posting
+        * 2つのソート済み配列の和集合を返す
+
+    Args:
+        left(array): ソート済みのレシピ番号配列
+        right(array): ソート済みのレシピ番号配列
+
+    Returns:
+        array: 和集合のソート済み配列
+    """
+    return array(POSTING_TYPE, sorted(set(left).union(right)))
+
+
+def union_all(postings):
+    """union_all
+        * 複数のソート済み配列の和集合を求める
+
+    Args:
+        postings(list): ソート済みのレシピ番号配列のリスト
+
+    Returns:
+        array: 和集合のソート済み配列
+    """
+    if len(postings) == 1:
+        return postings[0]
+
+    result = array(POSTING_TYPE)
+    for value in heapq.merge(*postings):
+        if len(result) == 0 or result[-1] != value:
+            result.append(value)
+
+    return result
+
+
+def intersect(left, right):
+    """intersect
+        * 2つのソート済み配列の積集合をギャロッピング探索で求める
+        * 短い配列の各要素について、長い配列を指数的に範囲を広げながら二分探索する
+
+    Args:
+        left(array): ソート済みのレシピ番号配列
+        right(array): ソート済みのレシピ番号配列
+
+    Returns:
+        array: 積集合のソート済み配列
+    """
+    if len(left) > len(right):
+        left, right = right, left
+
+    result = array(POSTING_TYPE)
+    length = len(right)
+    position = 0
+
+    for value in left:
+        # 探索範囲を 1, 2, 4, 8... と広げる
+        bound = 1
+        while position + bound < length and right[position + bound] < value:
+            bound *= 2
+
+        position = bisect_left(right, value, position, min(position + bound + 1, length))
+        if position == length:
+            break
+
+        if right[position] == value:
+            result.append(value)
+            position += 1
+
+    return result
+
+
+def iter_intersection(postings):
+    """iter_intersection
+        * 複数のソート済み配列の積集合を昇順に1件ずつ返す
+        * 積集合全体を作らずに、最も短い配列を基準にギャロッピング探索する
+
+    Args:
+        postings(list): ソート済みのレシピ番号配列のリスト
+
+    Yields:
+        int: 全ての配列に含まれるレシピ番号
+    """
+    if len(postings) == 0:
+        return
+
+    ordered = sorted(postings, key=len)
+    driver = ordered[0]
+    others = ordered[1:]
+    positions = [0] * len(others)
+
+    for value in driver:
+        matched = True
+        for i, other in enumerate(others):
+            length = len(other)
+            position = positions[i]
+
+            bound = 1
+            while position + bound < length and other[position + bound] < value:
+                bound *= 2
+            position = bisect_left(other, value, position, min(position + bound + 1, length))
+            positions[i] = position
+
+            # いずれかの配列を末尾まで探索した場合は、以降の値も一致しない
+            if position == length:
+                return
+
+            if other[position] != value:
+                matched = False
+                break
+
+        if matched:
+            yield value
+
+
+def iter_threshold(postings, minimum):
+    """iter_threshold
+        * 複数のソート済み配列のうち、minimum 個以上に含まれるレシピ番号を昇順に返す
+
+    Args:
+        postings(list): ソート済みのレシピ番号配列のリスト
+        minimum(int): 最低限含まれるべき配列の数
+
+    Yields:
+        tuple: (レシピ番号, 含まれる配列の添字のリスト)
+    """
+    streams = [zip(posting, repeat(i)) for i, posting in enumerate(postings)]
+
+    current = None
+    matched = []
+    for value, i in heapq.merge(*streams):
+        if value != current:
+            if current is not None and len(matched) >= minimum:
+                yield current, matched
+            current = value
+            matched = []
+        matched.append(i)
+
+    if current is not None and len(matched) >= minimum:
+        yield current, matched
+
+
+def intersect_all(postings):
+    """intersect_all
+        * 複数のソート済み配列の積集合を求める
+        * 短い配列から順に積集合を取り、途中で0件になれば打ち切る
+
+    Args:
+        postings(list): ソート済みのレシピ番号配列のリスト
+
+    Returns:
+        array: 積集合のソート済み配列
+    """
+    if len(postings) == 0:
+        return array(POSTING_TYPE)
+
+    ordered = sorted(postings, key=len)
+    result = ordered[0]
+    for posting in ordered[1:]:
+        if len(result) == 0:
+            break
+        result = intersect(result, posting)
+
+    return array(POSTING_TYPE, result)
+
+
+def read_postings():
+    """read_postings
+        * inverted_indexテーブルを読み込み、読み仮名をキーとしたソート済み整数配列を作成する
+
+    Returns:
+        dict: index_kana をキーとしたレシピ番号配列
+    """
+    # SELECT index_kana, index FROM inverted_index ;
+    rows = session.query(InvertedIndex.index_kana, InvertedIndex.index). \
+        all()
+
+    postings = {}
+    for row in rows:
+        index_kana = normalize_kana(row.index_kana)
+        if index_kana == '':
+            continue
+
+        posting = parse_posting(row.index)
+        # 同じ読みのレコードは和集合にまとめる
+        if index_kana in postings:
+            posting = merge_posting(postings[index_kana], posting)
+        postings[index_kana] = posting
+
+    return postings
+
+
+def count_doc_lengths(postings):
+    """count_doc_lengths
+        * レシピごとの索引語の数 (BM25 の文書長) を数える (全ての転置インデックスを走査するため、読み込み時のみ使う)
+
+    Args:
+        postings(dict): index_kana をキーとしたレシピ番号配列
+
+    Returns:
+        dict: レシピ番号をキーとした索引語の数
+    """
+    doc_lengths = {}
+    for posting in postings.values():
+        for recipe_number in posting:
+            doc_lengths[recipe_number] = doc_lengths.get(recipe_number, 0) + 1
+
+    return doc_lengths
+
+
+class DocLengths:
+    """DocLengths
+        * レシピごとの索引語の数 (BM25 の文書長) とその合計
+        * 作成後は変更せず、レシピの追加 / 削除は変更分だけを反映した新しい DocLengths を返す
+          (差分の確認・削除のたびに転置インデックス全体を数え直さない)
+
+    Attributes:
+        base(dict): 読み込み時に数えた文書長 (レシピ番号 → 索引語の数)
+        changes(dict): base からの変更 (レシピ番号 → 索引語の数、0 は削除済み)
+        total(int): 文書長の合計
+        count(int): レシピ数
+    """
+
+    def __init__(self, base, changes=None, total=None, count=None):
+        self.base = base
+        self.changes = changes or {}
+        self.total = sum(base.values()) if total is None else total
+        self.count = len(base) if count is None else count
+
+    def get(self, recipe_number, default=None):
+        length = self.changes.get(recipe_number)
+        if length is None:
+            length = self.base.get(recipe_number)
+        return length if length else default
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, recipe_number):
+        return self.get(recipe_number) is not None
+
+    def __iter__(self):
+        for recipe_number in self.base:
+            if recipe_number not in self.changes:
+                yield recipe_number
+        for recipe_number, length in self.changes.items():
+            if length:
+                yield recipe_number
+
+    def average(self):
+        return self.total / self.count if self.count else 0.0
+
+    def updated(self, lengths):
+        """updated
+            * 指定したレシピの文書長を変更した DocLengths を返す (変更するレシピ数に比例する処理のみ行う)
+
+        Args:
+            lengths(dict): レシピ番号をキーとした新しい索引語の数 (0 は削除)
+
+        Returns:
+            DocLengths: 変更後の文書長
+        """
+        changes = dict(self.changes)
+        total = self.total
+        count = self.count
+        for recipe_number, length in lengths.items():
+            previous = self.get(recipe_number, 0)
+            total += length - previous
+            count += bool(length) - bool(previous)
+            changes[recipe_number] = length
+
+        return DocLengths(self.base, changes, total, count)
+
+    def compacted(self):
+        """compacted
+            * 変更を base に反映した DocLengths を返す (転置インデックスの統合時に使う)
+
+        Returns:
+            DocLengths: 変更を反映した文書長
+        """
+        if len(self.changes) == 0:
+            return self
+
+        return DocLengths({recipe_number: self.get(recipe_number) for recipe_number in self},
+                          None, self.total, self.count)
+
+
+def posting_watermark(postings):
+    """posting_watermark
+        * 転置インデックスに含まれる最大のレシピ番号を返す
+        * recipeテーブルの最大値を使うと、索引作成後に収集したレシピが差分の確認から漏れるため、転置インデックスから求める
+
+    Args:
+        postings(dict): index_kana をキーとしたソート済みレシピ番号配列
+
+    Returns:
+        int: 最大のレシピ番号 (空の場合は 0)
+    """
+    return max((posting[-1] for posting in postings.values() if len(posting) != 0), default=0)
+
+
+class IndexState:
+    """IndexState
+        * ある時点の転置インデックス全体
+        * 作成後は変更せず、更新時は新しい IndexState に差し替える (検索中のスレッドは古い状態を参照し続けられる)
+
+    Attributes:
+        postings(dict): メインの転置インデックス (index_kana → レシピ番号配列)
+        delta(dict): 前回の読み込み以降に追加されたレシピの転置インデックス
+        tombstones(frozenset): 削除済みのレシピ番号
+        vocabulary(:obj:KanaVocabulary): 索引語の辞書
+        watermark(int): 転置インデックスに反映済みの最大レシピ番号
+        doc_lengths(:obj:DocLengths): レシピ番号をキーとした、レシピに含まれる索引語の数 (削除済みのレシピを除く)
+        avg_doc_length(float): レシピに含まれる索引語の数の平均
+    """
+
+    def __init__(self, postings, delta, tombstones, vocabulary, watermark, doc_lengths):
+        self.postings = postings
+        self.delta = delta
+        self.tombstones = frozenset(tombstones)
+        self.vocabulary = vocabulary
+        self.watermark = watermark
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = doc_lengths.average()
+
+    def get_posting(self, term):
+        """get_posting
+            * 索引語のレシピ番号配列を返す (追加分を含み、削除済みのレシピを除く)
+
+        Args:
+            term(str): 索引語
+
+        Returns:
+            array: ソート済みのレシピ番号配列
+        """
+        posting = self.postings.get(term, array(POSTING_TYPE))
+        added = self.delta.get(term)
+        if added is not None:
+            posting = union_all([posting, added])
+
+        if len(self.tombstones) != 0:
+            posting = array(POSTING_TYPE, [number for number in posting if number not in self.tombstones])
+
+        return posting
+
+
+class SearchEngine:
+    """SearchEngine
+        * メモリ上の転置インデックスからレシピを検索するクラス
+        * 新しく登録されたレシピは差分(delta)の転置インデックスに追加し、バックグラウンドでメインに統合する
+
+    Attributes:
+        state(:obj:IndexState): 現在の転置インデックス
+        snapshot(:obj:RecipeSnapshot): 読み込んだスナップショット (未使用の場合は None)
+        loaded(bool): 転置インデックス読み込み済みなら True
+        refreshed(float): 最後に差分を確認した時刻
+    """
+
+    def __init__(self):
+        self.state = IndexState({}, {}, set(), KanaVocabulary([]), 0, DocLengths({}))
+        self.snapshot = None
+        self.loaded = False
+        self.refreshed = 0.0
+        self.__lock = threading.Lock()
+        self.__write_lock = threading.Lock()
+        self.__worker = None
+
+    @property
+    def postings(self):
+        return self.state.postings
+
+    @property
+    def vocabulary(self):
+        return self.state.vocabulary
+
+    @property
+    def doc_lengths(self):
+        return self.state.doc_lengths
+
+    @property
+    def avg_doc_length(self):
+        return self.state.avg_doc_length
+
+    def load(self):
+        """load
+            * inverted_indexテーブルを読み込み、転置インデックスを作成する
+        """
+        with self.__write_lock:
+            postings = read_postings()
+            watermark = posting_watermark(postings)
+
+            # 参照を差し替えるだけなので、検索中のスレッドは古い状態をそのまま参照できる
+            self.state = IndexState(postings, {}, set(), KanaVocabulary(postings.keys()), watermark,
+                                    DocLengths(count_doc_lengths(postings)))
+            self.refreshed = time.monotonic()
+            self.loaded = True
+
+    def load_snapshot(self, snapshot):
+        """load_snapshot
+            * スナップショットから転置インデックスを読み込む (DB は参照しない)
+            * 転置インデックスと文書長は mmap 上の配列を参照するため、レシピ数に比例する処理を行わない
+            * スナップショット作成後に追加されたレシピは差分の確認で読み込まれる
+
+        Args:
+            snapshot(:obj:RecipeSnapshot): mmap で開いたスナップショット
+        """
+        with self.__write_lock:
+            # 文書長はスナップショットの配列をそのまま参照し、索引語の辞書は最初に使う時に作成する
+            postings = snapshot.postings
+            doc_lengths = DocLengths(snapshot.doc_lengths, None, snapshot.total_doc_length, len(snapshot.doc_lengths))
+            self.state = IndexState(postings, {}, set(), KanaVocabulary(postings.keys(), lazy=True),
+                                    snapshot.watermark, doc_lengths)
+            self.snapshot = snapshot
+            self.refreshed = time.monotonic()
+            self.loaded = True
+
+    def find_recipe(self, recipe_number):
+        """find_recipe
+            * スナップショットからレシピ情報を取り出す
+
+        Args:
+            recipe_number(int): レシピ番号
+
+        Returns:
+            tuple: (recipe_number, recipe_name, recipe_photo, recipe_url) (スナップショット未使用 / 存在しない場合は None)
+        """
+        if self.snapshot is None:
+            return None
+
+        return self.snapshot.find_recipe(recipe_number)
+
+    def ensure_loaded(self):
+        """ensure_loaded
+            * 未読み込みの場合のみ転置インデックスを読み込む
+            * 読み込み済みの場合は、一定間隔でバックグラウンドの差分確認を開始する
+        """
+        if self.loaded:
+            if time.monotonic() - self.refreshed > Delta.REFRESH_INTERVAL:
+                self.start_background(self.refresh)
+            return
+
+        with self.__lock:
+            if not self.loaded:
+                self.load()
+
+    def start_background(self, target):
+        """start_background
+            * 差分確認 / 統合をバックグラウンドのスレッドで実行する (同時に1つまで)
+
+        Args:
+            target(function): 実行する処理
+        """
+        with self.__lock:
+            if self.__worker is not None and self.__worker.is_alive():
+                return
+
+            # 実行中に再度呼び出されないよう、開始時点で確認時刻を更新する
+            self.refreshed = time.monotonic()
+            self.__worker = threading.Thread(target=self.run_background, args=(target,), daemon=True)
+            self.__worker.start()
+
+    @staticmethod
+    def run_background(target):
+        """run_background
+            * バックグラウンドのスレッドで処理を実行し、スレッドのDBセッションを破棄する
+
+        Args:
+            target(function): 実行する処理
+        """
+        try:
+            target()
+        except Exception as e:
+            print(e.args)
+        finally:
+            session.remove()
+
+    def refresh(self):
+        """refresh
+            * 転置インデックスに未反映のレシピを読み込み、差分の転置インデックスに追加する
+            * 差分が一定件数を超えた場合はメインの転置インデックスに統合する
+        """
+        with self.__write_lock:
+            state = self.state
+
+            # SELECT recipe_number, material FROM recipe WHERE recipe_number > ? ORDER BY recipe_number ;
+            recipes = session.query(Recipe.recipe_number, Recipe.material). \
+                filter(Recipe.recipe_number > state.watermark). \
+                order_by(Recipe.recipe_number). \
+                all()
+
+            self.refreshed = time.monotonic()
+            if len(recipes) == 0:
+                return
+
+            self.add_recipes(recipes)
+
+        if len(self.state.delta) != 0 and self.delta_size() >= Delta.COMPACT_THRESHOLD:
+            self.compact()
+
+    def add_recipes(self, recipes):
+        """add_recipes
+            * レシピを差分の転置インデックスに追加する (書き込みロック取得済みで呼び出すこと)
+            * 材料をカタカナに変換し、含まれる既存の索引語を索引語とする
+
+        Args:
+            recipes(list): recipe_number, material を持つレコードのリスト
+        """
+        state = self.state
+        materials = kana_converter.to_kana_batch([recipe.material or '' for recipe in recipes], use_cache=False)
+
+        added = {}
+        lengths = {}
+        watermark = state.watermark
+        for recipe, material in zip(recipes, materials):
+            watermark = max(watermark, recipe.recipe_number)
+            terms = state.vocabulary.contained_terms(material)
+            for term in terms:
+                added.setdefault(term, []).append(recipe.recipe_number)
+
+            # 追加したレシピの文書長のみ更新する (削除済みのレシピは数えない)
+            if len(terms) != 0 and recipe.recipe_number not in state.tombstones:
+                lengths[recipe.recipe_number] = state.doc_lengths.get(recipe.recipe_number, 0) + len(terms)
+
+        delta = dict(state.delta)
+        for term, numbers in added.items():
+            delta[term] = union_all([delta.get(term, array(POSTING_TYPE)), array(POSTING_TYPE, sorted(numbers))])
+
+        self.state = IndexState(state.postings, delta, state.tombstones, state.vocabulary, watermark,
+                                state.doc_lengths.updated(lengths))
+
+    def remove_recipes(self, recipe_numbers):
+        """remove_recipes
+            * 削除されたレシピを検索結果から除外する (次の統合時に転置インデックスからも削除する)
+
+        Args:
+            recipe_numbers(list): 削除されたレシピ番号
+        """
+        self.ensure_loaded()
+        with self.__write_lock:
+            state = self.state
+            tombstones = state.tombstones.union(recipe_numbers)
+            doc_lengths = state.doc_lengths.updated({number: 0 for number in recipe_numbers
+                                                     if number in state.doc_lengths})
+            self.state = IndexState(state.postings, state.delta, tombstones, state.vocabulary, state.watermark,
+                                    doc_lengths)
+
+    def compact(self):
+        """compact
+            * 差分の転置インデックスをメインに統合し、削除済みのレシピを取り除く
+            * 新しい状態を作成してから差し替えるため、検索中のスレッドは待たされない
+        """
+        with self.__write_lock:
+            # SELECT recipe_number FROM recipe ;
+            existing = {recipe.recipe_number for recipe in session.query(Recipe.recipe_number).all()}
+
+            state = self.state
+            removed = [number for number in state.doc_lengths if number not in existing]
+            tombstones = set(state.tombstones)
+            tombstones.update(removed)
+
+            postings = {}
+            for term in set(state.postings).union(state.delta):
+                posting = state.postings.get(term, array(POSTING_TYPE))
+                if term in state.delta:
+                    posting = union_all([posting, state.delta[term]])
+                if len(tombstones) != 0:
+                    posting = array(POSTING_TYPE, [number for number in posting if number not in tombstones])
+                postings[term] = posting
+
+            doc_lengths = state.doc_lengths.updated({number: 0 for number in removed}).compacted()
+            self.state = IndexState(postings, {}, set(), state.vocabulary, state.watermark, doc_lengths)
+
+    def delta_size(self):
+        """delta_size
+            * 差分の転置インデックスに含まれるレシピ数を返す
+
+        Returns:
+            int: レシピ数
+        """
+        recipe_numbers = set()
+        for posting in self.state.delta.values():
+            recipe_numbers.update(posting)
+
+        return len(recipe_numbers)
+
+    def get_posting(self, kana):
+        """get_posting
+            * 読み仮名に対応するレシピ番号配列を返す
+            * 索引語と完全一致しない場合は、辞書で対応付けた索引語の和集合を返す
+
+        Args:
+            kana(str): 商品の読み仮名 (product_kana)
+
+        Returns:
+            array: ソート済みのレシピ番号配列 (該当なしの場合は空配列)
+        """
+        self.ensure_loaded()
+        state = self.state
+        terms = state.vocabulary.resolve(normalize_kana(kana))
+        if len(terms) == 0:
+            return array(POSTING_TYPE)
+
+        return union_all([state.get_posting(term) for term in terms])
+
+    def search(self, kana_list):
+        """search
+            * 全ての読み仮名を含むレシピ番号を返す
+
+        Args:
+            kana_list(list): 商品の読み仮名のリスト
+
+        Returns:
+            array: 積集合のソート済みレシピ番号配列
+        """
+        return intersect_all([self.get_posting(kana) for kana in kana_list])
+
+    def count(self, kana_list):
+        """count
+            * 全ての読み仮名を含むレシピ件数を返す
+
+        Args:
+            kana_list(list): 商品の読み仮名のリスト
+
+        Returns:
+            int: 検索ヒット数
+        """
+        return len(self.search(kana_list))
+
+    def document_count(self):
+        """document_count
+            * 転置インデックスに含まれるレシピ数を返す
+
+        Returns:
+            int: レシピ数
+        """
+        self.ensure_loaded()
+        return len(self.state.doc_lengths)
+
+
+search_engine = SearchEngine()
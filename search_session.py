@@ -0,0 +1,181 @@
+"""search_session.py
+    * レシピ検索画面のユーザごとの検索状態
+    * 選択中の商品ごとの転置インデックス配列と、その積集合を保持する
+    * 商品の選択は積集合に追加するだけ、選択解除は保持している配列からのみ再計算する
+"""
+
+from setting import *
+from search import search_engine, intersect, intersect_all
+import threading
+import time
+
+
+class SearchSession:
+    """SearchSession
+        * 1ユーザ分のレシピ検索状態
+
+    Attributes:
+        user_id(str): ユーザID
+        selection(list): 選択中のproduct_id (選択順)
+        kana(dict): product_id をキーとした読み仮名 (削除済みの商品は None)
+        postings(dict): product_id をキーとしたレシピ番号配列
+        result(array): 選択中の商品を全て含むレシピ番号配列
+        accessed(float): 最終アクセス時刻
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.selection = []
+        self.kana = {}
+        self.postings = {}
+        self.result = None
+        self.accessed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def select(self, product_id):
+        """select
+            * 商品を選択し、積集合を更新する
+
+        Args:
+            product_id(str): 選択した商品のproduct_id
+        """
+        self.selection.append(product_id)
+        posting = self.postings.get(product_id)
+        if posting is None:
+            return
+
+        self.result = posting if self.result is None else intersect(self.result, posting)
+
+    def deselect(self, product_id):
+        """deselect
+            * 商品の選択を解除し、残りの商品の配列から積集合を再計算する
+
+        Args:
+            product_id(str): 選択解除した商品のproduct_id
+        """
+        self.selection.remove(product_id)
+        postings = [self.postings[marker] for marker in self.selection if self.postings.get(marker) is not None]
+        self.result = intersect_all(postings) if len(postings) != 0 else None
+
+    def kana_list(self):
+        """kana_list
+            * 選択中の商品の読み仮名を返す
+
+        Returns:
+            list: 読み仮名のリスト
+        """
+        return [self.kana[marker] for marker in self.selection if self.kana.get(marker) is not None]
+
+    def hit_count(self):
+        """hit_count
+            * 検索ヒット数を返す
+
+        Returns:
+            int: 選択中の商品を全て含むレシピ件数
+        """
+        return 0 if self.result is None else len(self.result)
+
+
+class SearchSessionStore:
+    """SearchSessionStore
+        * ユーザIDをキーとして SearchSession を保持するクラス
+        * 最終アクセスから timeout 秒経過した検索状態は破棄する
+
+    Attributes:
+        timeout(int): 検索状態を保持する秒数
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    def sync(self, user_id, marker_array):
+        """sync
+            * ユーザの検索状態を選択中の商品に合わせて更新する
+            * 未取得の商品のみ読み仮名を取得し、差分だけ選択 / 選択解除する
+
+        Args:
+            user_id(str): ユーザID
+            marker_array(list): 選択中のproduct_idリスト
+
+        Returns:
+            search_session(:obj:SearchSession): 更新後の検索状態
+        """
+        search_session = self.get(user_id)
+
+        with search_session.lock:
+            markers = [str(marker) for marker in marker_array]
+
+            # SELECT product_id, product_kana FROM product WHERE product_id IN (...) ;
+            missing = [marker for marker in markers if marker not in search_session.kana]
+            if len(missing) != 0:
+                products = session.query(Product.product_id, Product.product_kana). \
+                    filter(Product.product_id.in_(missing)). \
+                    all()
+
+                for marker in missing:
+                    search_session.kana[marker] = None
+                for product in products:
+                    search_session.kana[str(product.product_id)] = product.product_kana
+                    search_session.postings[str(product.product_id)] = search_engine.get_posting(product.product_kana)
+
+            for marker in list(search_session.selection):
+                if marker not in markers:
+                    search_session.deselect(marker)
+
+            for marker in markers:
+                if marker not in search_session.selection:
+                    search_session.select(marker)
+
+        return search_session
+
+    def get(self, user_id):
+        """get
+            * ユーザの検索状態を返す (存在しない / 期限切れの場合は新規作成)
+
+        Args:
+            user_id(str): ユーザID
+
+        Returns:
+            search_session(:obj:SearchSession): 検索状態
+        """
+        now = time.monotonic()
+        with self.__lock:
+            self.evict_expired(now)
+
+            search_session = self.__sessions.get(user_id)
+            if search_session is None:
+                search_session = SearchSession(user_id)
+                self.__sessions[user_id] = search_session
+
+            search_session.accessed = now
+            return search_session
+
+    def evict(self, user_id):
+        """evict
+            * ユーザの検索状態を破棄する
+
+        Args:
+            user_id(str): ユーザID
+        """
+        with self.__lock:
+            self.__sessions.pop(user_id, None)
+
+    def evict_expired(self, now):
+        """evict_expired
+            * 期限切れの検索状態を破棄する (ロック取得済みで呼び出すこと)
+
+        Args:
+            now(float): 現在時刻
+        """
+        expired = [user_id for user_id, search_session in self.__sessions.items()
+                   if now - search_session.accessed > self.timeout]
+        for user_id in expired:
+            del self.__sessions[user_id]
+
+    def __len__(self):
+        return len(self.__sessions)
+
+
+search_session_store = SearchSessionStore(Expiry.SEARCH_SESSION)
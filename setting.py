@@ -17,6 +17,12 @@ import os
 class DB:
     URL = os.environ["DATABASE_URL"]
     
+# ***************
+#  レシピのスナップショット
+# ***************
+class Snapshot:
+    PATH = os.getenv("RECIPE_SNAPSHOT", "")  # 未設定の場合は DB から読み込む
+
 # ***************
 #  LINE BOT
 # ***************
@@ -24,6 +30,50 @@ class BOT:
     YOUR_CHANNEL_ACCESS_TOKEN = os.environ["YOUR_CHANNEL_ACCESS_TOKEN"]
     YOUR_CHANNEL_SECRET = os.environ["YOUR_CHANNEL_SECRET"]
 
+# ***************
+#  LINE API クライアント
+# ***************
+class LineApi:
+    ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")   # スタブサーバを使う場合は変更する
+    CONNECT_TIMEOUT = float(os.getenv("LINE_API_CONNECT_TIMEOUT", "3"))  # 接続のタイムアウト(秒)
+    READ_TIMEOUT = float(os.getenv("LINE_API_READ_TIMEOUT", "10"))       # 応答のタイムアウト(秒)
+    POOL_SIZE = int(os.getenv("LINE_API_POOL_SIZE", "10"))              # 保持するコネクション数
+    MAX_RETRIES = int(os.getenv("LINE_API_MAX_RETRIES", "3"))           # 429 / 5xx の再試行回数
+    BACKOFF_BASE = 0.5                                                  # 再試行の待機時間の基準(秒)
+    BACKOFF_MAX = 8.0                                                   # 再試行の待機時間の上限(秒)
+    LATENCY_SAMPLES = 1024                                              # エンドポイントごとに保持する処理時間の件数
+
+# ***************
+#  webhook
+# ***************
+class Webhook:
+    MODE = os.getenv("WEBHOOK_MODE", "sync")                  # sync: 応答前に処理 / async: キュー登録後すぐに応答
+    WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))          # ワーカースレッド数
+    QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))  # キューに保持するイベント数
+    ENQUEUE_TIMEOUT = 0.5                                     # キューの空きを待つ秒数
+
+# ***************
+#  webhook の再送判定
+# ***************
+class Dedup:
+    MODE = os.getenv("WEBHOOK_DEDUP", "memory")   # off / memory: プロセス内 / table: webhook_eventテーブルで複数プロセス共有
+    TTL = 3600                                    # 処理済みのイベントを保持する秒数
+    PURGE_INTERVAL = 300                          # webhook_eventテーブルの期限切れを削除する間隔 (秒)
+
+# ***************
+#  WSGI サーバ (gunicorn.conf.py)
+# ***************
+class Server:
+    BIND = "0.0.0.0:" + os.getenv("PORT", "5000")
+    WORKERS = int(os.getenv("WEB_CONCURRENCY", "2"))                  # ワーカープロセス数
+    THREADS = int(os.getenv("WEB_THREADS", "4"))                      # 1プロセスで同時に受け付けるリクエスト数
+    MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "5000"))         # ワーカーを再起動するまでのリクエスト数 (0:再起動しない)
+    MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "500"))  # 再起動が重ならないよう加える揺らぎ
+    TIMEOUT = 30                                                      # 応答の無いワーカーを再起動する秒数
+    GRACEFUL_TIMEOUT = 20                                             # 終了時に処理中のリクエストを待つ秒数
+    DRAIN_TIMEOUT = 8                                                 # 終了時にキューのイベントを待つ秒数 (Heroku は30秒で強制終了)
+    KEEPALIVE = 5                                                     # keep-alive の待機秒数
+
 # ***************
 #  menu_type
 # ***************
@@ -88,6 +138,54 @@ class Command:
     BACK = 'back'
     NEXT = 'next'
 
+# ***************
+#  レシピ検索の順位付け
+# ***************
+class Ranking:
+    LIMIT = 10               # 表示するレシピ件数
+    BM25_K1 = 1.2            # BM25 の単語頻度の飽和パラメータ
+    BM25_B = 0.75            # BM25 の文書長の正規化パラメータ
+    COVERAGE_WEIGHT = 2.0    # 選択した食材の網羅率の重み
+    POPULARITY_WEIGHT = 1.0  # レシピの人気度 (カテゴリ別ランキングの順位の逆数) の重み
+
+# ***************
+#  キャッシュ件数
+# ***************
+class CacheSize:
+    RECIPE_BUBBLE = 2048     # 作成済みのレシピ Flex Message
+    PRODUCT_KANA = 4096      # 商品名の読み仮名
+    TERM_RESOLUTION = 4096   # 読み仮名に対応する索引語
+    STATUS = 10000           # ユーザごとの会話の位置 (status)
+    WEBHOOK_EVENT = 50000    # 処理済みの webhook イベント (再送の判定)
+
+# ***************
+#  statusテーブルのキャッシュ
+# ***************
+class StatusWrite:
+    # off: キャッシュしない / write_through: 同じトランザクションで更新 / write_behind: まとめて後から更新
+    # プロセス内のキャッシュのため、複数プロセスで起動する場合は off にすること
+    MODE = os.getenv("STATUS_CACHE", "off")
+    FLUSH_DELAY = 0.5        # write_behind で連続した更新をまとめる秒数
+
+# ***************
+#  索引語の辞書
+# ***************
+class Vocabulary:
+    MIN_TERM_LENGTH = 2      # 部分一致で使用する索引語の最小文字数
+    MAX_EXPANSION = 10       # 前方一致 / 部分一致で展開する索引語の最大数
+
+# ***************
+#  転置インデックスの差分
+# ***************
+class Delta:
+    REFRESH_INTERVAL = 300   # 新しいレシピを確認する間隔 (秒)
+    COMPACT_THRESHOLD = 200  # メインの転置インデックスに統合するレシピ数
+
+# ***************
+#  保持期間 (秒)
+# ***************
+class Expiry:
+    SEARCH_SESSION = 600     # レシピ検索画面の検索状態
 
 # ***************
 #  楽天API設定
@@ -99,6 +197,43 @@ class API:
 class CategoryAPI:
     FORM = 'https://app.rakuten.co.jp/services/api/Recipe/CategoryList/20170426?format=json&applicationId=1050949629223131297'
 
+# ***************
+#  賞味期限通知 (push.py)
+# ***************
+class Push:
+    NOTICE_DAYS = 7          # 通知する賞味期限 (今日から何日後まで)
+    FETCH_SIZE = 1000        # サーバサイドカーソルから1度に取得する行数
+    CHECKPOINT_USERS = 2000  # 進捗 (push_checkpoint) を記録する間隔 (ユーザ数)
+
+# ***************
+#  賞味期限切れ商品の削除 (purge.py)
+# ***************
+class Purge:
+    BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))   # 1トランザクションで移動する商品数
+    PAUSE = float(os.getenv("PURGE_PAUSE_SEC", "0.05"))       # バッチ間の待ち時間(秒) (他のトランザクションを優先する)
+    INTERVAL = int(os.getenv("PURGE_INTERVAL_SEC", "600"))    # 常駐して実行する場合の実行間隔(秒)
+
+# ***************
+#  通知の送信 (delivery.py)
+# ***************
+class Delivery:
+    SENDERS = int(os.getenv("PUSH_SENDERS", "16"))     # 同時に送信するスレッド数
+    PUSH_RATE = 2000                                   # push の秒間リクエスト数の上限 (LINE の制限)
+    MULTICAST_RATE = 200                               # multicast の秒間リクエスト数の上限 (LINE の制限)
+    MULTICAST_SIZE = 500                               # multicast 1回の送信先の上限
+    GROUP_WINDOW = 5000                                # 同じ内容の通知をまとめるために保持するユーザ数
+    MAX_RETRIES = 5                                    # 429 / 5xx の再試行回数
+    FAILED_SAMPLES = 20                                # 送信に失敗したユーザIDを報告する件数
+
+# ***************
+#  SQL の計測 (instrument.py)
+# ***************
+class Instrument:
+    ENABLED = os.getenv("SQL_INSTRUMENT", "off") == "on"       # off の場合はイベントフックを登録しない
+    SAMPLE_RATE = float(os.getenv("SQL_SAMPLE_RATE", "0.01"))  # SQL をログに出力するイベントの割合
+    SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))           # 必ずログに出力する SQL の処理時間(ms)
+    STATEMENT_LENGTH = 200                                     # ログに出力する SQL の最大文字数
+
 # ***************
 #  SQLAlchemy
 # ***************
@@ -107,7 +242,7 @@ DATABASE = DB.URL
 ENGINE = create_engine(
     DATABASE,
     encoding="utf-8",
-    echo=True  # True:実行時SQL発行
+    echo=os.getenv("SQL_ECHO", "off") == "on"  # on:実行時SQL発行 (全件をログに出力するため開発時のみ使用する)
 )
 
 # Sessionの作成
@@ -150,14 +285,70 @@ class Status(Base):
 # ***************
 class Product(Base):
     __tablename__ = "product"
+    __table_args__ = (
+        Index('product_user_id_expire_date', 'user_id', 'expire_date'),  # 商品一覧 / 賞味期限通知
+        Index('product_expire_date', 'expire_date'),                     # 賞味期限切れ商品のアーカイブ
+    )
     product_id = Column('product_id', Integer, primary_key=True)
     product_name = Column('product_name', String(15))
     product_kana = Column('product_kana', String(30))
     user_id = Column('user_id', String(33))
-    register_date = Column('register_date', Integer)
-    expire_date = Column('expire_date', Integer)
+    register_date = Column('register_date', Date)
+    expire_date = Column('expire_date', Date)
     status = Column('status', String(1), default='1')
 
+# ***************
+#  product_archiveテーブル
+# ***************
+class ProductArchive(Base):
+    __tablename__ = "product_archive"
+    product_id = Column('product_id', Integer, primary_key=True)
+    product_name = Column('product_name', String(15))
+    product_kana = Column('product_kana', String(30))
+    user_id = Column('user_id', String(33))
+    register_date = Column('register_date', Date)
+    expire_date = Column('expire_date', Date)
+    status = Column('status', String(1))
+
+# ***************
+#  webhook_eventテーブル
+# ***************
+class WebhookEvent(Base):
+    __tablename__ = "webhook_event"
+    event_key = Column('event_key', String(64), primary_key=True)
+    received_at = Column('received_at', Integer)
+
+# ***************
+#  push_logテーブル
+# ***************
+class PushLog(Base):
+    __tablename__ = "push_log"
+    user_id = Column('user_id', String(33), primary_key=True)
+    notice_date = Column('notice_date', Integer, primary_key=True)
+    shard = Column('shard', Integer)
+    notified_at = Column('notified_at', Integer)
+
+# ***************
+#  push_checkpointテーブル
+# ***************
+class PushCheckpoint(Base):
+    __tablename__ = "push_checkpoint"
+    notice_date = Column('notice_date', Integer, primary_key=True)
+    shard = Column('shard', Integer, primary_key=True)
+    shards = Column('shards', Integer, primary_key=True)
+    last_user_id = Column('last_user_id', String(33))
+    users = Column('users', Integer, default=0)
+    status = Column('status', String(1), default='0')
+    updated_at = Column('updated_at', Integer)
+
+# ***************
+#  schema_migrationsテーブル
+# ***************
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column('version', String(100), primary_key=True)
+    applied_at = Column('applied_at', Integer)
+
 # ***************
 #  recipeテーブル
 # ***************
@@ -173,12 +364,16 @@ class Recipe(Base):
     medium_id = Column('medium_id', Integer)
     small_id = Column('small_id', Integer)
     register_date = Column('register_date', Integer)
+    recipe_rank = Column('recipe_rank', Integer)  # 楽天レシピのカテゴリ別ランキングの順位 (1〜4)
 
 # ***************
 #  inverted_indexテーブル
 # ***************
 class InvertedIndex(Base):
     __tablename__ = "inverted_index"
+    __table_args__ = (
+        Index('inverted_index_index_kana', 'index_kana'),
+    )
     index_id = Column('index_id', Integer, primary_key=True)
     index_name = Column('index_name', String(30))
     index_kana = Column('index_kana', String(30))
@@ -0,0 +1,106 @@
+"""delivery_benchmark.py
+    * 賞味期限通知の送信を、スタブサーバ (line_stub.py) に対して計測するベンチマーク
+    * 1件ずつ push する従来の方法と、delivery.py (並行送信 / multicast) を比較する
+    * スタブサーバの遅延と 429 / 500 の発生率を指定し、全員に1回ずつ届くことを確認する
+
+    python setup/benchmark/delivery_benchmark.py --users 5000 --latency 30 --error-rate 0.05
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import line_stub
+import push_benchmark
+import search_benchmark
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='賞味期限通知の送信を計測する')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--users', type=int, default=5000, help='作成するユーザ数')
+    parser.add_argument('--products', type=int, default=2, help='ユーザあたりの商品数')
+    parser.add_argument('--names', type=int, default=30, help='商品名の種類 (少ないほど同じ内容の通知が増える)')
+    parser.add_argument('--latency', type=float, default=30, help='スタブサーバの応答時間(ms)')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='429 / 500 を返す割合')
+    parser.add_argument('--serial-users', type=int, default=300, help='従来の方法で送信するユーザ数 (時間がかかるため一部のみ)')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def notices(limit_date):
+    import push
+
+    for user_id, products in push.digests(push.due_products(datetime.date.today(), limit_date)):
+        yield user_id, push.build_message(products)
+
+
+def check(stub, expected):
+    """check
+        * 送信先のユーザに1回ずつ届いたかを確認する
+
+    Returns:
+        tuple: (届かなかったユーザ数, 2回以上届いたユーザ数)
+    """
+    with stub.state.lock:
+        deliveries = dict(stub.state.deliveries)
+        stub.state.deliveries.clear()
+
+    missing = sum(1 for user_id in expected if user_id not in deliveries)
+    duplicated = sum(1 for count in deliveries.values() if count > 1)
+    return missing, duplicated
+
+
+def main():
+    args = parse_args()
+    stub = line_stub.serve(0, args.latency / 1000, args.latency / 4000, args.error_rate)
+    os.environ['LINE_API_ENDPOINT'] = 'http://127.0.0.1:%d' % stub.server_address[1]
+    search_benchmark.setup_environment(args)
+
+    import setting
+    from linebot.exceptions import LineBotApiError
+    from linebot.models import TextSendMessage
+
+    setting.ENGINE.echo = False
+    push_benchmark.create_data(args.users, args.products, random.Random(args.seed), args.names)
+    limit_date = push_benchmark.date_of(setting.Push.NOTICE_DAYS)
+    targets = list(notices(limit_date))
+    setting.session.remove()
+
+    from delivery import delivery_engine, push_api
+
+    # 従来の方法 : 1件ずつ push (一部のユーザのみ)
+    serial = targets[:args.serial_users]
+    failed = 0
+    started = time.perf_counter()
+    for user_id, text in serial:
+        try:
+            push_api.push_message(user_id, TextSendMessage(text=text))
+        except LineBotApiError:
+            failed += 1
+    serial_elapsed = time.perf_counter() - started
+    missing, duplicated = check(stub, [user_id for user_id, text in serial])
+
+    print('%-10s %7s %8s %10s %10s %8s %9s %11s' % (
+        'method', 'users', 'calls', 'sec', 'users/sec', 'failed', 'missing', 'duplicated'))
+    print('%-10s %7d %8d %10.2f %10.1f %8d %9d %11d' % (
+        'serial', len(serial), len(serial), serial_elapsed, len(serial) / serial_elapsed, failed, missing, duplicated))
+
+    # delivery.py : 並行送信 / multicast
+    report = delivery_engine.deliver(notices(limit_date)).as_dict()
+    missing, duplicated = check(stub, [user_id for user_id, text in targets])
+    print('%-10s %7d %8d %10.2f %10.1f %8d %9d %11d' % (
+        'engine', report['users'], report['push'] + report['multicast'], report['elapsed_sec'],
+        report['users_per_sec'], report['failed'], missing, duplicated))
+    print('serial estimate for %d users: %.1f sec' % (len(targets), len(targets) * serial_elapsed / len(serial)))
+    print('report: ' + json.dumps(report))
+    print('stub: ' + json.dumps(stub.state.stats()))
+
+
+if __name__ == "__main__":
+    main()
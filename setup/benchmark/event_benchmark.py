@@ -0,0 +1,187 @@
+"""event_benchmark.py
+    * webhookイベント1件あたりの発行SQL数・COMMIT数・処理時間を計測するベンチマーク
+    * LINE API はスタブサーバ (line_stub.py) で代替し、返信されたメッセージのボタンを押す形で会話を進める
+    * 会話 : follow → 商品登録 × 3 → 一覧から賞味期限変更 → レシピ検索 → 一覧から商品削除 → unfollow
+
+    python setup/benchmark/event_benchmark.py --users 20
+"""
+
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import line_stub
+import search_benchmark
+
+# 登録する商品名
+PRODUCT_NAMES = ['豚バラ肉', 'キャベツ', '玉ねぎ']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='webhookイベントの発行SQL数を計測する')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--users', type=int, default=20, help='会話を行うユーザ数')
+    parser.add_argument('--skip-load', action='store_true', help='レシピ / 転置インデックスを登録済みの場合に指定')
+    return parser.parse_args()
+
+
+class Conversation:
+    """Conversation
+        * 1ユーザ分の webhook イベントを作成し、返信内容からボタンの postback data を取り出す
+
+    Attributes:
+        user_id(str): ユーザID
+    """
+
+    def __init__(self, user_id, stub, dispatch):
+        self.user_id = user_id
+        self.stub = stub
+        self.dispatch = dispatch
+        self.tokens = itertools.count()
+        self.reply = None
+
+    def send(self, event_dict):
+        from linebot.models import MessageEvent, PostbackEvent, FollowEvent, UnfollowEvent
+
+        classes = {'message': MessageEvent, 'postback': PostbackEvent, 'follow': FollowEvent, 'unfollow': UnfollowEvent}
+        reply_token = '%s-%d' % (self.user_id, next(self.tokens))
+        event_dict = dict(event_dict, replyToken=reply_token, mode='active', timestamp=int(time.time() * 1000),
+                          source={'type': 'user', 'userId': self.user_id})
+
+        self.dispatch(classes[event_dict['type']].new_from_json_dict(event_dict))
+        self.reply = self.stub.state.get_reply(reply_token)
+
+    def follow(self):
+        self.send({'type': 'follow'})
+
+    def unfollow(self):
+        self.send({'type': 'unfollow'})
+
+    def text(self, text):
+        self.send({'type': 'message', 'message': {'type': 'text', 'id': '1', 'text': text}})
+
+    def postback(self, data, date=None):
+        postback = {'data': data}
+        if date is not None:
+            postback['params'] = {'date': date}
+        self.send({'type': 'postback', 'postback': postback})
+
+    def find_action(self, command):
+        """find_action
+            * 直前の返信から command が一致するボタンの postback data を返す
+
+        Args:
+            command(str): postback data の command
+
+        Returns:
+            str: postback data
+        """
+        from postback import decode_postback
+
+        stack = list(self.reply or [])
+        while stack:
+            node = stack.pop(0)
+            if isinstance(node, dict):
+                action = node.get('action')
+                if isinstance(action, dict) and 'data' in action:
+                    if decode_postback(action['data'])['command'] == command:
+                        return action['data']
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+
+        raise LookupError('no "%s" action in reply: %s' % (command, json.dumps(self.reply, ensure_ascii=False)[:200]))
+
+
+def run(users, stub, counter):
+    """run
+        * ユーザごとに会話を行い、イベントの種類ごとに計測する
+
+    Returns:
+        tuple: (計測名をキーとした [(SQL数, COMMIT数, 処理時間ms), ...], 計測名ごとのエラー返信数)
+    """
+    from callback import dispatch
+    from setting import Command, Message
+
+    results = collections.defaultdict(list)
+    errors = collections.Counter()
+    date = (datetime.date.today() + datetime.timedelta(days=3)).isoformat()
+
+    def step(name, call, *args):
+        counter.update(statements=0, commits=0)
+        started = time.perf_counter()
+        call(*args)
+        results[name].append((counter['statements'], counter['commits'], (time.perf_counter() - started) * 1000))
+        if conversation.reply and conversation.reply[0].get('text') == Message.ERROR:
+            errors[name] += 1
+
+    for number in range(users):
+        conversation = Conversation('Uevent%026d' % number, stub, dispatch)
+        step('follow', conversation.follow)
+
+        for product_name in PRODUCT_NAMES:
+            step('menu: register', conversation.text, '登録')
+            step('text: product name', conversation.text, product_name)
+            step('postback: register date', conversation.postback, conversation.find_action(Command.DATEPICKER), date)
+
+        step('menu: list', conversation.text, '一覧')
+        step('postback: list select', conversation.postback, conversation.find_action(Command.SELECT_PRODUCT))
+        step('postback: change date', conversation.postback, conversation.find_action(Command.CHANGE_DATE))
+        step('postback: update date', conversation.postback, conversation.find_action(Command.DATEPICKER), date)
+
+        step('menu: recipe', conversation.text, 'レシピ')
+        step('postback: recipe select', conversation.postback, conversation.find_action(Command.SELECT_PRODUCT))
+        step('postback: search', conversation.postback, conversation.find_action(Command.SEARCH))
+
+        step('menu: list', conversation.text, '一覧')
+        step('postback: list select', conversation.postback, conversation.find_action(Command.SELECT_PRODUCT))
+        step('postback: delete', conversation.postback, conversation.find_action(Command.DELETE))
+
+        step('unfollow', conversation.unfollow)
+
+    return results, errors
+
+
+def main():
+    args = parse_args()
+    stub = line_stub.serve(0, 0, 0, 0)
+    os.environ['LINE_API_ENDPOINT'] = 'http://127.0.0.1:%d' % stub.server_address[1]
+    search_benchmark.setup_environment(args)
+
+    import setting
+    from sqlalchemy import event
+
+    setting.ENGINE.echo = False
+    if not args.skip_load:
+        search_benchmark.load_data()
+
+    from search import search_engine
+    search_engine.load()
+
+    counter = {'statements': 0, 'commits': 0}
+    event.listen(setting.ENGINE, 'before_cursor_execute', lambda *arguments: counter.update(statements=counter['statements'] + 1))
+    event.listen(setting.ENGINE, 'commit', lambda *arguments: counter.update(commits=counter['commits'] + 1))
+
+    results, errors = run(args.users, stub, counter)
+
+    print('%-26s %7s %10s %9s %9s' % ('event', 'calls', 'statements', 'commits', 'p50 ms'))
+    total = [0, 0, 0]
+    for name, samples in results.items():
+        statements = sum(sample[0] for sample in samples) / len(samples)
+        commits = sum(sample[1] for sample in samples) / len(samples)
+        total = [total[0] + len(samples), total[1] + statements * len(samples), total[2] + commits * len(samples)]
+        print('%-26s %7d %10.2f %9.2f %9.2f' % (
+            name, len(samples), statements, commits, search_benchmark.percentile([sample[2] for sample in samples], 0.5)))
+
+    print('%-26s %7d %10.2f %9.2f' % ('(all events)', total[0], total[1] / total[0], total[2] / total[0]))
+    print('error replies: %s' % (dict(errors) or 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""line_stub.py
+    * LINE Messaging API の代わりに応答するローカルのスタブサーバ
+    * reply / push / multicast / プロフィール取得に応答し、受信件数とユーザごとの通知件数を記録する
+    * 直近の reply の内容を replyToken ごとに保持する (ベンチマークで返信内容を確認するため)
+    * 応答の遅延と 429 / 500 の発生率を指定できる (クライアントの再試行・性能の確認用)
+    * 次のリクエストに返すエラーを順に指定できる (StubState.fail_next、テストで再試行を確認するため)
+
+    python setup/benchmark/line_stub.py --port 8080 --latency 50 --error-rate 0.1
+    LINE_API_ENDPOINT=http://127.0.0.1:8080 python callback.py
+
+    受信件数は GET /stub/stats で取得できる
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+
+PROFILE_PATH = re.compile(r'^/v2/bot/profile/([^/]+)$')
+
+# 保持する reply の件数
+REPLY_HISTORY = 1000
+
+
+class StubState:
+    """StubState
+        * スタブサーバの設定と受信件数
+
+    Attributes:
+        latency(float): 応答までの遅延(秒)
+        jitter(float): 遅延に加える揺らぎ(秒)
+        error_rate(float): 429 / 500 を返す割合
+    """
+
+    def __init__(self, latency, jitter, error_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.counts = collections.Counter()
+        self.retry_keys = set()
+        self.replies = collections.OrderedDict()
+        self.deliveries = collections.Counter()
+        self.failures = collections.deque()
+        self.lock = threading.Lock()
+
+    def fail_next(self, status, times=1, retry_after=None, accept=False):
+        """fail_next
+            * 次の times 回のリクエストに status を返す (error_rate より優先する)
+
+        Args:
+            status(int): 返すステータスコード (429 / 5xx)
+            times(int): 返す回数
+            retry_after(str): Retry-After ヘッダの値 (None の場合は付けない)
+            accept(bool): True の場合はリクエストを受け付けてから status を返す (応答が届かなかった場合の再現)
+        """
+        with self.lock:
+            self.failures.extend([(status, retry_after, accept)] * times)
+
+    def next_failure(self):
+        with self.lock:
+            return self.failures.popleft() if self.failures else None
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def add_reply(self, reply_token, messages):
+        with self.lock:
+            self.replies[reply_token] = messages
+            while len(self.replies) > REPLY_HISTORY:
+                self.replies.popitem(last=False)
+
+    def add_delivery(self, user_ids):
+        with self.lock:
+            self.deliveries.update(user_ids)
+
+    def get_reply(self, reply_token):
+        """get_reply
+            * replyToken に対して送信されたメッセージを返す
+
+        Args:
+            reply_token(str): replyToken
+
+        Returns:
+            list: 送信されたメッセージ (未受信の場合は None)
+        """
+        with self.lock:
+            return self.replies.get(reply_token)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """StubHandler
+        * LINE Messaging API のリクエストに応答する
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None
+    lost_response = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, retry_after=None):
+        self.send_json(status, {'message': 'Scripted error'},
+                       {'Retry-After': retry_after} if retry_after is not None else None)
+
+    def send_result(self, body):
+        """send_result
+            * 処理結果を返す (受け付けてからエラーを返すよう指定されている場合はエラーを返す)
+
+        Args:
+            body(dict): 応答の内容
+        """
+        if self.lost_response is not None:
+            status, retry_after = self.lost_response
+            self.send_error_json(status, retry_after)
+            return
+
+        self.send_json(200, body)
+
+    def delay(self):
+        """delay
+            * 遅延を入れ、指定されたエラー (fail_next) か指定の割合で 429 / 500 を返す
+
+        Returns:
+            bool: エラーを返した場合は True
+        """
+        state = self.state
+        time.sleep(max(0.0, state.latency + random.uniform(-state.jitter, state.jitter)))
+
+        # keep-alive では1つのハンドラで複数のリクエストを処理するため、リクエストごとに初期化する
+        self.lost_response = None
+        failure = state.next_failure()
+        if failure is not None:
+            status, retry_after, accept = failure
+            state.count(str(status))
+            if accept:
+                self.lost_response = (status, retry_after)
+                return False
+
+            self.send_error_json(status, retry_after)
+            return True
+
+        if random.random() < state.error_rate:
+            if random.random() < 0.5:
+                state.count('429')
+                self.send_json(429, {'message': 'The API rate limit has been exceeded.'}, {'Retry-After': '0'})
+            else:
+                state.count('500')
+                self.send_json(500, {'message': 'Internal server error'})
+            return True
+
+        return False
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stub/stats':
+            self.send_json(200, self.state.stats())
+            return
+
+        match = PROFILE_PATH.match(self.path)
+        if match is None:
+            self.send_json(404, {'message': 'Not found'})
+            return
+
+        if self.delay():
+            return
+
+        self.state.count('profile')
+        self.send_result({'userId': match.group(1), 'displayName': 'stub', 'pictureUrl': '', 'statusMessage': ''})
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path not in ('/v2/bot/message/reply', '/v2/bot/message/push', '/v2/bot/message/multicast'):
+            self.send_json(404, {'message': 'Not found'})
+            return
+
+        if self.delay():
+            return
+
+        # 受付済みの X-Line-Retry-Key は LINE と同じく 409 を返す
+        retry_key = self.headers.get('X-Line-Retry-Key')
+        if retry_key is not None:
+            with self.state.lock:
+                duplicated = retry_key in self.state.retry_keys
+                self.state.retry_keys.add(retry_key)
+            if duplicated:
+                self.state.count('409')
+                self.send_json(409, {'message': 'The retry key is already accepted'})
+                return
+
+        name = self.path.rsplit('/', 1)[1]
+        self.state.count(name)
+        if name == 'multicast':
+            self.state.count('recipients', len(body.get('to', [])))
+            self.state.add_delivery(body.get('to', []))
+        if name == 'push':
+            self.state.add_delivery([body.get('to')])
+        if name == 'reply':
+            self.state.add_reply(body.get('replyToken'), body.get('messages'))
+        self.send_result({})
+
+
+def serve(port, latency, jitter, error_rate):
+    """serve
+        * スタブサーバを起動する (別スレッド)
+
+    Args:
+        port(int): 待ち受けるポート (0 の場合は空きポート)
+        latency(float): 応答までの遅延(秒)
+        jitter(float): 遅延に加える揺らぎ(秒)
+        error_rate(float): 429 / 500 を返す割合
+
+    Returns:
+        server(:obj:ThreadingHTTPServer): 起動したサーバ (server.server_address でポートを参照できる)
+    """
+    handler = type('BoundStubHandler', (StubHandler,), {'state': StubState(latency, jitter, error_rate)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LINE Messaging API のスタブサーバ')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='応答までの遅延(ミリ秒)')
+    parser.add_argument('--jitter', type=float, default=0, help='遅延の揺らぎ(ミリ秒)')
+    parser.add_argument('--error-rate', type=float, default=0, help='429 / 500 を返す割合 (0〜1)')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency / 1000, args.jitter / 1000, args.error_rate)
+    print('LINE API stub: http://127.0.0.1:%d' % server.server_address[1])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
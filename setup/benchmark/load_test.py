@@ -0,0 +1,223 @@
+"""load_test.py
+    * gunicorn (gunicorn.conf.py / wsgi.py) を起動し、署名付きの webhook を送信してワーカー数ごとの処理件数を計測する
+    * LINE API はスタブサーバ (line_stub.py) で代替する (--latency で返信 API の応答時間を指定)
+    * 送信するイベントは一覧メニュー (商品3件の一覧を返信し、status を更新する)
+    * 計測後に SIGTERM で停止し、処理中のイベントを処理してから終了することを確認する
+
+    python setup/benchmark/load_test.py --workers 1,2,4 --duration 10
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import hmac
+import http.client
+import itertools
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import line_stub
+import search_benchmark
+
+REPOSITORY = search_benchmark.REPOSITORY
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='gunicorn のワーカー数ごとの処理件数を計測する')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--workers', default='1,2,4', help='計測するワーカープロセス数 (カンマ区切り)')
+    parser.add_argument('--threads', type=int, default=4, help='1ワーカーのスレッド数')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時に送信するリクエスト数')
+    parser.add_argument('--duration', type=float, default=10, help='1回の計測の秒数')
+    parser.add_argument('--users', type=int, default=200, help='イベントを送信するユーザ数')
+    parser.add_argument('--latency', type=float, default=20, help='スタブサーバの応答時間(ms)')
+    parser.add_argument('--skip-load', action='store_true', help='レシピ / 転置インデックスを登録済みの場合に指定')
+    return parser.parse_args()
+
+
+def create_users(count):
+    """create_users
+        * 商品を3件登録したユーザを作成する
+    """
+    from setting import session, User, Status, Product
+
+    user_ids = ['Uload%027d' % number for number in range(count)]
+    product_id = itertools.count(1)
+    for user_id in user_ids:
+        session.add(User(user_id=user_id, user_name='load', register_date=20200501))
+        session.add(Status(user_id=user_id))
+        for product_name, expire_date in (('豚バラ肉', 10), ('キャベツ', 12), ('玉ねぎ', 20)):
+            session.add(Product(product_id=next(product_id), product_name=product_name, user_id=user_id,
+                                register_date=datetime.date(2020, 5, 1), expire_date=datetime.date(2020, 5, expire_date)))
+    session.commit()
+    session.remove()
+    return user_ids
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threads, port):
+    """start_server
+        * gunicorn を起動し、応答するまで待つ
+
+    Returns:
+        process(:obj:Popen): gunicorn のマスタープロセス
+    """
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads),
+               PYTHONPATH=REPOSITORY)
+    # ログはパイプに溜まると書き込みで止まるため、一時ファイルに出力する
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                               cwd=REPOSITORY, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError('gunicorn exited: ' + log.read().decode('utf-8', 'replace')[-2000:])
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/metrics')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def stop_server(process):
+    """stop_server
+        * SIGTERM で停止し、終了コードと終了までの秒数を返す
+    """
+    started = time.monotonic()
+    process.send_signal(signal.SIGTERM)
+    try:
+        code = process.wait(60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        code = process.wait()
+    process.log.close()
+    return code, time.monotonic() - started
+
+
+def webhook_body(user_id, reply_token):
+    from setting import MenuType
+
+    return json.dumps({'destination': 'Uload', 'events': [{
+        'type': 'message', 'mode': 'active', 'replyToken': reply_token, 'timestamp': int(time.time() * 1000),
+        'source': {'type': 'user', 'userId': user_id},
+        'message': {'type': 'text', 'id': reply_token, 'text': MenuType.LIST},
+    }]}, ensure_ascii=False).encode('utf-8')
+
+
+def sign(body):
+    secret = os.environ['YOUR_CHANNEL_SECRET'].encode('utf-8')
+    return base64.b64encode(hmac.new(secret, body, hashlib.sha256).digest()).decode('utf-8')
+
+
+def run_load(port, user_ids, concurrency, duration):
+    """run_load
+        * concurrency 本の keep-alive 接続で duration 秒間 webhook を送信する
+
+    Returns:
+        tuple: (応答時間(ms)のリスト, エラー件数)
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    tokens = itertools.count()
+    deadline = time.monotonic() + duration
+
+    def client(number):
+        rng = random.Random(number)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        samples = []
+        failed = 0
+        while time.monotonic() < deadline:
+            body = webhook_body(rng.choice(user_ids), 'load-%d' % next(tokens))
+            started = time.perf_counter()
+            try:
+                connection.request('POST', '/callback', body,
+                                   {'Content-Type': 'application/json', 'X-Line-Signature': sign(body)})
+                response = connection.getresponse()
+                response.read()
+                if response.status == 200:
+                    samples.append((time.perf_counter() - started) * 1000)
+                else:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.close()
+
+        with lock:
+            latencies.extend(samples)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors[0]
+
+
+def main():
+    args = parse_args()
+    stub = line_stub.serve(0, args.latency / 1000, 0, 0)
+    os.environ['LINE_API_ENDPOINT'] = 'http://127.0.0.1:%d' % stub.server_address[1]
+    search_benchmark.setup_environment(args)
+
+    import setting
+
+    setting.ENGINE.echo = False
+    if not args.skip_load:
+        search_benchmark.load_data()
+    user_ids = create_users(args.users)
+    setting.ENGINE.dispose()
+
+    print('%-8s %9s %9s %9s %9s %7s %9s %11s' % (
+        'workers', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'errors', 'speedup', 'stop sec'))
+    baseline = None
+    for workers in [int(value) for value in args.workers.split(',')]:
+        port = free_port()
+        process = start_server(workers, args.threads, port)
+        replies_before = stub.state.stats().get('reply', 0)
+
+        latencies, errors = run_load(port, user_ids, args.concurrency, args.duration)
+        code, stop_seconds = stop_server(process)
+
+        # 同期モードでは全てのイベントが応答前に返信される
+        replies = stub.state.stats().get('reply', 0) - replies_before
+        rps = len(latencies) / args.duration
+        baseline = baseline or rps
+        print('%-8d %9d %9.1f %9.2f %9.2f %7d %8.2fx %8.1f (%d)' % (
+            workers, len(latencies), rps, search_benchmark.percentile(latencies, 0.5),
+            search_benchmark.percentile(latencies, 0.99), errors, rps / baseline, stop_seconds, code))
+        if replies < len(latencies):
+            print('  %d requests were answered without a reply' % (len(latencies) - replies), file=sys.stderr)
+
+    print('cpus: %d' % os.cpu_count())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""postback_benchmark.py
+    * Postback の data の長さと解析時間を、以前の形式 (DATA_FORMAT の JSON) と postback.py の形式で比較する
+    * レシピ検索の商品ボタンについて、選択中の商品数を変えて計測する (LINE の postback data は300文字まで)
+
+    python setup/benchmark/postback_benchmark.py --products 60
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import template_benchmark
+
+# LINE の postback data の上限文字数
+DATA_LIMIT = 300
+
+
+def legacy_data(product_id, marker_array):
+    from setting import Message, PostbackSEQ, Command
+
+    data_flame = dict(Message.DATA_FORMAT, sequence=PostbackSEQ.RECIPE_PRODUCT, command=Command.SELECT_PRODUCT)
+    data_flame['product_id'] = product_id
+    data_flame['product_name'] = '豚バラ肉'
+    data_flame['expire_date'] = '20200510'
+    data_flame['display_position'] = '0'
+    data_flame['marker_array'] = marker_array
+    return json.dumps(data_flame)
+
+
+def compact_data(product_id, product_ids, marker_array):
+    from setting import PostbackSEQ, Command
+    from postback import encode_postback, encode_selection
+
+    return encode_postback(PostbackSEQ.RECIPE_PRODUCT, Command.SELECT_PRODUCT, product_id=product_id,
+                           display_position=0, expire_date='20200510',
+                           selection=encode_selection(product_ids, marker_array), product_name='豚バラ肉')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Postback の data の長さと解析時間を比較する')
+    parser.add_argument('--products', type=int, default=60, help='ユーザの商品登録件数')
+    parser.add_argument('--number', type=int, default=20000, help='1回の計測で解析する回数')
+    args = parser.parse_args()
+    template_benchmark.setup_environment()
+
+    from postback import decode_postback, decode_selection
+
+    # 実際の product_id に近い桁数にする
+    product_ids = [str(100000 + product_id) for product_id in range(args.products)]
+
+    print('%-10s %10s %10s %12s %12s' % ('selected', 'json len', 'compact len', 'json us', 'compact us'))
+    for selected in sorted({0, 1, 5, 20, args.products // 2, args.products}):
+        marker_array = product_ids[:selected]
+        legacy = legacy_data(product_ids[0], marker_array)
+        compact = compact_data(product_ids[0], product_ids, marker_array)
+
+        # 解析結果の選択中の商品が一致することを確認する
+        if decode_selection(decode_postback(compact), product_ids) != marker_array:
+            print('selection differs after decoding (%d selected)' % selected, file=sys.stderr)
+            sys.exit(1)
+
+        legacy_us = min(timeit.repeat(lambda: decode_postback(legacy), number=args.number, repeat=5)) / args.number * 1000000
+        compact_us = min(timeit.repeat(lambda: decode_selection(decode_postback(compact), product_ids),
+                                       number=args.number, repeat=5)) / args.number * 1000000
+
+        print('%-10d %9d%s %10d%s %12.2f %12.2f' % (
+            selected, len(legacy), '!' if len(legacy) > DATA_LIMIT else ' ',
+            len(compact), '!' if len(compact) > DATA_LIMIT else ' ', legacy_us, compact_us))
+
+    print('(! : exceeds the %d character postback data limit)' % DATA_LIMIT)
+
+
+if __name__ == "__main__":
+    main()
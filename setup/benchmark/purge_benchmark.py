@@ -0,0 +1,177 @@
+"""purge_benchmark.py
+    * 賞味期限切れ商品のアーカイブ (purge.py) を計測するベンチマーク
+    * 1つの DELETE と1行ずつのトリガでアーカイブする従来の方法と、バッチごとにまとめて移動する方法を比較する
+    * 実行中に別の接続から商品を登録し、登録の待ち時間 (テーブルのロック) を計測する
+    * SQLite の場合はトリガを SQLite の構文で作成し、バッチの実行時は削除する (recipebot.skip_backup の代わり)
+
+    python setup/benchmark/purge_benchmark.py --products 200000 --expired 0.5
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import push_benchmark
+import search_benchmark
+
+TRIGGER_SQL = os.path.join(search_benchmark.REPOSITORY, 'setup', 'database', 'createTrigger', 'create_process_backup.sql')
+
+SQLITE_TRIGGER = """
+    CREATE TRIGGER backup_recode AFTER DELETE ON product FOR EACH ROW
+    BEGIN
+        INSERT INTO product_archive
+        VALUES (OLD.product_id, OLD.product_name, OLD.product_kana, OLD.user_id,
+                OLD.register_date, OLD.expire_date, OLD.status);
+    END
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='賞味期限切れ商品のアーカイブを計測する')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--products', type=int, default=200000, help='作成する商品数')
+    parser.add_argument('--expired', type=float, default=0.5, help='賞味期限切れの商品の割合')
+    parser.add_argument('--batch-size', type=int, default=1000, help='1トランザクションで移動する商品数')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def create_data(products, expired, rng):
+    """create_data
+        * 1ユーザあたり10件の商品を作成する (expired の割合は賞味期限切れ)
+    """
+    import setting
+
+    tables = [setting.User.__table__, setting.Product.__table__, setting.ProductArchive.__table__]
+    setting.Base.metadata.drop_all(setting.ENGINE, tables=tables)
+    setting.Base.metadata.create_all(setting.ENGINE, tables=tables)
+
+    user_rows = []
+    product_rows = []
+    for number in range(products):
+        user_id = 'Upurge%026d' % (number // 10)
+        if number % 10 == 0:
+            user_rows.append({'user_id': user_id, 'user_name': 'purge', 'register_date': push_benchmark.date_number(-30),
+                              'status': '1', 'delete_date': 0})
+        days = -rng.randrange(1, 30) if rng.random() < expired else rng.randrange(30)
+        product_rows.append({'product_id': number + 1, 'product_name': '商品%d' % rng.randrange(1000),
+                             'user_id': user_id, 'register_date': push_benchmark.date_of(-30),
+                             'expire_date': push_benchmark.date_of(days), 'status': '1'})
+
+    with setting.ENGINE.begin() as connection:
+        connection.execute(setting.User.__table__.insert(), user_rows)
+        connection.execute(setting.Product.__table__.insert(), product_rows)
+
+
+def set_trigger(enabled):
+    import setting
+
+    with setting.ENGINE.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute('DROP TRIGGER IF EXISTS backup_recode ON product')
+            if enabled:
+                with open(TRIGGER_SQL, encoding='utf-8') as file:
+                    function, trigger = file.read().split('CREATE TRIGGER')
+                connection.execute(function)
+                connection.execute('CREATE TRIGGER' + trigger)
+        else:
+            connection.execute('DROP TRIGGER IF EXISTS backup_recode')
+            if enabled:
+                connection.execute(SQLITE_TRIGGER)
+
+
+class WriteProbe(threading.Thread):
+    """WriteProbe
+        * 20ms ごとに別の接続から商品を登録し、登録にかかった時間を記録する (ユーザの操作の代わり)
+    """
+
+    def __init__(self, first_product_id):
+        super().__init__(daemon=True)
+        self.product_id = first_product_id
+        self.latencies = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        import setting
+
+        while not self.stopping.is_set():
+            self.product_id += 1
+            started = time.perf_counter()
+            with setting.ENGINE.begin() as connection:
+                connection.execute(setting.Product.__table__.insert(), {
+                    'product_id': self.product_id, 'product_name': 'probe', 'user_id': 'Upurge%026d' % 0,
+                    'register_date': push_benchmark.date_of(0),
+                    'expire_date': push_benchmark.date_of(7), 'status': '1'})
+            self.latencies.append(time.perf_counter() - started)
+            self.stopping.wait(0.02)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+        return max(self.latencies) * 1000 if self.latencies else 0.0
+
+
+def archived_ids():
+    import setting
+
+    with setting.ENGINE.connect() as connection:
+        return [row.product_id for row in connection.execute(
+            'SELECT product_id FROM product_archive ORDER BY product_id')]
+
+
+def measure(name, run, probe_start):
+    probe = WriteProbe(probe_start)
+    probe.start()
+    started = time.perf_counter()
+    deleted, batches = run()
+    elapsed = time.perf_counter() - started
+    max_wait = probe.stop()
+
+    print('%-10s %9d %8d %10.2f %10.0f %15.1f' % (name, deleted, batches, elapsed, deleted / elapsed, max_wait))
+    return archived_ids()
+
+
+def main():
+    args = parse_args()
+    search_benchmark.setup_environment(args)
+
+    import setting
+    import purge
+
+    setting.ENGINE.echo = False
+    today_date = push_benchmark.date_of(0)
+    rng = random.Random(args.seed)
+
+    def single_delete():
+        with setting.ENGINE.begin() as connection:
+            # DELETE FROM product WHERE expire_date < ? ; (トリガで1行ずつアーカイブ)
+            deleted = connection.execute(setting.Product.__table__.delete().
+                                         where(setting.Product.expire_date < today_date)).rowcount
+        return deleted, 1
+
+    def batched():
+        report = purge.purge(today_date, args.batch_size, 0)
+        return report['deleted'], report['batches']
+
+    print('%-10s %9s %8s %10s %10s %15s' % ('method', 'deleted', 'batches', 'sec', 'rows/sec', 'max write ms'))
+
+    create_data(args.products, args.expired, rng)
+    set_trigger(True)
+    legacy = measure('trigger', single_delete, args.products)
+
+    create_data(args.products, args.expired, random.Random(args.seed))
+    set_trigger(setting.ENGINE.dialect.name == 'postgresql')
+    result = measure('batched', batched, args.products)
+
+    # 同じ商品がアーカイブされることを確認する
+    if legacy != result:
+        print('batched purge archived different products', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""push_benchmark.py
+    * 賞味期限通知 (push.py) の通知対象の取得を計測するベンチマーク
+    * ユーザごとにクエリを発行する従来の方法と、1つのクエリでユーザごとにまとめる方法を比較する
+    * 通知メッセージの作成までを計測し、送信はしない
+
+    python setup/benchmark/push_benchmark.py --users 5000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import search_benchmark
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='賞味期限通知の対象取得を計測する')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--users', type=int, default=5000, help='作成するユーザ数')
+    parser.add_argument('--products', type=int, default=8, help='ユーザあたりの商品数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-create', action='store_true', help='ユーザ / 商品を作成済みの場合に指定')
+    return parser.parse_args()
+
+
+def date_number(days):
+    date = date_of(days)
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def date_of(days):
+    return datetime.date.today() + datetime.timedelta(days=days)
+
+
+def create_data(users, products, rng, names=1000):
+    """create_data
+        * ユーザ (1割は退会済み) と、今日から14日以内に賞味期限が切れる商品を作成する
+        * 商品名は names 種類から選ぶ (少ないほど同じ内容の通知が増える)
+    """
+    import setting
+
+    tables = [setting.User.__table__, setting.Status.__table__, setting.Product.__table__]
+    setting.Base.metadata.drop_all(setting.ENGINE, tables=tables)
+    setting.Base.metadata.create_all(setting.ENGINE, tables=tables)
+
+    user_rows = []
+    product_rows = []
+    for number in range(users):
+        user_id = 'Upush%027d' % number
+        user_rows.append({'user_id': user_id, 'user_name': 'push', 'register_date': date_number(-30),
+                          'status': '0' if number % 10 == 9 else '1', 'delete_date': 0})
+        for _ in range(products):
+            product_rows.append({'product_id': len(product_rows) + 1, 'product_name': '商品%d' % rng.randrange(names),
+                                 'user_id': user_id, 'register_date': date_of(-1),
+                                 'expire_date': date_of(rng.randrange(14)), 'status': '1'})
+
+    with setting.ENGINE.begin() as connection:
+        connection.execute(setting.User.__table__.insert(), user_rows)
+        connection.execute(setting.Product.__table__.insert(), product_rows)
+
+
+def legacy_digests(limit_date):
+    """legacy_digests
+        * 従来の方法 : 有効なユーザを取得し、ユーザごとに商品を取得する
+    """
+    import push
+    from setting import session, User, Product
+
+    users = session.query(User.user_id). \
+        filter(User.status == '1'). \
+        all()
+
+    for user in users:
+        products = session.query(Product.product_name, Product.expire_date). \
+            filter(Product.user_id == user.user_id). \
+            filter(Product.expire_date < limit_date). \
+            order_by(Product.expire_date). \
+            all()
+
+        if len(products) != 0:
+            yield user.user_id, push.build_message(products)
+
+
+def streaming_digests(limit_date):
+    """streaming_digests
+        * push.py の方法 : 1つのクエリで取得し、ユーザごとにまとめる
+    """
+    import push
+
+    for user_id, products in push.digests(push.due_products(datetime.date.today(), limit_date)):
+        yield user_id, push.build_message(products)
+
+
+def measure(name, digests, limit_date, counter):
+    from setting import session
+
+    counter['statements'] = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = [(user_id, message) for user_id, message in digests(limit_date)]
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    session.commit()
+    session.remove()
+
+    print('%-12s %8d %11d %10.2f %10.0f %12.1f' % (
+        name, len(result), counter['statements'], elapsed, len(result) / elapsed, peak / 1024))
+    return result
+
+
+def main():
+    args = parse_args()
+    search_benchmark.setup_environment(args)
+
+    import setting
+    from sqlalchemy import event
+
+    setting.ENGINE.echo = False
+    if not args.skip_create:
+        create_data(args.users, args.products, random.Random(args.seed))
+
+    counter = {'statements': 0}
+    event.listen(setting.ENGINE, 'before_cursor_execute',
+                 lambda *arguments: counter.update(statements=counter['statements'] + 1))
+
+    limit_date = date_of(setting.Push.NOTICE_DAYS)
+    print('%-12s %8s %11s %10s %10s %12s' % ('method', 'users', 'statements', 'sec', 'users/sec', 'peak KiB'))
+    legacy = measure('per-user', legacy_digests, limit_date, counter)
+    streaming = measure('streaming', streaming_digests, limit_date, counter)
+
+    # 同じ通知メッセージが作成されることを確認する
+    if legacy != streaming:
+        print('streaming digests differ from the per-user query', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""search_benchmark.py
+    * レシピ検索 (return_product_list / return_recipe_list) のベンチマーク
+    * 同梱の insert_recipe.sql / insert_inverter_index.sql をローカルDB (SQLite / Postgres) に登録する
+    * index_kana の出現頻度に従った食材を持つユーザを作成し、observer の検索処理を直接呼び出す
+    * 選択食材数 1〜8 ごとに p50/p95/p99 の処理時間・発行SQL数・メモリ確保量を計測する
+
+    python setup/benchmark/search_benchmark.py --output baseline.json
+    python setup/benchmark/search_benchmark.py --compare baseline.json
+"""
+
+from types import SimpleNamespace
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+INSERT_DATA = os.path.join(REPOSITORY, 'setup', 'database', 'insertData')
+DATA_FILES = ['insert_recipe.sql', 'insert_inverter_index.sql']
+
+# 比較時に悪化と判定する割合
+REGRESSION_RATIO = 1.2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='レシピ検索のベンチマーク')
+    parser.add_argument('--database', help='接続先 (未指定の場合は一時ファイルの SQLite)')
+    parser.add_argument('--users', type=int, default=50, help='作成するユーザ数')
+    parser.add_argument('--max-items', type=int, default=8, help='選択する食材数の上限')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-load', action='store_true', help='レシピ / 転置インデックスを登録済みの場合に指定')
+    parser.add_argument('--output', help='計測結果を保存する JSON')
+    parser.add_argument('--compare', help='比較するベースラインの JSON')
+    return parser.parse_args()
+
+
+def setup_environment(args):
+    """setup_environment
+        * setting.py の読み込み前に接続先を設定する
+    """
+    if args.database is None:
+        directory = tempfile.mkdtemp(prefix='recipebot_bench_')
+        args.database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('YOUR_CHANNEL_ACCESS_TOKEN', 'benchmark')
+    os.environ.setdefault('YOUR_CHANNEL_SECRET', 'benchmark')
+    sys.path.insert(0, REPOSITORY)
+
+
+def load_data():
+    """load_data
+        * テーブルを作成し、同梱のレシピ / 転置インデックスを登録する
+    """
+    import setting
+
+    tables = [setting.User.__table__, setting.Status.__table__, setting.Product.__table__,
+              setting.Recipe.__table__, setting.InvertedIndex.__table__]
+    setting.Base.metadata.drop_all(setting.ENGINE, tables=tables)
+    setting.Base.metadata.create_all(setting.ENGINE, tables=tables)
+
+    connection = setting.ENGINE.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for file_name in DATA_FILES:
+            with open(os.path.join(INSERT_DATA, file_name), encoding='cp932') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        cursor.execute(re.sub(r'^insert into "public"\.', 'insert into ', line))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def create_users(count, max_items, rng):
+    """create_users
+        * index_kana の出現頻度に従って食材を選び、ユーザと商品を登録する
+
+    Returns:
+        list: (user_id, [product_id(str), ...]) のリスト
+    """
+    import setting
+
+    terms = setting.session.query(setting.InvertedIndex.index_name, setting.InvertedIndex.index_kana,
+                                  setting.InvertedIndex.index).all()
+    population = [(term.index_name, term.index_kana) for term in terms]
+    weights = [len(term.index.split(',')) for term in terms]
+
+    users = []
+    for number in range(count):
+        user_id = 'Ubench%027d' % number
+        setting.session.add(setting.User(user_id=user_id, user_name='bench', register_date=20200501))
+        setting.session.add(setting.Status(user_id=user_id))
+
+        pantry = {}
+        while len(pantry) < max_items:
+            name, kana = rng.choices(population, weights)[0]
+            pantry[kana] = name
+
+        products = []
+        for day, (kana, name) in enumerate(pantry.items()):
+            product = setting.Product(product_name=name[:15], product_kana=kana, user_id=user_id,
+                                      register_date=datetime.date(2020, 5, 1),
+                                      expire_date=datetime.date(2020, 5, 10) + datetime.timedelta(days=day))
+            setting.session.add(product)
+            products.append(product)
+
+        setting.session.flush()
+        users.append((user_id, [str(product.product_id) for product in products]))
+
+    setting.session.commit()
+    return users
+
+
+def percentile(values, rate):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(rate * (len(ordered) - 1))))]
+
+
+def measure(name, calls, counter):
+    """measure
+        * 処理時間・発行SQL数・メモリ確保量を計測する
+
+    Args:
+        name(str): 計測名
+        calls(list): 引数なしで呼び出す関数のリスト
+        counter(dict): SQL発行数を数える辞書
+
+    Returns:
+        dict: 計測結果
+    """
+    latencies = []
+    queries = []
+    for call in calls:
+        counter['statements'] = 0
+        started = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter['statements'])
+
+    # メモリ確保量は tracemalloc の影響を受けない別の実行で計測する
+    allocations = []
+    tracemalloc.start()
+    for call in calls:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call()
+        allocations.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'calls': len(calls),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries_per_call': round(sum(queries) / len(queries), 2),
+        'peak_alloc_kib': round(sum(allocations) / len(allocations), 1),
+    }
+
+
+def run(users, max_items, counter):
+    """run
+        * 選択食材数ごとに検索処理を計測する
+    """
+    from observer import MessageObserver
+    from setting import PostbackSEQ, Command
+
+    results = []
+    for items in range(1, max_items + 1):
+        toggle_calls = []
+        search_calls = []
+        for user_id, product_ids in users:
+            selected = product_ids[:items - 1]
+            toggle = SimpleNamespace(
+                type='postback', user_id=user_id, sequence=PostbackSEQ.RECIPE_PRODUCT,
+                command=Command.SELECT_PRODUCT, message='',
+                data_json={'display_position': '0', 'marker_array': selected, 'product_id': product_ids[items - 1]})
+            search = SimpleNamespace(
+                type='postback', user_id=user_id, sequence=PostbackSEQ.RECIPE_PRODUCT,
+                command=Command.SEARCH, message='',
+                data_json={'marker_array': product_ids[:items]})
+
+            # handler.data_json は処理中に変更されるため、呼び出しごとに複製する
+            toggle_calls.append(lambda h=toggle: MessageObserver.return_product_list(
+                SimpleNamespace(**dict(vars(h), data_json=json.loads(json.dumps(h.data_json))))))
+            search_calls.append(lambda h=search: MessageObserver.return_recipe_list(h))
+
+        results.append(dict(measure('return_product_list', toggle_calls, counter), items=items))
+        results.append(dict(measure('return_recipe_list', search_calls, counter), items=items))
+
+    return results
+
+
+def compare(results, baseline_path):
+    """compare
+        * ベースラインと比較し、悪化した計測を表示する
+
+    Returns:
+        bool: 悪化がなければ True
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(result['name'], result['items']): result for result in json.load(f)['results']}
+
+    ok = True
+    print('\n%-20s %5s %12s %12s %10s' % ('name', 'items', 'p95 (base)', 'p95 (now)', 'queries'))
+    for result in results:
+        base = baseline.get((result['name'], result['items']))
+        if base is None:
+            continue
+
+        regressed = result['p95_ms'] > base['p95_ms'] * REGRESSION_RATIO or \
+            result['queries_per_call'] > base['queries_per_call']
+        ok = ok and not regressed
+        print('%-20s %5d %12.3f %12.3f %4.1f→%-4.1f %s' % (
+            result['name'], result['items'], base['p95_ms'], result['p95_ms'],
+            base['queries_per_call'], result['queries_per_call'], 'REGRESSION' if regressed else ''))
+
+    return ok
+
+
+def main():
+    args = parse_args()
+    setup_environment(args)
+
+    import setting
+    from sqlalchemy import event
+
+    setting.ENGINE.echo = False
+    if not args.skip_load:
+        load_data()
+
+    rng = random.Random(args.seed)
+    users = create_users(args.users, args.max_items, rng)
+
+    counter = {'statements': 0}
+    event.listen(setting.ENGINE, 'before_cursor_execute', lambda *arguments: counter.update(statements=counter['statements'] + 1))
+
+    # 転置インデックスの読み込み
+    from search import search_engine
+    started = time.perf_counter()
+    search_engine.load()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    results = run(users, args.max_items, counter)
+
+    print('index load: %.1f ms' % load_ms)
+    print('%-20s %5s %9s %9s %9s %8s %10s' % ('name', 'items', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'alloc KiB'))
+    for result in results:
+        print('%-20s %5d %9.3f %9.3f %9.3f %8.2f %10.1f' % (
+            result['name'], result['items'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['queries_per_call'], result['peak_alloc_kib']))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'users': args.users, 'seed': args.seed, 'index_load_ms': round(load_ms, 1),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+    if args.compare and not compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""template_benchmark.py
+    * Flex Message 作成のマイクロベンチマーク
+    * copy.deepcopy で Message のフォーマットを複製する従来の作成方法と、template.py のテンプレートを比較する
+    * 5件の商品一覧 / 10件のレシピ carousel について、dict の作成と送信データ(JSON)の作成までを計測する
+
+    python setup/benchmark/template_benchmark.py --number 2000
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def setup_environment():
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    os.environ.setdefault('YOUR_CHANNEL_ACCESS_TOKEN', 'benchmark')
+    os.environ.setdefault('YOUR_CHANNEL_SECRET', 'benchmark')
+    sys.path.insert(0, REPOSITORY)
+
+
+def sample_products(count):
+    return [(product_id, '商品%d' % product_id, 20200510 + product_id) for product_id in range(1, count + 1)]
+
+
+def sample_recipes(count):
+    return [(recipe_number, 'レシピ%d' % recipe_number,
+             'https://image.example.com/%d.jpg' % recipe_number,
+             'https://recipe.example.com/%d/' % recipe_number) for recipe_number in range(1, count + 1)]
+
+
+def legacy_product_list(products, marker_array):
+    """legacy_product_list
+        * 従来の作成方法 (copy.deepcopy) で5件の商品一覧を作成する
+    """
+    from setting import Message, PostbackSEQ, Command
+
+    sequence = PostbackSEQ.RECIPE_PRODUCT
+    list_flame = copy.deepcopy(Message.BUBBLE_FLAME)
+    list_flame['header'] = copy.deepcopy(Message.HEADER_FLAME)
+    list_flame['header']['contents'][0]['text'] = '【レシピ検索】'
+    list_flame['header']['contents'][1]['text'] = '検索ヒット数 : 10  (10件まで表示可能)'
+
+    contents_array = []
+    for product_id, product_name, expire_date in products:
+        body_data_flame = copy.deepcopy(Message.DATA_FORMAT)
+        body_data_flame['sequence'] = sequence
+        body_data_flame['command'] = Command.SELECT_PRODUCT
+        body_data_flame['product_id'] = str(product_id)
+        body_data_flame['product_name'] = product_name
+        body_data_flame['expire_date'] = str(expire_date)
+        body_data_flame['display_position'] = '0'
+        body_data_flame['marker_array'] = marker_array
+
+        list_contents = copy.deepcopy(Message.LIST_CONTENTS)
+        list_contents['contents'][0]['color'] = '#ff7f24' if str(product_id) in marker_array else '#ffc966'
+        list_contents['contents'][0]['action']['label'] = product_name
+        list_contents['contents'][0]['action']['data'] = json.dumps(body_data_flame)
+        contents_array.append(list_contents)
+
+    button_data_flame = copy.deepcopy(Message.DATA_FORMAT)
+    button_data_flame['sequence'] = sequence
+    button_data_flame['command'] = Command.SEARCH
+    button_data_flame['marker_array'] = marker_array
+    recipe_button = copy.deepcopy(Message.RECIPE_BUTTON)
+    recipe_button['contents'][0]['action']['label'] = 'レシピを検索'
+    recipe_button['contents'][0]['action']['data'] = json.dumps(button_data_flame)
+    contents_array.append(recipe_button)
+
+    list_body_flame = copy.deepcopy(Message.BODY_FLAME)
+    list_body_flame['contents'] = contents_array
+    list_flame['body'] = list_body_flame
+
+    back_data_flame = copy.deepcopy(Message.DATA_FORMAT)
+    back_data_flame['sequence'] = sequence
+    back_data_flame['command'] = Command.BACK
+    back_data_flame['display_position'] = '0'
+    back_data_flame['marker_array'] = marker_array
+    next_data_flame = copy.deepcopy(back_data_flame)
+    next_data_flame['command'] = Command.NEXT
+
+    list_footer = copy.deepcopy(Message.LIST_FOOTER)
+    list_footer['contents'][0]['action']['data'] = json.dumps(back_data_flame)
+    list_footer['contents'][1]['text'] = '1-%d / %d' % (len(products), len(products))
+    list_footer['contents'][2]['action']['data'] = json.dumps(next_data_flame)
+    list_flame['footer'] = list_footer
+    list_flame['styles'] = Message.COMMON_STYLES
+
+    return list_flame
+
+
+def template_product_list(products, marker_array):
+    """template_product_list
+        * template.py のテンプレートで5件の商品一覧を作成する (observer.return_product_list と同じ手順)
+    """
+    from setting import Message, PostbackSEQ, Command
+    from template import Template
+
+    sequence = PostbackSEQ.RECIPE_PRODUCT
+    contents_array = []
+    for product_id, product_name, expire_date in products:
+        body_data_flame = Template.DATA_FORMAT(sequence=sequence, command=Command.SELECT_PRODUCT)
+        body_data_flame['product_id'] = str(product_id)
+        body_data_flame['product_name'] = product_name
+        body_data_flame['expire_date'] = str(expire_date)
+        body_data_flame['display_position'] = '0'
+        body_data_flame['marker_array'] = marker_array
+
+        contents_array.append(Template.LIST_CONTENTS(
+            color='#ff7f24' if str(product_id) in marker_array else '#ffc966',
+            label=product_name, data=json.dumps(body_data_flame)))
+
+    button_data_flame = Template.DATA_FORMAT(sequence=sequence, command=Command.SEARCH)
+    button_data_flame['marker_array'] = marker_array
+    contents_array.append(Template.RECIPE_BUTTON(label='レシピを検索', data=json.dumps(button_data_flame)))
+
+    back_data_flame = Template.DATA_FORMAT(sequence=sequence, command=Command.BACK)
+    back_data_flame['display_position'] = '0'
+    back_data_flame['marker_array'] = marker_array
+    back_data_str = json.dumps(back_data_flame)
+    back_data_flame['command'] = Command.NEXT
+
+    list_flame = Template.LIST_BUBBLE(
+        header=Template.HEADER(title='【レシピ検索】', text='検索ヒット数 : 10  (10件まで表示可能)'),
+        footer=Template.LIST_FOOTER(back_data=back_data_str, page='1-%d / %d' % (len(products), len(products)),
+                                    next_data=json.dumps(back_data_flame)),
+        styles=Message.COMMON_STYLES)
+    list_flame['body'] = Template.BODY(contents=contents_array)
+
+    return list_flame
+
+
+def legacy_carousel(recipes):
+    from setting import Message
+
+    contents = []
+    for recipe_number, recipe_name, recipe_photo, recipe_url in recipes:
+        recipe_body = copy.deepcopy(Message.RECIPE_BODY)
+        recipe_body['header']['contents'][0]['text'] = recipe_name
+        recipe_body['hero']['url'] = recipe_photo
+        recipe_body['footer']['contents'][0]['action']['uri'] = recipe_url
+        recipe_body['styles'] = Message.COMMON_STYLES
+        contents.append(recipe_body)
+
+    recipe_flame = copy.deepcopy(Message.CAROUSEL_FLAME)
+    recipe_flame['contents'] = contents
+    return recipe_flame
+
+
+def template_carousel(recipes):
+    from setting import Message
+    from template import Template
+
+    return Template.CAROUSEL(contents=[
+        Template.RECIPE_BODY(title=recipe_name, photo=recipe_photo, url=recipe_url, styles=Message.COMMON_STYLES)
+        for recipe_number, recipe_name, recipe_photo, recipe_url in recipes])
+
+
+def legacy_payload(contents):
+    from linebot.models import FlexSendMessage
+    return json.dumps(FlexSendMessage(alt_text='flexMessage', contents=contents).as_json_dict())
+
+
+def template_payload(contents):
+    from template import FlexDictMessage
+    return json.dumps(FlexDictMessage(alt_text='flexMessage', contents=contents).as_json_dict())
+
+
+def measure(call, number):
+    """measure
+        * 1回あたりの処理時間(マイクロ秒)を返す (5回計測した最小値)
+    """
+    return min(timeit.repeat(call, number=number, repeat=5)) / number * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flex Message 作成のマイクロベンチマーク')
+    parser.add_argument('--number', type=int, default=2000, help='1回の計測で作成する回数')
+    args = parser.parse_args()
+    setup_environment()
+
+    products = sample_products(5)
+    marker_array = ['1', '3']
+    recipes = sample_recipes(10)
+
+    cases = [
+        ('product list (5 items)',
+         lambda: legacy_product_list(products, list(marker_array)),
+         lambda: template_product_list(products, list(marker_array))),
+        ('recipe carousel (10 cards)',
+         lambda: legacy_carousel(recipes),
+         lambda: template_carousel(recipes)),
+    ]
+
+    print('%-36s %12s %12s %8s' % ('case', 'deepcopy us', 'template us', 'speedup'))
+    for name, legacy, template in cases:
+        # 作成結果 / 送信データが従来と同じことを確認する
+        if legacy() != template() or json.loads(legacy_payload(legacy())) != json.loads(template_payload(template())):
+            print('%s: output differs from the deepcopy version' % name, file=sys.stderr)
+            sys.exit(1)
+
+        rows = [
+            (name + ' : dict', measure(legacy, args.number), measure(template, args.number)),
+            (name + ' : payload', measure(lambda: legacy_payload(legacy()), args.number),
+             measure(lambda: template_payload(template()), args.number)),
+        ]
+        for label, legacy_us, template_us in rows:
+            print('%-36s %12.1f %12.1f %7.1fx' % (label, legacy_us, template_us, legacy_us / template_us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+create table public.push_checkpoint( 
+  notice_date numeric (8) not null
+  , shard integer not null
+  , shards integer not null
+  , last_user_id varchar (33)
+  , users integer not null
+  , status char (1) not null
+  , updated_at integer not null
+  , primary key (notice_date, shard, shards)
+);
@@ -0,0 +1,7 @@
+create table public.push_log( 
+  user_id varchar (33) not null
+  , notice_date numeric (8) not null
+  , shard integer not null
+  , notified_at integer not null
+  , primary key (user_id, notice_date)
+);
@@ -0,0 +1,5 @@
+create table public.schema_migrations( 
+  version varchar (100) not null
+  , applied_at integer not null
+  , primary key (version)
+);
@@ -0,0 +1,7 @@
+create table public.webhook_event( 
+  event_key varchar (64) not null
+  , received_at integer not null
+  , primary key (event_key)
+);
+
+create index webhook_event_received_at on public.webhook_event (received_at);
@@ -4,6 +4,10 @@ CREATE OR REPLACE FUNCTION public.process_backup()
 AS 
 '
 BEGIN 
+	-- purge.py はバッチごとにまとめてアーカイブするため、1行ずつの INSERT を行わない
+	IF current_setting(''recipebot.skip_backup'', true) = ''on'' THEN
+		RETURN OLD;
+	END IF;
 	INSERT INTO product_archive SELECT OLD.*;
 	RETURN OLD;
 END
@@ -0,0 +1,9 @@
+-- product / product_archive の登録日・賞味期限を numeric(8) (yyyymmdd) から date に変換する
+-- テーブルを書き換えるため、実行中は product への読み書きが待たされる (利用の少ない時間帯に実行する)
+ALTER TABLE public.product
+  ALTER COLUMN register_date TYPE date USING to_date(register_date::text, 'YYYYMMDD')
+  , ALTER COLUMN expire_date TYPE date USING to_date(expire_date::text, 'YYYYMMDD');
+
+ALTER TABLE public.product_archive
+  ALTER COLUMN register_date TYPE date USING to_date(register_date::text, 'YYYYMMDD')
+  , ALTER COLUMN expire_date TYPE date USING to_date(expire_date::text, 'YYYYMMDD');
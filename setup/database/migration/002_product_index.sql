@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- 商品一覧 (user_id = ? ORDER BY expire_date) / 賞味期限通知 (user_id 順・expire_date < ?) 用
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_user_id_expire_date ON public.product (user_id, expire_date);
+
+-- 賞味期限切れ商品のアーカイブ (expire_date < ?) 用
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_expire_date ON public.product (expire_date);
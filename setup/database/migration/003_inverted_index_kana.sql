@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- 転置インデックスの読み仮名での検索 (index_kana = ?) 用
+CREATE INDEX CONCURRENTLY IF NOT EXISTS inverted_index_index_kana ON public.inverted_index (index_kana);
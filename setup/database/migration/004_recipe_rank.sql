@@ -0,0 +1,11 @@
+-- レシピの人気度 (ranking.py) に使用する、楽天レシピのカテゴリ別ランキングの順位
+ALTER TABLE public.recipe ADD COLUMN IF NOT EXISTS recipe_rank integer;
+
+-- 既存のレシピは collect_recipe.py がカテゴリごとにランキング順に登録しているため、カテゴリ内の登録順を順位とする
+UPDATE public.recipe
+SET recipe_rank = ranked.recipe_rank
+FROM (
+  SELECT recipe_number, row_number() OVER (PARTITION BY large_id, medium_id, small_id ORDER BY recipe_number) AS recipe_rank
+  FROM public.recipe
+) ranked
+WHERE recipe.recipe_number = ranked.recipe_number AND recipe.recipe_rank IS NULL;
@@ -0,0 +1,279 @@
+"""build_inverted_index.py
+    * recipeテーブルから転置インデックス(inverted_indexテーブル)を一括作成するスクリプト
+    * recipe はサーバサイドカーソルで少しずつ読み込み、形態素解析はプロセスプールで並列に実行する
+    * 転置インデックスはメモリ上でまとめ、COPY形式のファイル出力 または COPY による一括登録を行う
+
+    python setup/script/build_inverted_index.py --output inverted_index.tsv
+    python setup/script/build_inverted_index.py --load --workers 4
+"""
+
+from setting import *
+from multiprocessing import Pool
+import argparse
+import collections
+import itertools
+import io
+import os
+import sys
+import time
+
+# 索引語に採用する品詞 (前方一致)
+INDEX_POS = '名詞'
+
+# COPY 対象のカラム
+COPY_COLUMNS = 'index_id, index_name, index_kana, index_category, "index"'
+
+tagger = None
+
+
+def init_mecab():
+    """init_mecab
+        * プロセスプールの各プロセスで MeCab を初期化する
+    """
+    global tagger
+    import MeCab
+    tagger = MeCab.Tagger('-Ochasen')
+
+
+def tokenize_mecab(material, all_pos):
+    """tokenize_mecab
+        * 材料を形態素解析し、索引語を返す
+
+    Args:
+        material(str): レシピの材料
+        all_pos(bool): True なら全品詞を索引語にする
+
+    Returns:
+        list: (表層形, 読み, 品詞) のリスト
+    """
+    tokens = []
+    for line in tagger.parse(material).split('\n'):
+        line_array = line.split('\t')
+
+        if line_array[0] == 'EOS' or len(line_array) < 4:
+            break
+
+        if not all_pos and not line_array[3].startswith(INDEX_POS):
+            continue
+
+        tokens.append((line_array[0], line_array[1], line_array[3]))
+
+    return tokens
+
+
+def tokenize_ngram(material, n=2):
+    """tokenize_ngram
+        * 材料を n-gram に分割し、索引語を返す
+
+    Args:
+        material(str): レシピの材料
+        n(int): 分割する文字数
+
+    Returns:
+        list: (n-gram, n-gram, 'bigram') のリスト
+    """
+    return [(material[i:i + n], material[i:i + n], 'bigram') for i in range(0, len(material) - n + 1)]
+
+
+def tokenize_chunk(args):
+    """tokenize_chunk
+        * レシピのまとまりを索引語に分割する (プロセスプールで実行)
+
+    Args:
+        args(tuple): (トークナイザ名, 全品詞フラグ, [(recipe_number, material), ...])
+
+    Returns:
+        list: (recipe_number, 重複を除いた索引語のリスト) のリスト
+    """
+    tokenizer, all_pos, recipes = args
+
+    results = []
+    for recipe_number, material in recipes:
+        if material is None:
+            results.append((recipe_number, []))
+            continue
+
+        if tokenizer == 'mecab':
+            tokens = tokenize_mecab(material, all_pos)
+        else:
+            tokens = tokenize_ngram(material)
+
+        # 1レシピ内で同じ読みは1回のみ
+        unique_tokens = {}
+        for surface, kana, category in tokens:
+            if kana and kana not in unique_tokens:
+                unique_tokens[kana] = (surface, kana, category)
+
+        results.append((recipe_number, list(unique_tokens.values())))
+
+    return results
+
+
+def stream_recipes(batch_size):
+    """stream_recipes
+        * recipeテーブルをサーバサイドカーソルで少しずつ読み込む
+
+    Args:
+        batch_size(int): 1回に取得する件数
+
+    Yields:
+        list: [(recipe_number, material), ...]
+    """
+    # SELECT recipe_number, material FROM recipe ORDER BY recipe_number ;
+    recipes = session.query(Recipe.recipe_number, Recipe.material). \
+        order_by(Recipe.recipe_number). \
+        execution_options(stream_results=True). \
+        yield_per(batch_size)
+
+    iterator = iter(recipes)
+    while True:
+        chunk = [(recipe.recipe_number, recipe.material) for recipe in itertools.islice(iterator, batch_size)]
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+
+def build_index(tokenizer, all_pos, workers, batch_size, report):
+    """build_index
+        * 転置インデックスをメモリ上に作成する
+
+    Args:
+        tokenizer(str): 'mecab' or 'ngram'
+        all_pos(bool): True なら全品詞を索引語にする
+        workers(int): 形態素解析のプロセス数
+        batch_size(int): 1回に処理するレシピ数
+        report(dict): 処理件数を記録する辞書
+
+    Returns:
+        dict: 読みをキーとした {'name', 'category', 'postings'} (出現順)
+    """
+    index = {}
+
+    def merge(results):
+        for recipe_number, tokens in results:
+            report['recipes'] += 1
+            for surface, kana, category in tokens:
+                report['postings'] += 1
+                entry = index.get(kana)
+                if entry is None:
+                    entry = {'name': surface, 'category': category, 'postings': []}
+                    index[kana] = entry
+                entry['postings'].append(recipe_number)
+
+    initializer = init_mecab if tokenizer == 'mecab' else None
+    with Pool(processes=workers, initializer=initializer) as pool:
+        # 処理中のまとまりは workers * 2 件までに抑え、投入順に結果を取り出す
+        # (レシピ番号の昇順で転置インデックスに追加される)
+        pending = collections.deque()
+        for chunk in stream_recipes(batch_size):
+            pending.append(pool.apply_async(tokenize_chunk, ((tokenizer, all_pos, chunk),)))
+            if len(pending) >= workers * 2:
+                merge(pending.popleft().get())
+
+        while pending:
+            merge(pending.popleft().get())
+
+    return index
+
+
+def escape_copy(value):
+    """escape_copy
+        * COPY の text 形式で値をエスケープする
+
+    Args:
+        value(str): 値
+
+    Returns:
+        str: エスケープした値
+    """
+    if value is None:
+        return '\\N'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def write_copy(index, stream):
+    """write_copy
+        * 転置インデックスを COPY の text 形式で書き出す
+
+    Args:
+        index(dict): build_index の結果
+        stream(obj): 書き込み先
+    """
+    for index_id, (kana, entry) in enumerate(index.items(), start=1):
+        row = [
+            str(index_id),
+            escape_copy(entry['name'][:30]),
+            escape_copy(kana[:30]),
+            escape_copy(entry['category'][:20]),
+            ','.join(str(recipe_number) for recipe_number in entry['postings']),
+        ]
+        stream.write('\t'.join(row) + '\n')
+
+
+def load_copy(index):
+    """load_copy
+        * inverted_indexテーブルを入れ替え、COPY で一括登録する (1トランザクション)
+
+    Args:
+        index(dict): build_index の結果
+    """
+    buffer = io.StringIO()
+    write_copy(index, buffer)
+    buffer.seek(0)
+
+    connection = ENGINE.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('TRUNCATE inverted_index')
+        cursor.copy_expert('COPY inverted_index (' + COPY_COLUMNS + ') FROM STDIN', buffer)
+        cursor.execute("SELECT setval(pg_get_serial_sequence('inverted_index', 'index_id'), %s)", (max(len(index), 1),))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='recipeテーブルから転置インデックスを作成する')
+    parser.add_argument('--tokenizer', choices=['mecab', 'ngram'], default='mecab')
+    parser.add_argument('--all-pos', action='store_true', help='名詞以外も索引語にする')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--output', help='COPY形式で書き出すファイル ("-" は標準出力)')
+    parser.add_argument('--load', action='store_true', help='inverted_indexテーブルを入れ替える')
+    args = parser.parse_args()
+
+    if args.output is None and not args.load:
+        parser.error('--output または --load を指定してください')
+
+    report = {'recipes': 0, 'postings': 0}
+    started = time.perf_counter()
+
+    index = build_index(args.tokenizer, args.all_pos, args.workers, args.batch_size, report)
+    built = time.perf_counter()
+
+    if args.output == '-':
+        write_copy(index, sys.stdout)
+    elif args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            write_copy(index, stream)
+
+    if args.load:
+        load_copy(index)
+    finished = time.perf_counter()
+
+    # ** 作成レポート **
+    build_seconds = built - started
+    total_seconds = finished - started
+    print('recipes   : %d' % report['recipes'], file=sys.stderr)
+    print('terms     : %d' % len(index), file=sys.stderr)
+    print('postings  : %d' % report['postings'], file=sys.stderr)
+    print('build     : %.2f sec (%.1f recipes/sec)' % (build_seconds, report['recipes'] / build_seconds if build_seconds else 0), file=sys.stderr)
+    print('total     : %.2f sec' % total_seconds, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""check_query_plan.py
+    * 商品一覧・賞味期限通知・賞味期限切れ商品のアーカイブ・転置インデックスの検索で発行する SQL の実行計画を確認するスクリプト
+    * EXPLAIN の結果に product / inverted_index の全件走査 (Seq Scan / SCAN) がある場合は終了コード1で終了する
+    * データの少ない DB ではインデックスがあっても全件走査の方が安いため、既定では全件走査を無効にして
+      (SET LOCAL enable_seqscan = off) 使用できるインデックスがあることを確認する
+      本番相当のデータで実際の実行計画を確認する場合は --real-costs を指定する
+
+    PYTHONPATH=. python setup/script/check_query_plan.py [--real-costs]
+"""
+
+from setting import *
+import argparse
+import datetime
+import json
+import sys
+
+import purge
+import push
+
+# 確認するテーブル
+CHECKED_TABLES = ('product', 'inverted_index')
+
+
+def hot_queries():
+    """hot_queries
+        * 確認する SQL (アプリケーションと同じクエリを作成する)
+
+    Returns:
+        list: (名前, SQL文)
+    """
+    today_date = datetime.date.today()
+    limit_date = today_date + datetime.timedelta(days=Push.NOTICE_DAYS)
+    product = Product.__table__
+
+    return [
+        # 商品一覧 (observer.py / postback.py)
+        ('product_list', session.query(Product.product_id, Product.product_name, Product.expire_date).
+            filter(Product.user_id == 'U00000000000000000000000000000000').
+            order_by(Product.expire_date, Product.product_id).
+            statement),
+        # 賞味期限通知 (push.py)
+        ('push_due_products', push.due_products(today_date, limit_date).statement),
+        ('push_due_products_resume', push.due_products(today_date, limit_date, 'U00000000000000000000000000000000').statement),
+        ('push_due_products_shard', push.due_products(today_date, limit_date, None, 4, 1).statement),
+        # 賞味期限切れ商品のアーカイブ (purge.py)
+        ('purge_batch', purge.MOVE_EXPIRED.bindparams(today_date=today_date, batch_size=Purge.BATCH_SIZE,
+                                                      after_product_id=0)
+            if ENGINE.dialect.name == 'postgresql' else
+            select([product.c.product_id]).
+            where(product.c.expire_date < today_date).
+            where(product.c.product_id > 0).
+            order_by(product.c.product_id).
+            limit(Purge.BATCH_SIZE)),
+        # 転置インデックスの読み仮名での検索
+        ('inverted_index_kana', session.query(InvertedIndex).
+            filter(InvertedIndex.index_kana == 'トマト').
+            statement),
+    ]
+
+
+def explain(connection, statement):
+    """explain
+        * 実行計画を取得する
+
+    Args:
+        connection(:obj:Connection): 接続
+        statement(obj): SQL文
+
+    Returns:
+        list: (走査方法, テーブル名, 使用したインデックス) ※ テーブルを読む処理のみ
+    """
+    compiled = statement.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+
+    if connection.dialect.name == 'postgresql':
+        plan = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        scans = []
+        nodes = [plan[0]['Plan']]
+        while len(nodes) != 0:
+            node = nodes.pop()
+            nodes.extend(node.get('Plans', []))
+            if 'Relation Name' in node:
+                scans.append((node['Node Type'], node['Relation Name'], node.get('Index Name', '')))
+        return scans
+
+    # SQLite : SCAN [TABLE] <table> / SEARCH [TABLE] <table> USING INDEX <index> (...)
+    scans = []
+    for row in connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params):
+        words = [word for word in row[-1].split() if word != 'TABLE']
+        if words[0] in ('SCAN', 'SEARCH') and len(words) > 1:
+            index = ' '.join(words[words.index('USING') + 1:]) if 'USING' in words else ''
+            scans.append((words[0], words[1], index))
+    return scans
+
+
+def is_full_scan(scan):
+    scan_type, table, index = scan
+    return table in CHECKED_TABLES and scan_type in ('Seq Scan', 'SCAN') and index == ''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='主要な SQL がインデックスを使用することを確認する')
+    parser.add_argument('--real-costs', action='store_true', help='全件走査を無効にせず、実際の実行計画を確認する')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    failed = 0
+
+    with ENGINE.begin() as connection:
+        if connection.dialect.name == 'postgresql' and not args.real_costs:
+            connection.execute('SET LOCAL enable_seqscan = off')
+
+        for name, statement in hot_queries():
+            scans = explain(connection, statement)
+            full_scans = [scan for scan in scans if is_full_scan(scan)]
+            failed += len(full_scans) != 0
+
+            print('%-26s %-4s %s' % (name, 'NG' if full_scans else 'OK',
+                                      ', '.join('%s %s%s' % (scan_type, table, ' (' + index + ')' if index else '')
+                                                for scan_type, table, index in scans)))
+
+    session.remove()
+    if failed != 0:
+        print('check_query_plan: %d queries scan %s without an index' % (failed, ' / '.join(CHECKED_TABLES)),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
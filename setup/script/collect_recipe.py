@@ -36,6 +36,7 @@ def main():
                 recipe.medium_id = category[1]
                 recipe.small_id = category[2]
                 recipe.register_date = get_datetime()
+                recipe.recipe_rank = int(rcp['rank'])
                 session.add(recipe)
                 session.commit()
 
@@ -40,7 +40,7 @@ def main():
                     break
                 
                 registered_index.index += ',' + str(recipe.recipe_number)
-                session.commit
+                session.commit()
 
 if __name__ == "__main__":
     main()
@@ -29,7 +29,7 @@ def main():
                     break
                 
                 registered_index.index += ',' + str(recipe.recipe_number)
-                session.commit
+                session.commit()
 
 
 def n_gram(target, n):
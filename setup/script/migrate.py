@@ -0,0 +1,136 @@
+"""migrate.py
+    * setup/database/migration の SQL をファイル名の番号順に適用するスクリプト (PostgreSQL)
+    * 適用済みのファイルは schema_migrationsテーブルに記録し、未適用のファイルのみ実行する
+    * 1ファイルを1トランザクションで実行する
+    * 先頭行が "-- migrate: no-transaction" のファイルは1文ずつ自動コミットで実行する (CREATE INDEX CONCURRENTLY 用)
+
+    PYTHONPATH=. python setup/script/migrate.py [--status] [--dry-run]
+"""
+
+from setting import *
+import argparse
+import os
+import re
+import sys
+import time
+
+MIGRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'database', 'migration')
+MIGRATION_FILE = re.compile(r'^(\d{3})_\w+\.sql$')
+NO_TRANSACTION = '-- migrate: no-transaction'
+
+
+def migrations():
+    """migrations
+        * マイグレーションのファイルを番号順に返す
+
+    Returns:
+        list: (version, ファイルパス) ※ version はファイル名 (拡張子なし)
+    """
+    names = sorted(name for name in os.listdir(MIGRATION_DIR) if MIGRATION_FILE.match(name))
+    return [(os.path.splitext(name)[0], os.path.join(MIGRATION_DIR, name)) for name in names]
+
+
+def statements(sql):
+    """statements
+        * SQL を1文ずつに分割する (行末の ; で区切る。コメント行は除く)
+
+    Args:
+        sql(str): ファイルの内容
+
+    Returns:
+        list: SQL文
+    """
+    result = []
+    lines = []
+    for line in sql.splitlines():
+        if line.strip().startswith('--') or line.strip() == '':
+            continue
+        lines.append(line)
+        if line.rstrip().endswith(';'):
+            result.append('\n'.join(lines))
+            lines = []
+
+    if len(lines) != 0:
+        result.append('\n'.join(lines))
+    return result
+
+
+def applied_versions():
+    # SELECT version FROM schema_migrations ;
+    SchemaMigration.__table__.create(ENGINE, checkfirst=True)
+    with ENGINE.connect() as connection:
+        return {row.version for row in connection.execute(select([SchemaMigration.version]))}
+
+
+def apply(version, path):
+    """apply
+        * マイグレーションを1つ実行し、schema_migrations に記録する
+
+    Args:
+        version(str): バージョン
+        path(str): ファイルパス
+    """
+    with open(path, encoding='utf-8') as file:
+        sql = file.read()
+
+    # INSERT INTO schema_migrations (version, applied_at) VALUES (?, ?) ;
+    record = SchemaMigration.__table__.insert().values(version=version, applied_at=int(time.time()))
+
+    if sql.startswith(NO_TRANSACTION):
+        # 1文ずつ自動コミット (途中で失敗した場合は IF NOT EXISTS で再実行できるように書く)
+        with ENGINE.connect() as connection:
+            autocommit = connection.execution_options(isolation_level='AUTOCOMMIT')
+            for statement in statements(sql):
+                autocommit.execute(text(statement))
+            autocommit.execute(record)
+        return
+
+    with ENGINE.begin() as connection:
+        for statement in statements(sql):
+            connection.execute(text(statement))
+        connection.execute(record)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='データベースのマイグレーション')
+    parser.add_argument('--status', action='store_true', help='適用済み / 未適用の一覧を表示する')
+    parser.add_argument('--dry-run', action='store_true', help='未適用の SQL を表示し、実行しない')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if ENGINE.dialect.name != 'postgresql':
+        print('migrate: migrations are written for PostgreSQL (%s)' % ENGINE.dialect.name, file=sys.stderr)
+        sys.exit(1)
+
+    applied = applied_versions()
+    pending = [(version, path) for version, path in migrations() if version not in applied]
+
+    if args.status:
+        for version, path in migrations():
+            print('%-10s %s' % ('applied' if version in applied else 'pending', version))
+        return
+
+    for version, path in pending:
+        if args.dry_run:
+            with open(path, encoding='utf-8') as file:
+                print('-- %s\n%s' % (version, file.read()))
+            continue
+
+        started = time.perf_counter()
+        try:
+            apply(version, path)
+        except Exception as e:
+            print(e.args)
+            print('migrate: %s failed' % version, file=sys.stderr)
+            sys.exit(1)
+        print('migrate: %s applied (%.1f sec)' % (version, time.perf_counter() - started))
+
+    if len(pending) == 0:
+        print('migrate: up to date')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""snapshot.py
+    * レシピと転置インデックスのバイナリスナップショット
+    * mmap で開くため、同じファイルを開いた複数のプロセスで物理メモリを共有できる
+    * 起動時に DB を参照せずに転置インデックスとレシピ情報を読み込める
+    * BM25 の文書長も書き出しておき、読み込み時に転置インデックスを走査しない
+
+    ** ファイル形式 (リトルエンディアン) **
+    * ヘッダ          : HEADER
+    * 索引語ディレクトリ : TERM_ENTRY × 索引語数 (索引語の昇順)
+    * 転置インデックス   : uint32 × 全レシピ番号数 (索引語ごとに昇順)
+    * レシピ          : RECIPE_ENTRY × レシピ数 (レシピ番号の昇順)
+    * 文書長          : DOC_ENTRY × 転置インデックスに含まれるレシピ数 (レシピ番号の昇順)
+    * 文字列領域       : UTF-8 文字列 (索引語 / レシピ名 / 画像URL / レシピURL)
+
+    python snapshot.py export recipe.snapshot
+"""
+
+from setting import *
+from search import read_postings, posting_watermark, count_doc_lengths
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'RCPSNAP\0'
+VERSION = 2
+
+# magic, version, 索引語数, レシピ数, 反映済みの最大レシピ番号, 全レシピ番号数, 文書長のレシピ数,
+# 索引語ディレクトリ / 転置インデックス / レシピ / 文書長 / 文字列領域 の開始位置, 文字列領域のサイズ
+# ※ 文書長の合計は全レシピ番号数と等しい (索引語ごとにレシピ番号は重複しないため)
+HEADER = struct.Struct('<8sIIIIIIQQQQQQ')
+
+# 文字列領域の位置, 長さ, 転置インデックスの開始位置(要素数), 要素数
+TERM_ENTRY = struct.Struct('<IIII')
+
+# レシピ番号, レシピ名 / 画像URL / レシピURL の文字列領域の位置と長さ, ランキング順位 (0 : 順位なし)
+RECIPE_ENTRY = struct.Struct('<IIIIIIII')
+RECIPE_FIELDS = RECIPE_ENTRY.size // 4
+
+# レシピ番号, 索引語の数
+DOC_ENTRY = struct.Struct('<II')
+
+
+class SnapshotDocLengths:
+    """SnapshotDocLengths
+        * スナップショットの文書長を mmap 上の配列のまま参照するクラス (レシピ番号の二分探索)
+        * search.DocLengths の base として使う
+
+    Attributes:
+        numbers(memoryview): レシピ番号 (昇順)
+        lengths(memoryview): レシピ番号に対応する索引語の数
+    """
+
+    def __init__(self, entries):
+        self.numbers = entries[0::2]
+        self.lengths = entries[1::2]
+
+    def get(self, recipe_number, default=None):
+        position = bisect_left(self.numbers, recipe_number)
+        if position < len(self.numbers) and self.numbers[position] == recipe_number:
+            return self.lengths[position]
+        return default
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        return iter(self.numbers)
+
+    def values(self):
+        return iter(self.lengths)
+
+
+class RecipeSnapshot:
+    """RecipeSnapshot
+        * mmap で開いたスナップショット
+
+    Attributes:
+        path(str): スナップショットのパス
+        watermark(int): スナップショットに反映済みの最大レシピ番号
+        postings(dict): 索引語をキーとしたレシピ番号配列 (mmap 上の memoryview)
+        doc_lengths(:obj:SnapshotDocLengths): レシピ番号をキーとした文書長 (mmap 上の memoryview)
+        total_doc_length(int): 文書長の合計
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.__mmap)
+        (magic, version, term_count, recipe_count, watermark, posting_count, doc_count,
+         term_offset, posting_offset, recipe_offset, doc_offset, heap_offset, heap_size) = HEADER.unpack_from(view, 0)
+
+        if magic != MAGIC:
+            raise ValueError('not a recipe snapshot: ' + path)
+        if version != VERSION:
+            raise ValueError('unsupported snapshot version: ' + str(version))
+
+        self.watermark = watermark
+        self.__heap = view[heap_offset:heap_offset + heap_size]
+        self.__numbers = self.cast_uint32(view[posting_offset:posting_offset + posting_count * 4])
+        self.__recipes = self.cast_uint32(view[recipe_offset:recipe_offset + recipe_count * RECIPE_ENTRY.size])
+        self.__recipe_count = recipe_count
+        self.doc_lengths = SnapshotDocLengths(
+            self.cast_uint32(view[doc_offset:doc_offset + doc_count * DOC_ENTRY.size]))
+        self.total_doc_length = posting_count
+
+        self.postings = {}
+        for i in range(term_count):
+            text_offset, text_length, start, length = TERM_ENTRY.unpack_from(view, term_offset + i * TERM_ENTRY.size)
+            term = self.text(text_offset, text_length)
+            self.postings[term] = self.__numbers[start:start + length]
+
+    @staticmethod
+    def cast_uint32(view):
+        """cast_uint32
+            * バイト列を uint32 の配列として参照する (リトルエンディアン以外の環境ではコピーする)
+
+        Args:
+            view(memoryview): バイト列
+
+        Returns:
+            memoryview or array: uint32 の配列
+        """
+        if sys.byteorder == 'little':
+            return view.cast('I')
+
+        numbers = array('I', view.tobytes())
+        numbers.byteswap()
+        return numbers
+
+    def text(self, offset, length):
+        """text
+            * 文字列領域から文字列を取り出す
+
+        Args:
+            offset(int): 開始位置
+            length(int): バイト数
+
+        Returns:
+            str: 文字列
+        """
+        return bytes(self.__heap[offset:offset + length]).decode('utf-8')
+
+    def find_recipe(self, recipe_number):
+        """find_recipe
+            * レシピ番号からレシピ情報を二分探索で取り出す
+
+        Args:
+            recipe_number(int): レシピ番号
+
+        Returns:
+            tuple: (recipe_number, recipe_name, recipe_photo, recipe_url) (存在しない場合は None)
+        """
+        recipes = self.__recipes
+        low = 0
+        high = self.__recipe_count
+        while low < high:
+            middle = (low + high) // 2
+            if recipes[middle * RECIPE_FIELDS] < recipe_number:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self.__recipe_count or recipes[low * RECIPE_FIELDS] != recipe_number:
+            return None
+
+        base = low * RECIPE_FIELDS
+        return (
+            recipe_number,
+            self.text(recipes[base + 1], recipes[base + 2]),
+            self.text(recipes[base + 3], recipes[base + 4]),
+            self.text(recipes[base + 5], recipes[base + 6]),
+        )
+
+    def recipe_ranks(self):
+        """recipe_ranks
+            * ランキング順位のあるレシピを返す
+
+        Returns:
+            iterator: (recipe_number, recipe_rank)
+        """
+        recipes = self.__recipes
+        for base in range(0, self.__recipe_count * RECIPE_FIELDS, RECIPE_FIELDS):
+            if recipes[base + 7] != 0:
+                yield recipes[base], recipes[base + 7]
+
+
+def write_snapshot(path, postings, recipes, watermark):
+    """write_snapshot
+        * スナップショットを書き出す (一時ファイルに書き込んでから置き換える)
+
+    Args:
+        path(str): 書き出し先
+        postings(dict): 索引語をキーとしたソート済みレシピ番号配列
+        recipes(list): (recipe_number, recipe_name, recipe_photo, recipe_url, recipe_rank) のリスト
+        watermark(int): スナップショットに反映済みの最大レシピ番号
+    """
+    heap = bytearray()
+
+    def add_text(value):
+        data = (value or '').encode('utf-8')
+        offset = len(heap)
+        heap.extend(data)
+        return offset, len(data)
+
+    terms = sorted(postings)
+    term_entries = bytearray()
+    numbers = array('I')
+    for term in terms:
+        text_offset, text_length = add_text(term)
+        term_entries.extend(TERM_ENTRY.pack(text_offset, text_length, len(numbers), len(postings[term])))
+        numbers.extend(postings[term])
+
+    recipe_entries = bytearray()
+    for recipe_number, recipe_name, recipe_photo, recipe_url, recipe_rank in sorted(recipes):
+        recipe_entries.extend(RECIPE_ENTRY.pack(
+            recipe_number, *add_text(recipe_name), *add_text(recipe_photo), *add_text(recipe_url), recipe_rank or 0))
+
+    doc_lengths = count_doc_lengths(postings)
+    doc_entries = bytearray()
+    for recipe_number in sorted(doc_lengths):
+        doc_entries.extend(DOC_ENTRY.pack(recipe_number, doc_lengths[recipe_number]))
+
+    if sys.byteorder != 'little':
+        numbers.byteswap()
+
+    term_offset = HEADER.size
+    posting_offset = term_offset + len(term_entries)
+    recipe_offset = posting_offset + len(numbers) * 4
+    doc_offset = recipe_offset + len(recipe_entries)
+    heap_offset = doc_offset + len(doc_entries)
+
+    header = HEADER.pack(MAGIC, VERSION, len(terms), len(recipes), watermark, len(numbers), len(doc_lengths),
+                         term_offset, posting_offset, recipe_offset, doc_offset, heap_offset, len(heap))
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        f.write(term_entries)
+        f.write(numbers.tobytes())
+        f.write(recipe_entries)
+        f.write(doc_entries)
+        f.write(heap)
+    os.replace(temporary, path)
+
+
+def export_snapshot(path):
+    """export_snapshot
+        * recipe / inverted_index テーブルからスナップショットを作成する
+
+    Args:
+        path(str): 書き出し先
+
+    Returns:
+        tuple: (索引語数, レシピ数)
+    """
+    postings = read_postings()
+
+    # SELECT recipe_number, recipe_name, recipe_photo, recipe_url, recipe_rank FROM recipe ;
+    recipes = [tuple(recipe) for recipe in session.query(
+        Recipe.recipe_number, Recipe.recipe_name, Recipe.recipe_photo, Recipe.recipe_url, Recipe.recipe_rank).all()]
+
+    # 転置インデックスに反映済みの最大レシピ番号 (これより後のレシピは各プロセスが差分として読み込む)
+    watermark = posting_watermark(postings)
+    write_snapshot(path, postings, recipes, watermark)
+
+    return len(postings), len(recipes)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != 'export':
+        print('usage: python snapshot.py export <path>', file=sys.stderr)
+        sys.exit(2)
+
+    term_count, recipe_count = export_snapshot(sys.argv[2])
+    print('terms: %d, recipes: %d -> %s' % (term_count, recipe_count, sys.argv[2]))
@@ -0,0 +1,226 @@
+"""status_cache.py
+    * ユーザごとの会話の位置 (statusテーブル) をプロセス内にキャッシュする
+    * キャッシュにヒットした場合は DB を参照せずに status を返す
+    * 更新は write_through (イベントと同じトランザクション) または write_behind (バックグラウンドでまとめて更新) で反映する
+    * write_behind では連続した更新を最新の1回にまとめ、バージョンで書き込み済みかを判定する
+"""
+
+from setting import *
+from cache import LRUCache
+import atexit
+import itertools
+import threading
+import time
+
+# キャッシュする status のカラム
+STATUS_COLUMNS = ('register_status', 'list_status', 'recipe_status', 'web_status')
+
+# UPDATE status SET ... WHERE user_id = ? ; (executemany)
+UPDATE_STATUS = Status.__table__.update(). \
+    where(Status.__table__.c.user_id == bindparam('target_user_id')). \
+    values({column: bindparam('target_' + column) for column in STATUS_COLUMNS})
+
+
+class StatusCache:
+    """StatusCache
+        * statusテーブルのキャッシュ
+
+    Attributes:
+        mode(str): 'off' / 'write_through' / 'write_behind'
+        flush_delay(float): write_behind で連続した更新をまとめる秒数
+    """
+
+    def __init__(self, mode, size, flush_delay):
+        self.mode = mode
+        self.flush_delay = flush_delay
+        self.__entries = LRUCache(size)
+        self.__pending = {}
+        self.__versions = itertools.count(1)
+        self.__lock = threading.Lock()
+        self.__changed = threading.Condition(self.__lock)
+        self.__flush_lock = threading.Lock()
+        self.__thread = None
+        self.__counts = {'writes': 0, 'coalesced': 0, 'flushes': 0, 'failed': 0}
+
+    @property
+    def enabled(self):
+        return self.mode in ('write_through', 'write_behind')
+
+    def load(self, user_id):
+        """load
+            * ユーザの status を返す
+            * キャッシュ有効時は DB と切り離した Status を返し、更新は save() で反映する
+
+        Args:
+            user_id(str): ユーザID
+
+        Returns:
+            status(:obj:Status): ユーザの status (存在しない場合は None)
+        """
+        if not self.enabled:
+            # SELECT * FROM status WHERE user_id = ? ;
+            return session.query(Status). \
+                filter(Status.user_id == user_id). \
+                first()
+
+        with self.__lock:
+            # 書き込み前の更新はキャッシュから追い出されていても保持している
+            entry = self.__pending.get(user_id) or self.__entries.get(user_id)
+
+        if entry is None:
+            # SELECT register_status, list_status, recipe_status, web_status FROM status WHERE user_id = ? ;
+            row = session.query(*[getattr(Status, column) for column in STATUS_COLUMNS]). \
+                filter(Status.user_id == user_id). \
+                first()
+
+            if row is None:
+                return None
+
+            entry = (0, tuple(row))
+            self.__entries.put(user_id, entry)
+
+        return Status(user_id=user_id, **dict(zip(STATUS_COLUMNS, entry[1])))
+
+    def save(self, unit_of_work, status):
+        """save
+            * 更新した status を反映する
+            * キャッシュはイベントのトランザクションを commit した後に更新する
+
+        Args:
+            unit_of_work(:obj:UnitOfWork): イベントのトランザクション
+            status(:obj:Status): 更新した status
+        """
+        if not self.enabled:
+            session.flush()
+            return
+
+        user_id = status.user_id
+        values = tuple(getattr(status, column) for column in STATUS_COLUMNS)
+
+        if self.mode == 'write_through':
+            # UPDATE status SET ... WHERE user_id = ? ;
+            unit_of_work.before_commit(lambda: session.execute(UPDATE_STATUS, [self.to_parameters(user_id, values)]))
+
+        unit_of_work.after_commit(lambda: self.put(user_id, values))
+
+    def put(self, user_id, values):
+        """put
+            * 新しいバージョンとしてキャッシュに登録し、write_behind の場合は書き込み待ちにする
+
+        Args:
+            user_id(str): ユーザID
+            values(tuple): STATUS_COLUMNS の値
+        """
+        with self.__lock:
+            entry = (next(self.__versions), values)
+            self.__entries.put(user_id, entry)
+
+            if self.mode == 'write_behind':
+                if user_id in self.__pending:
+                    self.__counts['coalesced'] += 1
+                self.__pending[user_id] = entry
+                self.__changed.notify()
+
+        if self.mode == 'write_behind':
+            self.start()
+
+    def invalidate(self, user_id):
+        """invalidate
+            * ユーザのキャッシュと書き込み待ちの更新を破棄する (follow / unfollow 時)
+            * 書き込み中の更新がある場合は、完了を待ってから破棄する
+
+        Args:
+            user_id(str): ユーザID
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                self.__entries.pop(user_id)
+                self.__pending.pop(user_id, None)
+
+    def start(self):
+        """start
+            * 書き込みスレッドを起動する (起動済みの場合は何もしない)
+        """
+        with self.__lock:
+            if self.__thread is not None:
+                return
+
+            self.__thread = threading.Thread(target=self.run, name='status-writer', daemon=True)
+            self.__thread.start()
+
+    def run(self):
+        """run
+            * 書き込み待ちの更新を flush_delay 秒ごとにまとめて書き込む
+        """
+        while True:
+            with self.__lock:
+                self.__changed.wait_for(lambda: len(self.__pending) != 0)
+
+            time.sleep(self.flush_delay)
+            self.flush()
+            session.remove()
+
+    def flush(self):
+        """flush
+            * 書き込み待ちの更新を1トランザクションで書き込む
+
+        Returns:
+            int: 書き込んだ件数
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                batch = dict(self.__pending)
+
+            if len(batch) == 0:
+                return 0
+
+            try:
+                # UPDATE status SET ... WHERE user_id = ? ; (ユーザごとに最新の1回のみ)
+                session.execute(UPDATE_STATUS, [self.to_parameters(user_id, values)
+                                                for user_id, (version, values) in batch.items()])
+                session.commit()
+            except Exception as e:
+                print(e.args)
+                session.rollback()
+                with self.__lock:
+                    self.__counts['failed'] += 1
+                return 0
+
+            with self.__lock:
+                for user_id, (version, values) in batch.items():
+                    # 書き込み中に更新されたユーザは、次回に書き込む
+                    if self.__pending.get(user_id, (None,))[0] == version:
+                        del self.__pending[user_id]
+                self.__counts['writes'] += len(batch)
+                self.__counts['flushes'] += 1
+
+        return len(batch)
+
+    def stats(self):
+        """stats
+            * キャッシュのヒット数と書き込み件数を返す
+
+        Returns:
+            dict: 件数
+        """
+        with self.__lock:
+            stats = dict(self.__counts)
+            stats['pending'] = len(self.__pending)
+
+        stats['mode'] = self.mode
+        stats['entries'] = len(self.__entries)
+        stats['hits'] = self.__entries.hits
+        stats['misses'] = self.__entries.misses
+        return stats
+
+    @staticmethod
+    def to_parameters(user_id, values):
+        parameters = {'target_' + column: value for column, value in zip(STATUS_COLUMNS, values)}
+        parameters['target_user_id'] = user_id
+        return parameters
+
+
+status_cache = StatusCache(StatusWrite.MODE, CacheSize.STATUS, StatusWrite.FLUSH_DELAY)
+
+# 終了時に書き込み待ちの更新を書き込む
+atexit.register(status_cache.flush)
@@ -0,0 +1,155 @@
+"""template.py
+    * setting.py の Message に定義した Flex Message のフォーマットを、値を埋め込む関数にコンパイルする
+    * コンパイルは起動時に1度だけ行い、メッセージ作成時は copy.deepcopy をせずに新しい dict を作成する
+    * 作成した dict は line-bot-sdk のモデルに変換せず、そのまま送信する (FlexDictMessage)
+"""
+
+from setting import *
+from linebot.models import (
+    SendMessage
+)
+
+# テンプレートに埋め込める定数の型
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+
+class FlexTemplate:
+    """FlexTemplate
+        * Flex Message のフォーマットをコンパイルしたテンプレート
+        * スロットのパス以外の値は定数としてコードに埋め込み、呼び出しごとに dict / list のリテラルを評価する
+
+    Attributes:
+        name(str): テンプレート名
+        slots(tuple): スロット名 (キーワード引数で値を渡す)
+    """
+
+    def __init__(self, name, template, **slots):
+        self.name = name
+        self.slots = tuple(slots)
+        self.source = self.generate(template, slots)
+
+        namespace = {}
+        exec(compile(self.source, '<template ' + name + '>', 'exec'), namespace)
+        self.__build = namespace['build']
+
+    def __call__(self, **values):
+        return self.__build(**values)
+
+    def generate(self, template, slots):
+        """generate
+            * テンプレートを作成する関数のソースコードを返す
+
+        Args:
+            template(dict): Message に定義したフォーマット
+            slots(dict): スロット名をキーとしたパス (dict のキー / list の位置のタプル)
+
+        Returns:
+            str: build 関数のソースコード
+        """
+        paths = {tuple(path): slot for slot, path in slots.items()}
+        used = set()
+
+        def emit(node, path):
+            if path in paths:
+                used.add(path)
+                return paths[path]
+
+            if isinstance(node, dict):
+                items = [repr(key) + ': ' + emit(value, path + (key,)) for key, value in node.items()]
+
+                # フォーマットに無いキーのスロットは末尾に追加する
+                for slot_path, slot in paths.items():
+                    if slot_path[:-1] == path and slot_path[-1] not in node:
+                        used.add(slot_path)
+                        items.append(repr(slot_path[-1]) + ': ' + slot)
+
+                return '{' + ', '.join(items) + '}'
+
+            if isinstance(node, list):
+                return '[' + ', '.join(emit(value, path + (i,)) for i, value in enumerate(node)) + ']'
+
+            if isinstance(node, LITERAL_TYPES):
+                return repr(node)
+
+            raise TypeError('unsupported value in template ' + self.name + ': ' + repr(node))
+
+        body = emit(template, ())
+
+        unused = [paths[path] for path in paths if path not in used]
+        if len(unused) != 0:
+            raise ValueError('slot path not found in template ' + self.name + ': ' + ', '.join(unused))
+
+        arguments = '*, ' + ', '.join(self.slots) if len(self.slots) != 0 else ''
+        return 'def build(' + arguments + '):\n    return ' + body + '\n'
+
+
+class FlexDictMessage(SendMessage):
+    """FlexDictMessage
+        * dict の Flex Message をそのまま送信する SendMessage
+        * FlexSendMessage は dict を SDK のモデルに変換してから JSON に戻すため、その処理を省く
+
+    Attributes:
+        alt_text(str): 代替テキスト
+        contents(dict): bubble / carousel
+    """
+
+    def __init__(self, alt_text, contents, **kwargs):
+        super(FlexDictMessage, self).__init__(**kwargs)
+        self.type = 'flex'
+        self.alt_text = alt_text
+        self.contents = contents
+
+    def as_json_dict(self):
+        return {'type': self.type, 'altText': self.alt_text, 'contents': self.contents}
+
+
+class Template:
+    """Template
+        * Message のフォーマットをコンパイルしたテンプレート
+        * styles など共有する dict を渡した場合は、作成後に変更しないこと
+    """
+
+    CAROUSEL = FlexTemplate('CAROUSEL_FLAME', Message.CAROUSEL_FLAME, contents=('contents',))
+
+    BUBBLE = FlexTemplate('BUBBLE_FLAME', Message.BUBBLE_FLAME,
+                          header=('header',), body=('body',), styles=('styles',))
+
+    # body は商品が0件の場合に省略するため、作成後に追加する
+    LIST_BUBBLE = FlexTemplate('BUBBLE_FLAME', Message.BUBBLE_FLAME,
+                               header=('header',), footer=('footer',), styles=('styles',))
+
+    HEADER = FlexTemplate('HEADER_FLAME', Message.HEADER_FLAME,
+                          title=('contents', 0, 'text'), text=('contents', 1, 'text'))
+
+    BODY = FlexTemplate('BODY_FLAME', Message.BODY_FLAME, contents=('contents',))
+
+    CALENDER_BODY = FlexTemplate('CALENDER_BODY', Message.CALENDER_BODY,
+                                 pick_data=('contents', 0, 'action', 'data'),
+                                 min_date=('contents', 0, 'action', 'min'),
+                                 cancel_data=('contents', 1, 'action', 'data'))
+
+    LIST_CONTENTS = FlexTemplate('LIST_CONTENTS', Message.LIST_CONTENTS,
+                                 color=('contents', 0, 'color'),
+                                 label=('contents', 0, 'action', 'label'),
+                                 data=('contents', 0, 'action', 'data'))
+
+    RECIPE_BUTTON = FlexTemplate('RECIPE_BUTTON', Message.RECIPE_BUTTON,
+                                 label=('contents', 0, 'action', 'label'),
+                                 data=('contents', 0, 'action', 'data'))
+
+    LIST_FOOTER = FlexTemplate('LIST_FOOTER', Message.LIST_FOOTER,
+                               back_data=('contents', 0, 'action', 'data'),
+                               page=('contents', 1, 'text'),
+                               next_data=('contents', 2, 'action', 'data'))
+
+    SELECT_BODY = FlexTemplate('SELECT_BODY', Message.SELECT_BODY,
+                               change_data=('contents', 0, 'contents', 0, 'action', 'data'),
+                               delete_data=('contents', 1, 'contents', 0, 'action', 'data'))
+
+    DATA_FORMAT = FlexTemplate('DATA_FORMAT', Message.DATA_FORMAT, sequence=('sequence',), command=('command',))
+
+    RECIPE_BODY = FlexTemplate('RECIPE_BODY', Message.RECIPE_BODY,
+                               title=('header', 'contents', 0, 'text'),
+                               photo=('hero', 'url'),
+                               url=('footer', 'contents', 0, 'action', 'uri'),
+                               styles=('styles',))
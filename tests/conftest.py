@@ -0,0 +1,51 @@
+"""conftest.py
+    * テストの共通設定
+    * setting.py が参照する環境変数を設定し、リポジトリ直下と setup/benchmark (スタブサーバ) を import できるようにする
+    * スタブサーバと、再試行の待機を記録するフィクスチャ
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('YOUR_CHANNEL_ACCESS_TOKEN', 'test')
+os.environ.setdefault('YOUR_CHANNEL_SECRET', 'test')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+sys.path.insert(0, os.path.join(REPOSITORY, 'setup', 'benchmark'))
+sys.path.insert(0, REPOSITORY)
+
+# 環境変数を設定してから import する
+import line_client
+import line_stub
+
+
+@pytest.fixture
+def server():
+    """server
+        * スタブサーバを空きポートで起動する (遅延・ランダムなエラーなし)
+    """
+    server = line_stub.serve(0, 0, 0, 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub(server):
+    return server.state
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """sleeps
+        * 再試行の待機を実際には行わず、待機時間を記録する
+    """
+    waited = []
+    monkeypatch.setattr(line_client, 'time', types.SimpleNamespace(
+        perf_counter=line_client.time.perf_counter, sleep=waited.append))
+    return waited
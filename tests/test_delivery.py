@@ -0,0 +1,168 @@
+"""test_delivery.py
+    * delivery.py の送信 (multicast へのまとめ・トークンバケット・再試行・送信結果) を確認するテスト
+    * 空きポートで起動したスタブサーバ (setup/benchmark/line_stub.py) に送信し、返すエラーは fail_next で指定する
+
+    python -m pytest -q tests
+"""
+
+import functools
+import threading
+import types
+
+import pytest
+from linebot import LineBotApi
+
+import delivery
+import line_client
+
+MAX_RETRIES = 2
+
+
+def user_id(number):
+    return 'U%032d' % number
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """clock
+        * delivery.py の時刻を進めた分だけ経過したことにする (sleep は待たずに時刻を進める)
+    """
+    clock = types.SimpleNamespace(now=0.0, sleeps=[])
+
+    def sleep(seconds):
+        clock.sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(delivery, 'time', types.SimpleNamespace(
+        monotonic=lambda: clock.now, perf_counter=delivery.time.perf_counter, sleep=sleep))
+    return clock
+
+
+@pytest.fixture
+def api(server, sleeps):
+    client = LineBotApi('test', endpoint='http://127.0.0.1:%d' % server.server_address[1],
+                        http_client=functools.partial(line_client.PooledHttpClient, max_retries=MAX_RETRIES))
+    yield client
+    client.http_client.session.close()
+
+
+def engine(api, senders=1, multicast_size=3, group_window=10):
+    return delivery.DeliveryEngine(api, senders, push_rate=1000, multicast_rate=1000,
+                                   multicast_size=multicast_size, group_window=group_window)
+
+
+class Delivered:
+    """Delivered
+        * on_delivered で受け取ったユーザIDを記録する
+    """
+
+    def __init__(self):
+        self.user_ids = []
+        self.lock = threading.Lock()
+
+    def __call__(self, user_ids):
+        with self.lock:
+            self.user_ids.extend(user_ids)
+
+
+def test_token_bucket_paces_requests(clock):
+    bucket = delivery.TokenBucket(rate=10, capacity=2)
+
+    waited = [bucket.acquire() for _ in range(5)]
+
+    # 保持している2回分はすぐに送信し、以降は 1 / rate 秒ごとに送信する
+    assert waited[:2] == [0.0, 0.0]
+    assert waited[2:] == pytest.approx([0.1, 0.1, 0.1])
+    assert sum(clock.sleeps) == pytest.approx(0.3)
+
+    clock.now += 1.0
+    assert bucket.acquire() == 0.0
+
+
+def test_identical_messages_are_multicast(api, stub, clock):
+    notices = [(user_id(number), 'A') for number in range(5)] + \
+              [(user_id(number), 'B') for number in range(5, 7)] + [(user_id(7), 'C')]
+    delivered = Delivered()
+
+    report = engine(api, senders=2).deliver(iter(notices), on_delivered=delivered)
+
+    # A : 3人 (multicast_size) + 2人、B : 2人、C : 1人 (push)
+    assert stub.stats() == {'multicast': 3, 'recipients': 7, 'push': 1}
+    assert stub.deliveries == {user: 1 for user, text in notices}
+    assert sorted(delivered.user_ids) == sorted(user for user, text in notices)
+    counts = report.as_dict()
+    assert (counts['delivered'], counts['failed'], counts['multicast'], counts['multicast_recipients'],
+            counts['push']) == (8, 0, 3, 7, 1)
+
+
+def test_group_window_flushes_buffered_messages(api, stub, clock):
+    notices = [(user_id(number), 'message %d' % (number % 2)) for number in range(6)]
+
+    report = engine(api, multicast_size=100, group_window=4).deliver(iter(notices))
+
+    # 4人分で送信し、残りの2人は最後に送信する (同じ内容でも multicast_size に達するまで待たない)
+    assert stub.stats() == {'multicast': 2, 'push': 2, 'recipients': 4}
+    assert report.as_dict()['delivered'] == 6
+
+
+def test_retries_429_and_5xx(api, stub, sleeps, clock):
+    stub.fail_next(429, retry_after='0')
+    stub.fail_next(503)
+    delivered = Delivered()
+
+    report = engine(api).deliver(iter([(user_id(1), 'A'), (user_id(2), 'B')]), on_delivered=delivered)
+
+    assert stub.stats() == {'429': 1, '503': 1, 'push': 2}
+    assert stub.deliveries == {user_id(1): 1, user_id(2): 1}
+    assert delivered.user_ids == [user_id(1), user_id(2)]
+    assert len(sleeps) == 2
+    counts = report.as_dict()
+    assert (counts['delivered'], counts['failed'], counts['retries']) == (2, 0, 2)
+
+
+def test_retry_key_conflict_counts_as_delivered(api, stub, clock):
+    # 1回目は受け付けられたが応答が届かず (500)、同じ X-Line-Retry-Key の再試行が 409 になる
+    stub.fail_next(500, accept=True)
+    delivered = Delivered()
+
+    report = engine(api).deliver(iter([(user_id(1), 'A'), (user_id(2), 'A'), (user_id(3), 'B')]),
+                                 on_delivered=delivered)
+
+    assert stub.stats() == {'500': 1, '409': 1, 'multicast': 1, 'recipients': 2, 'push': 1}
+    assert stub.deliveries == {user_id(1): 1, user_id(2): 1, user_id(3): 1}
+    assert sorted(delivered.user_ids) == [user_id(1), user_id(2), user_id(3)]
+    counts = report.as_dict()
+    assert (counts['delivered'], counts['failed'], counts['already_accepted'], counts['retries']) == (3, 0, 1, 1)
+
+
+def test_report_and_callback_for_failed_recipients(api, stub, clock):
+    # 1件目 : 再試行しないエラー、2件目 : 再試行の上限を超える 5xx、3件目 : 成功
+    stub.fail_next(400)
+    stub.fail_next(500, times=MAX_RETRIES + 1)
+    notices = [(user_id(1), 'A'), (user_id(2), 'A'), (user_id(3), 'B'), (user_id(4), 'C')]
+    delivered = Delivered()
+
+    report = engine(api).deliver(iter(notices), on_delivered=delivered)
+
+    # 送信できたユーザのみ on_delivered に渡す (push.py は通知済みとして記録する)
+    assert delivered.user_ids == [user_id(4)]
+    assert stub.deliveries == {user_id(4): 1}
+
+    counts = report.as_dict()
+    assert counts.pop('elapsed_sec') >= 0
+    assert counts.pop('users_per_sec') >= 0
+    assert counts == {
+        'delivered': 1, 'failed': 3, 'push': 2, 'multicast': 1, 'multicast_recipients': 0, 'already_accepted': 0,
+        'retries': MAX_RETRIES, 'throttled_ms': 0, 'users': 4, 'errors': {'400': 1, '500': 1},
+        'failed_users': [user_id(1), user_id(2), user_id(3)],
+    }
+
+
+def test_callback_error_is_reported(api, stub, clock):
+    def on_delivered(user_ids):
+        raise RuntimeError('database is down')
+
+    report = engine(api).deliver(iter([(user_id(1), 'A')]), on_delivered=on_delivered)
+
+    counts = report.as_dict()
+    assert (counts['delivered'], counts['failed'], counts['errors']) == (1, 0, {'on_delivered': 1})
@@ -0,0 +1,133 @@
+"""test_line_client.py
+    * line_client.py の再試行の規則と、エンドポイントごとの集計を確認するテスト
+    * 空きポートで起動したスタブサーバ (setup/benchmark/line_stub.py) に送信し、返すエラーは fail_next で指定する
+
+    python -m pytest -q tests
+"""
+
+import functools
+
+import pytest
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+import line_client
+
+USER_ID = 'U' + '0' * 32
+MAX_RETRIES = 2
+
+
+@pytest.fixture
+def api(server, sleeps):
+    client = LineBotApi('test', endpoint='http://127.0.0.1:%d' % server.server_address[1],
+                        http_client=functools.partial(line_client.PooledHttpClient, max_retries=MAX_RETRIES))
+    yield client
+    client.http_client.session.close()
+
+
+def stats(api):
+    return api.http_client.stats.snapshot()
+
+
+def test_reply_retries_429(api, stub, sleeps):
+    stub.fail_next(429, retry_after='0')
+
+    api.reply_message('token-429', TextSendMessage(text='hello'))
+
+    assert stub.stats() == {'429': 1, 'reply': 1}
+    assert stub.get_reply('token-429') == [{'type': 'text', 'text': 'hello'}]
+    assert len(sleeps) == 1
+    entry = stats(api)['POST /v2/bot/message/reply']
+    assert (entry['count'], entry['errors'], entry['retries']) == (2, 1, 1)
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 504])
+def test_reply_does_not_retry_5xx(api, stub, sleeps, status):
+    stub.fail_next(status)
+
+    with pytest.raises(LineBotApiError) as error:
+        api.reply_message('token-5xx', TextSendMessage(text='hello'))
+
+    assert error.value.status_code == status
+    assert stub.stats() == {str(status): 1}
+    assert sleeps == []
+    entry = stats(api)['POST /v2/bot/message/reply']
+    assert (entry['count'], entry['errors'], entry['retries']) == (1, 1, 0)
+
+
+def test_push_retries_5xx_with_retry_key(api, stub, sleeps):
+    stub.fail_next(500)
+    stub.fail_next(503)
+
+    api.push_message(USER_ID, TextSendMessage(text='hello'))
+
+    # 再試行しても同じ X-Line-Retry-Key を使うため、受け付けられるのは1回だけ (409 にならない)
+    assert stub.stats() == {'500': 1, '503': 1, 'push': 1}
+    assert len(stub.retry_keys) == 1
+    assert stub.deliveries == {USER_ID: 1}
+    assert len(sleeps) == 2
+    entry = stats(api)['POST /v2/bot/message/push']
+    assert (entry['count'], entry['errors'], entry['retries']) == (3, 2, 2)
+
+
+def test_multicast_retries_5xx(api, stub, sleeps):
+    stub.fail_next(502)
+
+    api.multicast([USER_ID], TextSendMessage(text='hello'))
+
+    assert stub.stats() == {'502': 1, 'multicast': 1, 'recipients': 1}
+    entry = stats(api)['POST /v2/bot/message/multicast']
+    assert (entry['count'], entry['errors'], entry['retries']) == (2, 1, 1)
+
+
+def test_get_retries_5xx(api, stub, sleeps):
+    stub.fail_next(500)
+
+    profile = api.get_profile(USER_ID)
+
+    assert profile.user_id == USER_ID
+    assert stub.stats() == {'500': 1, 'profile': 1}
+    entry = stats(api)['GET /v2/bot/profile/{id}']
+    assert (entry['count'], entry['errors'], entry['retries']) == (2, 1, 1)
+
+
+def test_retry_after_is_respected(api, stub, sleeps):
+    stub.fail_next(429, retry_after='5')
+    stub.fail_next(429, retry_after='60')
+
+    api.reply_message('token-retry-after', TextSendMessage(text='hello'))
+
+    # 待機時間はジッタ (BACKOFF_BASE 以下) より長い Retry-After になり、BACKOFF_MAX を上限とする
+    assert sleeps == [5.0, line_client.LineApi.BACKOFF_MAX]
+    assert stub.stats() == {'429': 2, 'reply': 1}
+
+
+def test_gives_up_after_max_retries(api, stub, sleeps):
+    stub.fail_next(429, times=MAX_RETRIES + 1, retry_after='0')
+
+    with pytest.raises(LineBotApiError) as error:
+        api.reply_message('token-limit', TextSendMessage(text='hello'))
+
+    assert error.value.status_code == 429
+    assert stub.stats() == {'429': MAX_RETRIES + 1}
+    assert len(sleeps) == MAX_RETRIES
+    entry = stats(api)['POST /v2/bot/message/reply']
+    assert (entry['count'], entry['errors'], entry['retries']) == (MAX_RETRIES + 1, MAX_RETRIES + 1, MAX_RETRIES)
+
+
+def test_stats_per_endpoint(api, stub, sleeps):
+    stub.fail_next(500)
+    with pytest.raises(LineBotApiError):
+        api.reply_message('token-a', TextSendMessage(text='a'))
+    api.reply_message('token-b', TextSendMessage(text='b'))
+    api.get_profile(USER_ID)
+    api.get_profile('U' + 'f' * 32)
+
+    snapshot = stats(api)
+    assert sorted(snapshot) == ['GET /v2/bot/profile/{id}', 'POST /v2/bot/message/reply']
+    reply = snapshot['POST /v2/bot/message/reply']
+    profile = snapshot['GET /v2/bot/profile/{id}']
+    assert (reply['count'], reply['errors'], reply['retries']) == (2, 1, 0)
+    assert (profile['count'], profile['errors'], profile['retries']) == (2, 0, 0)
+    assert 0 <= reply['p50_ms'] <= reply['p95_ms'] <= reply['p99_ms'] <= reply['max_ms']
@@ -0,0 +1,78 @@
+"""test_worker.py
+    * worker.py の EventWorkerPool のバックプレッシャーと、ユーザごとの処理順を確認するテスト
+
+    python -m pytest -q tests
+"""
+
+import threading
+import types
+
+from worker import EventWorkerPool
+
+QUEUE_SIZE = 3
+EVENTS = 20
+
+
+def user_event(user_id, number):
+    return types.SimpleNamespace(source=types.SimpleNamespace(user_id=user_id), number=number)
+
+
+def test_single_user_burst_stays_within_queue_size():
+    gate = threading.Event()
+    processed = []
+    depths = []
+
+    def dispatch(event):
+        gate.wait(5)
+        depths.append(pool.stats()['queue_depth'])
+        processed.append(event.number)
+
+    pool = EventWorkerPool(dispatch, workers=2, queue_size=QUEUE_SIZE, put_timeout=0.01)
+    events = [user_event('U' + '1' * 32, number) for number in range(EVENTS)]
+    batches = []
+    submitter = threading.Thread(target=lambda: batches.append(pool.submit_all(events)))
+    submitter.start()
+
+    # 処理待ちが一杯になると、受け付けたスレッドはレーンが空くまで待ち、処理待ちを増やさない
+    submitter.join(0.5)
+    assert submitter.is_alive()
+    stats = pool.stats()
+    assert stats['queue_depth'] == QUEUE_SIZE
+    assert stats['overflow'] == 1
+
+    gate.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    assert batches[0].wait(5)
+    assert pool.drain(5)
+
+    stats = pool.stats()
+    assert processed == list(range(EVENTS))
+    assert max(depths) <= QUEUE_SIZE
+    assert stats['max_depth'] <= QUEUE_SIZE
+    assert stats['enqueued'] + stats['overflow'] == EVENTS
+    assert (stats['processed'], stats['failed'], stats['queue_depth'], stats['pending'], stats['lanes']) == \
+        (EVENTS, 0, 0, 0, 0)
+    pool.shutdown(1)
+
+
+def test_other_users_are_not_blocked_by_a_busy_lane():
+    gate = threading.Event()
+    processed = []
+
+    def dispatch(event):
+        if event.source.user_id.startswith('Ubusy'):
+            gate.wait(5)
+        processed.append(event.source.user_id)
+
+    pool = EventWorkerPool(dispatch, workers=2, queue_size=QUEUE_SIZE, put_timeout=0.01)
+    pool.submit_all([user_event('Ubusy', number) for number in range(QUEUE_SIZE)])
+
+    # 処理待ちが一杯でも、レーンの無いユーザのイベントは受け付けたスレッドですぐに処理する
+    assert pool.submit(user_event('Uidle', 0)) is False
+    assert processed == ['Uidle']
+
+    gate.set()
+    assert pool.drain(5)
+    assert pool.stats()['processed'] == QUEUE_SIZE + 1
+    pool.shutdown(1)
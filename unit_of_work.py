@@ -0,0 +1,106 @@
+"""unit_of_work.py
+    * 1イベントの処理を1トランザクションにまとめる
+    * observer は session.flush() までを行い、commit / rollback は notify_observer で1度だけ行う
+    * 返信メッセージはトランザクションの確定後に送信する (DB 更新に失敗した場合はエラーメッセージを返信する)
+"""
+
+from setting import *
+from line_client import line_bot_api
+from linebot.models import (
+    TextSendMessage
+)
+
+
+class UnitOfWork:
+    """UnitOfWork
+        * イベント単位のトランザクションと返信メッセージを管理するクラス
+
+    Attributes:
+        reply_token(str): イベントの replyToken (unfollow など返信できないイベントは None)
+        replies(list): 確定後に送信するメッセージ
+        committed(bool): commit 済みの場合は True
+    """
+
+    def __init__(self, reply_token):
+        self.reply_token = reply_token
+        self.replies = []
+        self.committed = False
+        self.__before_commit = []
+        self.__after_commit = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 想定外の例外で抜けた場合は、途中までの更新を破棄する
+        if exc_type is not None and not self.committed:
+            session.rollback()
+        return False
+
+    def reply(self, message):
+        """reply
+            * 確定後に送信するメッセージを登録する
+
+        Args:
+            message(obj): TextSendMessage / FlexDictMessage
+        """
+        self.replies.append(message)
+
+    def before_commit(self, callback):
+        """before_commit
+            * commit の直前に (同じトランザクションで) 実行する処理を登録する
+
+        Args:
+            callback(function): 引数なしで呼び出す関数
+        """
+        self.__before_commit.append(callback)
+
+    def after_commit(self, callback):
+        """after_commit
+            * commit に成功した後に実行する処理を登録する (rollback した場合は実行しない)
+
+        Args:
+            callback(function): 引数なしで呼び出す関数
+        """
+        self.__after_commit.append(callback)
+
+    def complete(self, error):
+        """complete
+            * エラーが無ければ commit し、あれば rollback する
+
+        Args:
+            error(bool): observer でエラーが発生した場合は True
+
+        Returns:
+            bool: commit した場合は True
+        """
+        if error:
+            session.rollback()
+            return False
+
+        try:
+            for callback in self.__before_commit:
+                callback()
+            session.commit()
+        except Exception as e:
+            print(e.args)
+            session.rollback()
+            return False
+
+        self.committed = True
+        for callback in self.__after_commit:
+            callback()
+        return True
+
+    def send_replies(self):
+        """send_replies
+            * 登録されたメッセージを送信する (rollback した場合はエラーメッセージのみ送信する)
+        """
+        if self.reply_token is None:
+            return
+
+        messages = self.replies if self.committed else [TextSendMessage(text=Message.ERROR)]
+        if len(messages) == 0:
+            return
+
+        line_bot_api.reply_message(self.reply_token, messages)
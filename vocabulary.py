@@ -0,0 +1,235 @@
+"""vocabulary.py
+    * 転置インデックスの索引語(index_kana)の辞書
+    * カナのトライ木と文字 bi-gram の索引で、商品の読み仮名に対応する索引語を求める
+"""
+
+from setting import *
+from cache import LRUCache
+import threading
+
+# トライ木の終端を表すキー
+TERMINAL = ''
+
+
+class KanaVocabulary:
+    """KanaVocabulary
+        * 索引語のトライ木と bi-gram 索引を保持するクラス
+        * lazy の場合は、トライ木と bi-gram 索引を最初に使う時に作成する
+          (スナップショットの読み込み時に作成しない。完全一致のみの検索では作成しない)
+
+    Attributes:
+        terms(set): 索引語
+        trie(dict): 1文字ずつ辿るトライ木 (終端は TERMINAL キー)
+        bigrams(dict): 文字 bi-gram をキーとした索引語の集合
+        cache(:obj:LRUCache): 読み仮名をキーとした解決結果のキャッシュ
+    """
+
+    def __init__(self, terms, cache_size=CacheSize.TERM_RESOLUTION, lazy=False):
+        self.terms = set(terms)
+        self.cache = LRUCache(cache_size)
+        self.__trie = None
+        self.__bigrams = None
+        self.__lock = threading.Lock()
+
+        if not lazy:
+            self.build()
+
+    @property
+    def trie(self):
+        if self.__trie is None:
+            self.build()
+        return self.__trie
+
+    @property
+    def bigrams(self):
+        if self.__bigrams is None:
+            self.build()
+        return self.__bigrams
+
+    def build(self):
+        """build
+            * 全ての索引語からトライ木と bi-gram 索引を作成する (作成済みの場合は何もしない)
+        """
+        with self.__lock:
+            if self.__trie is not None:
+                return
+
+            trie = {}
+            bigrams = {}
+            for term in self.terms:
+                self.insert(trie, bigrams, term)
+
+            self.__bigrams = bigrams
+            self.__trie = trie
+
+    def add_term(self, term):
+        """add_term
+            * 索引語をトライ木と bi-gram 索引に追加する
+
+        Args:
+            term(str): 索引語
+        """
+        self.terms.add(term)
+        self.insert(self.trie, self.bigrams, term)
+
+        # 追加した索引語で解決結果が変わるため破棄する
+        self.cache.clear()
+
+    def insert(self, trie, bigrams, term):
+        """insert
+            * トライ木と bi-gram 索引に索引語を登録する
+
+        Args:
+            trie(dict): トライ木
+            bigrams(dict): bi-gram 索引
+            term(str): 索引語
+        """
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[TERMINAL] = True
+
+        for bigram in self.split_bigram(term):
+            bigrams.setdefault(bigram, set()).add(term)
+
+    def resolve(self, kana):
+        """resolve
+            * 読み仮名に対応する索引語を返す
+            * 完全一致 → 読み仮名に含まれる索引語 → 前方一致 → 部分一致 の順で探す
+
+        Args:
+            kana(str): 商品の読み仮名
+
+        Returns:
+            tuple: 対応する索引語 (見つからない場合は空)
+        """
+        terms = self.cache.get(kana)
+        if terms is not None:
+            return terms
+
+        terms = self.find_terms(kana)
+        self.cache.put(kana, terms)
+        return terms
+
+    def find_terms(self, kana):
+        """find_terms
+            * キャッシュを使わずに読み仮名に対応する索引語を探す
+
+        Args:
+            kana(str): 商品の読み仮名
+
+        Returns:
+            tuple: 対応する索引語
+        """
+        # 完全一致
+        if kana in self.terms:
+            return (kana,)
+
+        # 読み仮名に含まれる索引語のうち、他の索引語の一部ではないもの (ブタバラニク → ブタ, バラニク)
+        contained = self.contained_terms(kana)
+        if len(contained) != 0:
+            return tuple(sorted(
+                term for term in contained
+                if not any(term != other and term in other for other in contained)
+            ))
+
+        if len(kana) < Vocabulary.MIN_TERM_LENGTH:
+            return ()
+
+        # 読み仮名から始まる索引語 (タマゴ → タマゴヤキ)
+        prefixed = self.prefixed_terms(kana)
+        if len(prefixed) != 0:
+            return tuple(sorted(prefixed)[:Vocabulary.MAX_EXPANSION])
+
+        # 読み仮名を含む索引語
+        return tuple(sorted(self.containing_terms(kana))[:Vocabulary.MAX_EXPANSION])
+
+    def contained_terms(self, kana):
+        """contained_terms
+            * 読み仮名の部分文字列になっている索引語を返す
+
+        Args:
+            kana(str): 商品の読み仮名
+
+        Returns:
+            set: 索引語の集合
+        """
+        found = set()
+        for start in range(len(kana)):
+            node = self.trie
+            for end in range(start, len(kana)):
+                node = node.get(kana[end])
+                if node is None:
+                    break
+
+                if TERMINAL in node and end - start + 1 >= Vocabulary.MIN_TERM_LENGTH:
+                    found.add(kana[start:end + 1])
+
+        return found
+
+    def prefixed_terms(self, kana):
+        """prefixed_terms
+            * 読み仮名から始まる索引語を返す
+
+        Args:
+            kana(str): 商品の読み仮名
+
+        Returns:
+            list: 索引語のリスト
+        """
+        node = self.trie
+        for char in kana:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        found = []
+        stack = [(kana, node)]
+        while stack:
+            prefix, node = stack.pop()
+            for char, child in node.items():
+                if char == TERMINAL:
+                    found.append(prefix)
+                else:
+                    stack.append((prefix + char, child))
+
+        return found
+
+    def containing_terms(self, kana):
+        """containing_terms
+            * 読み仮名を部分文字列として含む索引語を返す
+            * bi-gram 索引で候補を絞り込んでから文字列を照合する
+
+        Args:
+            kana(str): 商品の読み仮名
+
+        Returns:
+            set: 索引語の集合
+        """
+        candidates = None
+        for bigram in self.split_bigram(kana):
+            terms = self.bigrams.get(bigram)
+            if terms is None:
+                return set()
+
+            candidates = set(terms) if candidates is None else candidates & terms
+            if len(candidates) == 0:
+                return set()
+
+        if candidates is None:
+            return set()
+
+        return {term for term in candidates if kana in term}
+
+    @staticmethod
+    def split_bigram(text):
+        """split_bigram
+            * 文字列を文字 bi-gram に分割する
+
+        Args:
+            text(str): 文字列
+
+        Returns:
+            set: bi-gram の集合
+        """
+        return {text[i:i + 2] for i in range(len(text) - 1)}
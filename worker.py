@@ -0,0 +1,279 @@
+"""worker.py
+    * webhookのイベントをワーカースレッドで処理するディスパッチャ
+    * イベントはユーザごとのレーンに振り分け、同じユーザのイベントは受信順に1件ずつ処理する
+    * 異なるユーザのイベントは共有のワーカースレッドで並行に処理する
+"""
+
+from setting import *
+import collections
+import queue
+import threading
+
+
+class EventBatch:
+    """EventBatch
+        * 1回のwebhookで受け取ったイベントの処理完了を待つためのクラス
+
+    Attributes:
+        None
+    """
+
+    def __init__(self, count):
+        self.__remaining = count
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        if count == 0:
+            self.__done.set()
+
+    def finish(self):
+        """finish
+            * イベント1件の処理完了を記録する
+        """
+        with self.__lock:
+            self.__remaining -= 1
+            if self.__remaining == 0:
+                self.__done.set()
+
+    def wait(self, timeout=None):
+        """wait
+            * 全てのイベントの処理完了を待つ
+
+        Args:
+            timeout(float): 待機する秒数 (None の場合は完了まで待つ)
+
+        Returns:
+            bool: 全て完了した場合は True
+        """
+        return self.__done.wait(timeout)
+
+
+class EventWorkerPool:
+    """EventWorkerPool
+        * ユーザごとのレーンと共有のワーカースレッドでイベントを処理するクラス
+        * 処理待ちのイベントが queue_size 件を超える場合は、受け付けたスレッドで処理する (バックプレッシャー)
+          同じユーザのイベントが処理待ちの場合は、そのレーンが空くまで受け付けたスレッドを待たせる
+
+    Attributes:
+        dispatch(function): イベントを処理する関数
+        workers(int): ワーカースレッド数
+        queue_size(int): 処理待ちにできるイベント数
+        put_timeout(float): 処理待ちの空きを待つ秒数
+    """
+
+    def __init__(self, dispatch, workers, queue_size, put_timeout):
+        self.dispatch = dispatch
+        self.workers = workers
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.__slots = threading.BoundedSemaphore(queue_size)
+        self.__lanes = {}
+        self.__ready = queue.Queue()
+        self.__threads = []
+        self.__pending = 0
+        self.__queued = 0
+        self.__lock = threading.Lock()
+        self.__idle = threading.Condition(self.__lock)
+        self.__released = threading.Condition(self.__lock)
+        self.__counts = {'enqueued': 0, 'processed': 0, 'failed': 0, 'overflow': 0, 'max_depth': 0}
+
+    def start(self):
+        """start
+            * ワーカースレッドを起動する (起動済みの場合は何もしない)
+        """
+        with self.__lock:
+            if len(self.__threads) != 0:
+                return
+
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.run, name='event-worker-' + str(number), daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+
+    def submit_all(self, events):
+        """submit_all
+            * 複数のイベントを受信順に登録する
+
+        Args:
+            events(list): webhookのイベント
+
+        Returns:
+            batch(:obj:EventBatch): 処理完了を待つためのオブジェクト
+        """
+        batch = EventBatch(len(events))
+        for event in events:
+            self.submit(event, batch)
+
+        return batch
+
+    def submit(self, event, batch=None):
+        """submit
+            * イベントをユーザのレーンに登録する
+            * 処理待ちが一杯のまま put_timeout 秒経過した場合は、そのユーザのレーンの処理が終わるのを待ってから
+              呼び出し元のスレッドで処理する (処理待ちは queue_size 件を超えない)
+
+        Args:
+            event(obj): webhookのイベント
+            batch(:obj:EventBatch): 処理完了を通知するオブジェクト
+
+        Returns:
+            bool: レーンに登録した場合は True
+        """
+        self.start()
+        key = self.lane_key(event)
+        acquired = self.__slots.acquire(timeout=self.put_timeout)
+
+        with self.__lock:
+            self.__pending += 1
+
+            if acquired:
+                self.__queued += 1
+                self.__counts['max_depth'] = max(self.__counts['max_depth'], self.__queued)
+                self.__counts['enqueued'] += 1
+
+                # 処理中 / 処理待ちのレーンがあるユーザは、順序を守るため必ずレーンの末尾に追加する
+                lane = self.__lanes.get(key)
+                if lane is not None:
+                    lane.append((event, batch, acquired))
+                else:
+                    self.__lanes[key] = collections.deque([(event, batch, acquired)])
+                    self.__ready.put(key)
+                return True
+
+            # 処理待ちが一杯の場合は、先に受け付けたイベントを追い越さないようにレーンが空くのを待ち、
+            # 空のレーンを確保して呼び出し元のスレッドで処理する
+            self.__counts['overflow'] += 1
+            self.__released.wait_for(lambda: key not in self.__lanes)
+            self.__lanes[key] = collections.deque()
+
+        self.process(event, batch, acquired)
+        self.release_lane(key)
+        return False
+
+    def run(self):
+        """run
+            * ワーカースレッドのメイン処理 (準備のできたレーンから1件ずつ処理する)
+        """
+        while True:
+            key = self.__ready.get()
+            if key is None:
+                return
+
+            with self.__lock:
+                event, batch, acquired = self.__lanes[key].popleft()
+
+            self.process(event, batch, acquired)
+            self.release_lane(key)
+
+    def release_lane(self, key):
+        """release_lane
+            * レーンの処理権を手放す (残りのイベントがあれば再度準備完了にする)
+
+        Args:
+            key(str): レーンのキー
+        """
+        with self.__lock:
+            if len(self.__lanes[key]) != 0:
+                self.__ready.put(key)
+            else:
+                del self.__lanes[key]
+                self.__released.notify_all()
+
+    def process(self, event, batch, acquired):
+        """process
+            * イベントを処理し、スレッドのDBセッションを破棄する
+
+        Args:
+            event(obj): webhookのイベント
+            batch(:obj:EventBatch): 処理完了を通知するオブジェクト
+            acquired(bool): 処理待ちの枠を確保している場合は True
+        """
+        try:
+            self.dispatch(event)
+            self.count('processed')
+        except Exception as e:
+            print(e.args)
+            self.count('failed')
+        finally:
+            session.remove()
+            if batch is not None:
+                batch.finish()
+
+            with self.__lock:
+                if acquired:
+                    self.__queued -= 1
+                    self.__slots.release()
+                self.__pending -= 1
+                if self.__pending == 0:
+                    self.__idle.notify_all()
+
+    def drain(self, timeout=None):
+        """drain
+            * 処理待ちのイベントが無くなるまで待つ
+
+        Args:
+            timeout(float): 待機する秒数 (None の場合は無くなるまで待つ)
+
+        Returns:
+            bool: 処理待ちが無くなった場合は True
+        """
+        with self.__lock:
+            return self.__idle.wait_for(lambda: self.__pending == 0, timeout)
+
+    def shutdown(self, timeout=None):
+        """shutdown
+            * 処理待ちのイベントを処理してからワーカースレッドを停止する
+
+        Args:
+            timeout(float): 処理待ちを待機する秒数
+        """
+        self.drain(timeout)
+
+        with self.__lock:
+            threads = self.__threads
+            self.__threads = []
+
+        for thread in threads:
+            self.__ready.put(None)
+        for thread in threads:
+            thread.join()
+
+    def count(self, name):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    def stats(self):
+        """stats
+            * 処理待ちの状態と処理件数を返す
+
+        Returns:
+            dict: 処理件数
+        """
+        with self.__lock:
+            stats = dict(self.__counts)
+            stats['queue_depth'] = self.__queued
+            stats['pending'] = self.__pending
+            stats['lanes'] = len(self.__lanes)
+            stats['workers'] = len(self.__threads)
+
+        stats['queue_size'] = self.queue_size
+        return stats
+
+    @staticmethod
+    def lane_key(event):
+        """lane_key
+            * イベントを振り分けるレーンのキーを返す (ユーザID / グループID / トークルームID)
+
+        Args:
+            event(obj): webhookのイベント
+
+        Returns:
+            str: レーンのキー
+        """
+        source = getattr(event, 'source', None)
+        for name in ('user_id', 'group_id', 'room_id'):
+            value = getattr(source, name, None)
+            if value:
+                return value
+
+        # 送信元が無いイベントは1件ずつ独立したレーンで処理する
+        return 'event-' + str(id(event))
@@ -0,0 +1,15 @@
+"""wsgi.py
+    * 本番環境用の WSGI エントリポイント
+    * gunicorn -c gunicorn.conf.py wsgi:app で起動する (開発時は python callback.py)
+    * preload_app のため、マスタープロセスで転置インデックスを読み込み、fork したワーカーとメモリを共有する
+"""
+
+from setting import *
+from callback import app, prepare
+
+# 転置インデックスの事前読み込み
+prepare()
+
+# 読み込みに使用したコネクションは fork 前に閉じる (ワーカーと同じソケットを共有しないため)
+session.remove()
+ENGINE.dispose()